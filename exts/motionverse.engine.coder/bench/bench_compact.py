@@ -0,0 +1,67 @@
+# Compact frame encoding (scripts/compact.py): bytes per frame for the keyframe/delta mix, encode
+# and decode cost next to parsing a raw frame, and the error the quantization adds, measured
+# as the angle between sent and decoded joint rotations and the largest face weight difference.
+# Frames are procedural (as bench/stream_server.py sends them) or looped from a raw capture.
+#
+#   python bench/bench_compact.py [--frames 2000] [--capture take.mvcap] [--keyframe-interval 30]
+import argparse
+
+from common import *
+
+from scripts.constants import COMPACT_KEYFRAME_INTERVAL
+from scripts.compact import CompactEncoder, CompactDecoder, ROOT_JOINT
+from scripts.frames import FRAME_SIZE_V2, FrameDetections
+from stream_server import ProceduralFrames, CaptureFrames
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=60.0)
+    parser.add_argument("--capture", help="raw capture to encode instead of procedural frames")
+    parser.add_argument("--keyframe-interval", type=int, default=COMPACT_KEYFRAME_INTERVAL)
+    args = parser.parse_args()
+
+    frames = CaptureFrames(args.capture) if args.capture else ProceduralFrames(args.rate)
+    encoder = CompactEncoder(args.keyframe_interval)
+    decoder = CompactDecoder()
+    out = bytearray(FRAME_SIZE_V2)
+    fd = FrameDetections()
+    raw = FrameDetections()
+
+    encoding = Timings("encode")
+    decoding = Timings("decode")
+    parsing = Timings("parse raw frame")
+    total_bytes = 0
+    angles = []
+    face_error = 0.0
+    root_error = 0.0
+    for i in range(args.frames):
+        record = frames(i)
+        faces = record["faces"][0]
+        body = record["body"][0]
+        message = encoding.time(encoder.encode, faces, body, i, i / args.rate)
+        total_bytes += len(message)
+        decoding.time(decoder.decode, message, out)
+        parsing.time(raw.ParseFromString, record.tobytes())
+        fd.ParseFromString(out)
+
+        sent = body[:, :4] / np.linalg.norm(body[:, :4], axis=1, keepdims=True)
+        dot = np.abs(np.einsum("ij,ij->i", sent, fd.body_data[:, :4]))
+        angles.append(2 * np.degrees(np.arccos(np.minimum(dot, 1.0))))
+        face_error = max(face_error, np.abs(np.clip(faces, 0, 1) - fd.faces).max())
+        root_error = max(root_error, np.abs(body[ROOT_JOINT, 4:7] - fd.body_data[ROOT_JOINT, 4:7]).max())
+
+    encoding.report()
+    decoding.report()
+    parsing.report()
+    angles = np.concatenate(angles)
+    print("keyframes %d  deltas %d  %.1f B/frame (raw %d B)"
+          % (encoder.keyframes, encoder.deltas, total_bytes / args.frames, FRAME_SIZE_V2))
+    print("rotation error  mean %.4f deg  p99 %.4f deg  max %.4f deg"
+          % (angles.mean(), np.percentile(angles, 99), angles.max()))
+    print("face error max %.4f  root error max %.2e" % (face_error, root_error))
+
+
+if __name__ == "__main__":
+    main()
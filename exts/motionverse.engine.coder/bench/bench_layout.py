@@ -0,0 +1,156 @@
+# Partial-body streams (scripts/frames.py FrameLayout): for each of bench/stream_server.py's
+# layouts, the bytes per frame and the receive-side cost of parse, the compiled body and face
+# gathers and the solve on a shipped avatar, next to the full layout.
+#
+# Every frame is also solved from the full frame it was cut from; joints and face channels the
+# layout carries have to come out the same, and the root translation too where the layout has
+# the root position. Any difference above the tolerance fails the run, as does a layout that
+# doesn't come back the same, frame size included, through its layout message.
+#
+# Last, a SolverWorker solves full, body and full frames again, restarted across each layout
+# change the way a session does it; its poses have to match the same golden solves.
+#
+#   python bench/bench_layout.py [--frames 2000] [--avatar NanKeFu] [--layouts full body upper face]
+import argparse
+import json
+
+from common import *
+
+from scripts.driver import SkeletonDriver
+from scripts.frames import LAYOUT_POSITIONS_NONE, FULL_LAYOUT, FrameDetections
+from scripts.protocol import build_layout, parse_layout
+from scripts.worker import SolverWorker
+from bench_pipeline import RIG_FILE, synthetic_frames, quat_error
+from stream_server import LAYOUTS, LayoutEncoder
+
+
+def init_driver(name, rig_mapping, layout):
+    stage, skeleton = open_avatar_stage(name)
+    driver = SkeletonDriver(stage, skeleton, rig_mapping, UsdSkel.Cache())
+    driver.init_animation(layout.joint_names, layout)
+    return driver
+
+
+class WorkerSession:
+    # what a SolverWorker reads from its StreamSession
+    def __init__(self, drivers):
+        self.name = "bench"
+        self.metrics = None
+        self.layout = FULL_LAYOUT
+        self.drivers = drivers
+
+    def _frame_time(self, fd, arrival_time):
+        return arrival_time
+
+
+def solve_on_worker(avatar, rig_mapping, frames, names, frames_per_layout=8):
+    # worst pose difference to the golden solves, or None once the worker stops solving; more
+    # frames per layout than the worker has buffers, so every buffer sees each layout
+    driver = init_driver(avatar, rig_mapping, FULL_LAYOUT)
+    session = WorkerSession([driver])
+    worker = SolverWorker(session)
+    worst = 0.0
+    try:
+        for name in names:
+            layout = LAYOUTS[name]
+            # as StreamSession._set_layout: the same worker, stopped while the drivers change
+            worker.stop()
+            driver.init_animation(layout.joint_names, layout)
+            session.layout = layout
+            worker.start()
+            reference = init_driver(avatar, rig_mapping, layout)
+            encoder = LayoutEncoder(layout)
+            fd = FrameDetections(layout)
+            for i, values in enumerate(frames[:frames_per_layout]):
+                message = encoder.encode(values[:51], values[51:].reshape(-1, 7), i, i / 60.0)
+                worker.submit(message)
+                deadline = time.perf_counter() + 5.0
+                solved = worker.take()
+                while solved is None and worker.alive and time.perf_counter() < deadline:
+                    time.sleep(0.0005)
+                    solved = worker.take()
+                if solved is None:
+                    return None
+                fd.ParseFromString(message)
+                for out, expected in zip(solved.poses[0], reference.solve(fd)):
+                    if expected is not None:
+                        worst = max(worst, np.abs(out - expected).max())
+    finally:
+        worker.stop()
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--avatar", choices=sorted(AVATARS), default="NanKeFu")
+    parser.add_argument("--layouts", nargs="+", choices=sorted(LAYOUTS), default=["full", "body", "upper", "face"])
+    parser.add_argument("--tolerance", type=float, default=1e-6)
+    args = parser.parse_args()
+
+    with open(RIG_FILE) as rig_file:
+        rig_mapping = json.load(rig_file)
+    rng = np.random.default_rng(0)
+    messages = synthetic_frames(rng, args.frames)
+    frames = [np.frombuffer(message, dtype=np.float32) for message in messages]
+
+    reference = init_driver(args.avatar, rig_mapping, FULL_LAYOUT)
+    full_fd = FrameDetections()
+    failed = False
+    for name in args.layouts:
+        layout = LAYOUTS[name]
+        round_trip = parse_layout(build_layout(layout))
+        message_kept = round_trip == layout and round_trip.frame_size == layout.frame_size
+        encoder = LayoutEncoder(layout)
+        driver = init_driver(args.avatar, rig_mapping, layout)
+        fd = FrameDetections(layout)
+        shared = [
+            (driver.motion_to_anim_index[motion], index) for motion, index in reference.motion_to_anim_index.items()
+            if motion in driver.motion_to_anim_index
+        ]
+        anim_rows, reference_rows = np.array(shared, dtype=np.intp).T
+        carried = np.isin(driver.face_channels, layout.face_names)
+
+        receive = Timings("%s parse + gather + solve" % name)
+        worst_rotation = worst_translation = worst_face = 0.0
+        for i, values in enumerate(frames):
+            faces, body = values[:51], values[51:].reshape(-1, 7)
+            message = encoder.encode(faces, body, i, i / 60.0)
+
+            def solve():
+                fd.ParseFromString(message)
+                return driver.solve(fd)
+
+            rotations, root_translation, face_weights = receive.time(solve)
+            full_fd.ParseFromString(messages[i])
+            ref_rotations, ref_translation, ref_weights = reference.solve(full_fd)
+            worst_rotation = max(worst_rotation, quat_error(rotations[anim_rows], ref_rotations[reference_rows]))
+            if layout.positions != LAYOUT_POSITIONS_NONE:
+                worst_translation = max(worst_translation, np.abs(root_translation - ref_translation).max())
+            if face_weights is not None:
+                worst_face = max(worst_face, np.abs(face_weights[carried] - ref_weights[carried]).max(initial=0.0))
+                assert not face_weights[~carried].any()
+
+        receive.report()
+        passed = message_kept and max(worst_rotation, worst_translation, worst_face) <= args.tolerance
+        failed = failed or not passed
+        print("    %d B/frame, %d of %d anim joints, %d of %d blend shapes; golden %s: layout message %s, "
+              "rotation %.2e, translation %.2e, faces %.2e"
+              % (layout.frame_size, len(driver.motion_to_anim_index), len(reference.motion_to_anim_index),
+                 carried.sum(), len(carried), "ok" if passed else "FAILED", "kept" if message_kept else "changed",
+                 worst_rotation, worst_translation, worst_face))
+
+    names = ["full", "body", "full"]
+    worst = solve_on_worker(args.avatar, rig_mapping, frames, names)
+    passed = worst is not None and worst <= args.tolerance
+    failed = failed or not passed
+    print("solver thread, %s: golden %s: %s" % (
+        " -> ".join(names), "ok" if passed else "FAILED",
+        "worker stopped solving" if worst is None else "max pose difference %.2e" % worst
+    ))
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
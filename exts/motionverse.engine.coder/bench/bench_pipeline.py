@@ -0,0 +1,115 @@
+# Runs the receive-side pipeline headless on the shipped avatars: decode (FrameDetections),
+# solve (gather + PoseSolver) and author (AnimationWriter stage + commit), with per-stage
+# p50/p99 and throughput. Frames are synthetic, or read from a raw capture.
+#
+# Every frame is also checked against the reference paths: the struct-based decode and the
+# per-joint Gf solver (GfPoseSolver). Any difference above the tolerance fails the run.
+#
+#   python bench/bench_pipeline.py [--frames 5000] [--capture take.mvcap] [--tolerance 1e-5]
+import argparse
+import json
+import struct
+
+from common import *
+
+from scripts.capture import CaptureReader
+from scripts.driver import SkeletonDriver
+from scripts.frames import FRAME_SIZE, NUM_BODY_JOINTS, NUM_FACE_CHANNELS, BODY_CHANNELS, FrameDetections
+from scripts.solver import GfPoseSolver
+
+RIG_FILE = os.path.join(EXT_ROOT, "motionverse", "engine", "coder", "scripts", "xform_generic.json")
+
+
+def synthetic_frames(rng, count):
+    body = np.empty((count, NUM_BODY_JOINTS, BODY_CHANNELS), dtype=np.float32)
+    body[:, :, :4] = random_unit_quats(rng, count, NUM_BODY_JOINTS)
+    body[:, :, 4:] = rng.normal(scale=0.2, size=(count, NUM_BODY_JOINTS, 3))
+    faces = rng.uniform(size=(count, NUM_FACE_CHANNELS)).astype(np.float32)
+    return [faces[i].tobytes() + body[i].tobytes() for i in range(count)]
+
+
+def captured_frames(path, count):
+    reader = CaptureReader(path)
+    return [bytes(reader.frame(i % len(reader))) for i in range(count)]
+
+
+def reference_decode(message):
+    # the version 1 payload; version 2 frames only prefix it with a header
+    values = struct.unpack("%df" % (FRAME_SIZE // 4), message[-FRAME_SIZE:])
+    return np.array(values[:NUM_FACE_CHANNELS]), np.array(values[NUM_FACE_CHANNELS:]).reshape(-1, BODY_CHANNELS)
+
+
+def quat_error(a, b):
+    # q and -q are the same rotation
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    return np.minimum(np.abs(a - b).max(axis=1), np.abs(a + b).max(axis=1)).max()
+
+
+def run_avatar(name, rig_mapping, messages, tolerance):
+    stage, skeleton = open_avatar_stage(name)
+    driver = SkeletonDriver(stage, skeleton, rig_mapping, UsdSkel.Cache())
+    fd = FrameDetections()
+
+    init = Timings("init_animation")
+    init.time(driver.init_animation, fd.body_pose_names)
+    solver = driver.pose_solver
+    writer = driver.anim_writer
+    reference = GfPoseSolver(
+        driver.anim_topology, driver.rest_xforms_anim_global, driver.rest_xform_adjust,
+        solver.motion_indices, solver.root_index,
+    )
+
+    decode = Timings("decode")
+    solve = Timings("gather + solve")
+    faces = Timings("face gather")
+    author = Timings("author (stage + commit)")
+    total = Timings("frame total")
+    worst_rotation = worst_translation = 0.0
+    decode_mismatches = 0
+
+    for message in messages:
+        start = time.perf_counter()
+        decode.time(fd.ParseFromString, message)
+        block = solve.time(lambda: solver.solve(fd.gather_body(solver.motion_indices, solver.body_block)))
+        weights = faces.time(fd.gather_faces, driver.face_indices, driver.face_weights)
+        author.time(lambda: (writer.stage(block[0], block[1], weights), writer.commit()))
+        total.samples.append(time.perf_counter() - start)
+
+        ref_faces, ref_body = reference_decode(message)
+        if not (np.array_equal(fd.faces, ref_faces) and np.array_equal(fd.body_data, ref_body)):
+            decode_mismatches += 1
+        ref_rotations, ref_translation = reference.solve_vt(ref_body[solver.motion_indices])
+        worst_rotation = max(worst_rotation, quat_error(block[0], ref_rotations))
+        worst_translation = max(worst_translation, np.abs(np.asarray(block[1]) - np.array(ref_translation)).max())
+
+    print("%s (%d anim joints, %d blend shapes, %d frames)"
+          % (name, len(solver.motion_indices), len(driver.face_indices), len(messages)))
+    for timings in (init, decode, solve, faces, author, total):
+        timings.report()
+    passed = decode_mismatches == 0 and worst_rotation <= tolerance and worst_translation <= tolerance
+    print("    golden %s: decode mismatches %d, max rotation error %.2e, max translation error %.2e"
+          % ("ok" if passed else "FAILED", decode_mismatches, worst_rotation, worst_translation))
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=5000)
+    parser.add_argument("--capture", help="raw capture to replay instead of synthetic frames")
+    parser.add_argument("--tolerance", type=float, default=1e-5)
+    args = parser.parse_args()
+
+    with open(RIG_FILE) as rig_file:
+        rig_mapping = json.load(rig_file)
+    if args.capture:
+        messages = captured_frames(args.capture, args.frames)
+    else:
+        messages = synthetic_frames(np.random.default_rng(0), args.frames)
+
+    passed = [run_avatar(name, rig_mapping, messages, args.tolerance) for name in AVATARS]
+    sys.exit(0 if all(passed) else 1)
+
+
+if __name__ == "__main__":
+    main()
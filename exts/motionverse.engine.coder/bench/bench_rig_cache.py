@@ -0,0 +1,88 @@
+# Compiled rigs (scripts/rig_cache.py): the cost of initializing a driver without a cache,
+# with a cold CompiledRigCache and with a warm one (the same skeleton selected again, or in a
+# new Kit session through the cache directory), and the first streamed frame against the
+# ones after it once the driver was initialized at selection time.
+#
+# The rest pose has to stay the same through repeated initialization with every layout of
+# bench/stream_server.py, and poses solved through the cache have to match the uncached ones;
+# otherwise the run fails.
+#
+#   python bench/bench_rig_cache.py [--repeat 20] [--avatar NanKeFu] [--frames 200]
+import argparse
+import json
+import shutil
+import tempfile
+
+from common import *
+
+from scripts.driver import SkeletonDriver
+from scripts.frames import FULL_LAYOUT, FrameDetections
+from scripts.rig_cache import CompiledRigCache
+from bench_pipeline import RIG_FILE, synthetic_frames
+from stream_server import LAYOUTS
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--avatar", choices=sorted(AVATARS), default="NanKeFu")
+    parser.add_argument("--frames", type=int, default=200)
+    args = parser.parse_args()
+
+    with open(RIG_FILE) as rig_file:
+        rig_mapping = json.load(rig_file)
+    messages = synthetic_frames(np.random.default_rng(0), args.frames)
+    directory = tempfile.mkdtemp()
+    failed = False
+    try:
+        def init(label, compiled_rigs_factory):
+            timings = Timings(label)
+            for _ in range(args.repeat):
+                stage, skeleton = open_avatar_stage(args.avatar)
+                driver = SkeletonDriver(stage, skeleton, rig_mapping, UsdSkel.Cache(),
+                                        compiled_rigs=compiled_rigs_factory())
+                timings.time(driver.init_animation, FULL_LAYOUT.joint_names, FULL_LAYOUT)
+            timings.report()
+            return driver
+
+        reference = init("init, no cache", lambda: None)
+        init("init, cold cache", lambda: CompiledRigCache())
+        init("init, cache directory", lambda: CompiledRigCache(directory))
+        shared = CompiledRigCache()
+        driver = init("init, warm cache", lambda: shared)
+
+        # repeated initialization with every layout leaves the rest pose as the first one made it
+        rest = np.array(driver.skeleton.GetRestTransformsAttr().Get())
+        for name in sorted(LAYOUTS) * 2:
+            layout = LAYOUTS[name]
+            driver.init_animation(layout.joint_names, layout)
+        driver.init_animation(FULL_LAYOUT.joint_names, FULL_LAYOUT)
+        idempotent = np.array_equal(rest, np.array(driver.skeleton.GetRestTransformsAttr().Get()))
+
+        first = Timings("first frame")
+        later = Timings("later frames")
+        fd = FrameDetections()
+        worst = 0.0
+        for i, message in enumerate(messages):
+            fd.ParseFromString(message)
+            (first if i == 0 else later).time(driver.apply, fd)
+            rotations, root_translation = reference.solve(fd)[:2]
+            worst = max(
+                worst, np.abs(driver.rotations - rotations).max(),
+                np.abs(driver.root_translation - root_translation).max(),
+            )
+            driver.commit()
+        first.report()
+        later.report()
+        passed = idempotent and worst == 0.0
+        failed = not passed
+        print("golden %s: rest pose kept %s, max pose difference %.2e, cache hits %d, misses %d"
+              % ("ok" if passed else "FAILED", idempotent, worst, shared.hits, shared.misses))
+    finally:
+        shutil.rmtree(directory)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Rig profile selection over a synthetic catalog: the original get_rig_index scan (list
+# membership for every mapped joint of every profile) versus RigRegistry, whose joint index is
+# built once when the profiles are loaded.
+#
+#   python bench/bench_rig_match.py [--profiles 60] [--extra-joints 400] [--iterations 200]
+import argparse
+import json
+
+from common import *
+
+from scripts.rigs import RigRegistry
+
+RIG_FILE = os.path.join(EXT_ROOT, "motionverse", "engine", "coder", "scripts", "xform_generic.json")
+
+
+def legacy_get_rig_index(model_joint_names, rig_mappings):
+    candidates = [mapping["joint_mappings"].keys() for mapping in rig_mappings]
+    index = None
+
+    for i in range(len(candidates)):
+        if all([(joint in model_joint_names) for joint in candidates[i]]):
+            index = i
+    return index
+
+
+def make_catalog(base, count, rng):
+    # renamed copies of the shipped profile (DCC naming schemes), some dropping the fingers
+    schemes = ["Bip01_%s", "%s_jnt", "DEF-%s", "CC_Base_%s", "%s_bind", "rig_%s"]
+    catalog = []
+    for i in range(count - 1):
+        scheme = schemes[i % len(schemes)]
+        tag = "v%d_" % i
+        joints = list(base["joint_mappings"].items())
+        if rng.random() < 0.5:
+            joints = [(key, value) for key, value in joints if "Hand" not in key or key.endswith("Hand")]
+        catalog.append({
+            "display_name": "Synthetic %d" % i,
+            "joint_mappings": {scheme % (tag + key): value for key, value in joints},
+        })
+    catalog.append(base)
+    return catalog
+
+
+def make_skeleton_names(base, extra, namespace):
+    # the shipped profile's joints plus helper/twist/face joints, as found on production rigs
+    names = list(base["joint_mappings"]) + ["Helper%03d" % i for i in range(extra)]
+    return [namespace + name for name in names]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profiles", type=int, default=60)
+    parser.add_argument("--extra-joints", type=int, default=400)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    with open(RIG_FILE) as rig_file:
+        base = json.load(rig_file)
+    catalog = make_catalog(base, args.profiles, rng)
+
+    build = Timings("RigRegistry build")
+    for _ in range(args.iterations):
+        registry = build.time(RigRegistry, catalog)
+    print("%d profiles" % len(catalog))
+    build.report()
+
+    for namespace in ("", "mixamorig:"):
+        names = make_skeleton_names(base, args.extra_joints, namespace)
+        print("skeleton: %d joints, namespace %r" % (len(names), namespace))
+        legacy = Timings("legacy get_rig_index")
+        for _ in range(args.iterations):
+            legacy_index = legacy.time(legacy_get_rig_index, names, catalog)
+        legacy.report()
+        indexed = Timings("RigRegistry.match")
+        for _ in range(args.iterations):
+            match = indexed.time(registry.match, names)
+        indexed.report()
+        print("    legacy -> %s, registry -> %s" % (legacy_index, match))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# One-Euro pose smoothing (scripts/smoothing.py) over growing joint counts: the vectorized
+# PoseFilter against a per-joint Python loop of scalar One-Euro filters, which is what
+# smoothing joint by joint would cost. Both see the same noisy rotation stream; their outputs
+# are compared as a correctness check.
+#
+#   python bench/bench_smoothing.py [--frames 600] [--joints 16 52 128 512]
+import argparse
+import math
+
+from common import *
+
+from scripts.constants import DEFAULT_SMOOTHING
+from scripts.smoothing import PoseFilter, smoothing_alpha
+
+
+class ScalarOneEuro:
+    # textbook single-row One-Euro filter
+    def __init__(self, min_cutoff, beta, d_cutoff):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.value = None
+        self.derivative = None
+        self.time = None
+
+    def __call__(self, x, t):
+        if self.value is None:
+            self.value = list(x)
+            self.derivative = [0.0] * len(x)
+            self.time = t
+            return self.value
+        dt = t - self.time
+        self.time = t
+        a_d = smoothing_alpha(self.d_cutoff, dt)
+        self.derivative = [d + a_d * ((xi - v) / dt - d) for d, xi, v in zip(self.derivative, x, self.value)]
+        cutoff = self.min_cutoff + self.beta * math.sqrt(sum(d * d for d in self.derivative))
+        a = smoothing_alpha(cutoff, dt)
+        self.value = [v + a * (xi - v) for v, xi in zip(self.value, x)]
+        return self.value
+
+
+def noisy_stream(rng, frames, num_joints, rate):
+    # slow rotations about random axes plus measurement noise, with random solver sign flips
+    axes = rng.normal(size=(num_joints, 3))
+    axes /= np.linalg.norm(axes, axis=1, keepdims=True)
+    t = np.arange(frames)[:, None] / rate
+    half_angles = 0.4 * np.sin(2 * np.pi * 0.5 * t + rng.uniform(0, 2 * np.pi, num_joints))
+    quats = np.empty((frames, num_joints, 4))
+    quats[..., :3] = axes * np.sin(half_angles)[..., None]
+    quats[..., 3] = np.cos(half_angles)
+    quats += rng.normal(scale=0.01, size=quats.shape)
+    quats /= np.linalg.norm(quats, axis=2, keepdims=True)
+    quats *= np.where(rng.uniform(size=(frames, num_joints, 1)) < 0.1, -1.0, 1.0)
+    return quats.astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--joints", type=int, nargs="+", default=[16, 52, 128, 512])
+    parser.add_argument("--rate", type=float, default=60.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    body = DEFAULT_SMOOTHING["body"]
+    for num_joints in args.joints:
+        stream = noisy_stream(rng, args.frames, num_joints, args.rate)
+        root = np.zeros(3, dtype=np.float32)
+        motion_to_anim_index = {"joint%d" % i: i for i in range(num_joints)}
+        # every joint in the body group, so the scalar reference uses one parameter set
+        pose_filter = PoseFilter(motion_to_anim_index, -1, DEFAULT_SMOOTHING)
+        scalar = [ScalarOneEuro(body["min_cutoff"], body["beta"], body["d_cutoff"]) for _ in range(num_joints)]
+
+        vectorized = Timings("PoseFilter %d joints" % num_joints)
+        looped = Timings("per-joint loop %d joints" % num_joints)
+        worst = 0.0
+        for i, rotations in enumerate(stream):
+            t = i / args.rate
+            smoothed = vectorized.time(pose_filter.filter, rotations, root, t)[0]
+
+            def loop():
+                out = np.empty((num_joints, 4))
+                for j, joint_filter in enumerate(scalar):
+                    q = rotations[j].tolist()
+                    if joint_filter.value is not None and sum(a * b for a, b in zip(q, joint_filter.value)) < 0:
+                        q = [-c for c in q]
+                    out[j] = joint_filter(q, t)
+                return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+            reference = looped.time(loop)
+            worst = max(worst, np.abs(smoothed - reference).max())
+        vectorized.report()
+        looped.report()
+        print("    max difference %.2e" % worst)
+
+
+if __name__ == "__main__":
+    main()
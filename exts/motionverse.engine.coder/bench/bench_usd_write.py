@@ -0,0 +1,66 @@
+# Compares the per-frame cost of pushing a pose into a UsdSkel.Animation with the original
+# read-modify-write path versus AnimationWriter (cached attributes, local translations and one
+# Sdf.ChangeBlock per frame).
+#
+#   python bench/bench_usd_write.py [--frames 2000]
+import argparse
+
+from common import *
+
+from pxr import Gf, Tf, Vt
+from scripts.writer import AnimationWriter
+
+
+def legacy_write(skel_anim, root_index, rotations, root_translation):
+    local_translations_attr = skel_anim.GetTranslationsAttr()
+    local_translations = local_translations_attr.Get(0)
+    local_translations[root_index] = Gf.Vec3f(*root_translation.tolist())
+    local_translations_attr.Set(local_translations, 0)
+    skel_anim.GetRotationsAttr().Set(Vt.QuatfArray.FromNumpy(rotations), 0)
+
+
+def make_animation(stage, skeleton):
+    joints = skeleton.GetJointsAttr().Get()
+    skel_anim = UsdSkel.Animation.Define(stage, skeleton.GetPath().AppendChild("MotionverseBench"))
+    skel_anim.GetJointsAttr().Set(joints)
+    skel_anim.SetTransforms(skeleton.GetRestTransformsAttr().Get(), 0)
+    UsdSkel.BindingAPI.Apply(skeleton.GetPrim()).CreateAnimationSourceRel().SetTargets([skel_anim.GetPath()])
+    return skel_anim, len(joints)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=2000)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    for name in AVATARS:
+        stage, skeleton = open_avatar_stage(name)
+        skel_anim, num_joints = make_animation(stage, skeleton)
+        rotations = random_unit_quats(rng, args.frames, num_joints)
+        translations = rng.normal(size=(args.frames, 3)).astype(np.float32)
+
+        notices = [0]
+        listener = Tf.Notice.Register(
+            Usd.Notice.ObjectsChanged, lambda notice, sender: notices.__setitem__(0, notices[0] + 1), stage
+        )
+
+        print("%s (%d joints)" % (name, num_joints))
+        legacy = Timings("legacy Get/Set")
+        for i in range(args.frames):
+            legacy.time(legacy_write, skel_anim, 0, rotations[i], translations[i])
+        legacy.report()
+        print("    notices/frame %.1f" % (notices[0] / args.frames))
+
+        notices[0] = 0
+        writer = AnimationWriter(skel_anim, 0)
+        cached = Timings("AnimationWriter")
+        for i in range(args.frames):
+            cached.time(writer.write, rotations[i], translations[i])
+        cached.report()
+        print("    notices/frame %.1f" % (notices[0] / args.frames))
+        listener.Revoke()
+
+
+if __name__ == "__main__":
+    main()
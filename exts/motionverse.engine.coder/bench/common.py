@@ -0,0 +1,52 @@
+# Shared helpers for the headless benchmarks. These only need numpy and pxr (usd-core);
+# the extension's pure modules are imported as the top level `scripts` package so that the
+# Kit-only package __init__ is never executed.
+import os
+import sys
+import time
+
+import numpy as np
+
+EXT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(EXT_ROOT, "motionverse", "engine", "coder"))
+
+from pxr import Usd, UsdSkel
+
+AVATARS = {
+    "NanKeFu": os.path.join(EXT_ROOT, "data", "NanKeFu", "NanKeFu.skel.usd"),
+    "XiaoMeng": os.path.join(EXT_ROOT, "data", "XiaoMeng", "XiaoMeng.skel.usd"),
+}
+
+
+def open_avatar_stage(name):
+    # in-memory root layer sublayering the shipped asset, so authoring never touches the file
+    stage = Usd.Stage.CreateInMemory()
+    stage.GetRootLayer().subLayerPaths.append(AVATARS[name])
+    skeleton = next(UsdSkel.Skeleton(prim) for prim in stage.Traverse() if prim.IsA(UsdSkel.Skeleton))
+    return stage, skeleton
+
+
+def random_unit_quats(rng, count, num_joints):
+    quats = rng.normal(size=(count, num_joints, 4)).astype(np.float32)
+    quats /= np.linalg.norm(quats, axis=2, keepdims=True)
+    return quats
+
+
+class Timings:
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+
+    def time(self, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.samples.append(time.perf_counter() - start)
+        return result
+
+    def report(self):
+        samples = np.array(self.samples) * 1e6
+        print(
+            "%-28s n=%-6d mean %8.1f us  p50 %8.1f us  p99 %8.1f us  %9.0f /s"
+            % (self.name, len(samples), samples.mean(), np.percentile(samples, 50),
+               np.percentile(samples, 99), 1e6 / samples.mean())
+        )
@@ -0,0 +1,483 @@
+# Stand-in for the Motionverse engine: accepts the b"ov" handshake and streams valid frames,
+# either procedurally animated or looped from a raw capture (see scripts/capture.py), to every
+# connected client at a fixed rate with optional jitter and bursts. Reports the achieved send
+# rate and each client's backlog (bytes queued in the socket that the client has not read yet).
+#
+# Clients that ask for protocol version 2 get an ack and frames with a sequence number and send
+# time; --protocol 1 behaves like an old server that ignores the request. Clients that offer
+# the compact encoding get it unless --no-compact is given. --layout streams only part of the
+# channels to clients that take a frame layout (the extension always offers to), in place of
+# the compact encoding.
+#
+# The same port also serves UDP: a handshake datagram registers the sender, which then gets one
+# version 2 frame per datagram until its keepalives stop. --loss and --reorder drop or swap
+# datagrams to stand in for a bad network.
+#
+# With --clients N it also runs N receivers in-process on the extension's own transport and
+# frame queue, which makes it a load generator for the client path on a plain Linux box.
+# Version 1 frames carry their send time in the unused 52nd pose row so receivers can still
+# report latency.
+#
+#   python bench/stream_server.py [--port 4188] [--rate 60] [--capture take.mvcap] [--protocol 2]
+#                                 [--jitter-ms 2] [--burst 5 --burst-every 2]
+#                                 [--loss 0.05 --reorder 0.02]
+#                                 [--clients 4] [--policy block] [--transport udp] [--compact]
+#                                 [--layout body]
+#                                 [--duration 10]
+import argparse
+import asyncio
+import random
+
+from common import *
+
+from scripts.constants import (
+    DEFAULT_PORT, QUEUE_POLICIES, DEFAULT_QUEUE_SIZE, PROTOCOL_VERSION, PROTOCOL_FLAG_COMPACT, PROTOCOL_FLAG_LAYOUT,
+    TRANSPORTS, TRANSPORT_UDP, DATAGRAM_TIMEOUT
+)
+from scripts.compact import COMPACT_HEADER, COMPACT_DELTA_DTYPE, CompactEncoder
+from scripts.capture import CaptureReader
+from scripts.frames import (
+    BODY_POSE_NAMES, FACE_CHANNEL_NAMES, FRAME_DTYPE, FRAME_SIZE, NUM_BODY_JOINTS, NUM_FACE_CHANNELS,
+    LAYOUT_POSITIONS_NONE, LAYOUT_POSITIONS_ROOT, ROTATION_CHANNELS, FULL_LAYOUT, FrameLayout,
+    FrameDetections, body_pose_indices, face_channel_indices
+)
+from scripts.protocol import (
+    HANDSHAKE, PROTOCOL_REQUEST, FRAME_HEADER, SequenceTracker, parse_request, build_ack, build_layout
+)
+from scripts.streaming import FrameQueue
+from scripts.transport import open_frame_connection, open_frame_datagram_endpoint
+
+STAMP_ROW = NUM_BODY_JOINTS - 1  # not part of BODY_POSE_NAMES
+
+UPPER_BODY_JOINTS = BODY_POSE_NAMES[BODY_POSE_NAMES.index("Spine"):BODY_POSE_NAMES.index("LeftToeBase")]
+LAYOUTS = {
+    "full": FULL_LAYOUT,
+    # no fingers, root motion only
+    "body": FrameLayout(BODY_POSE_NAMES[:BODY_POSE_NAMES.index("LeftHandThumb1")], positions=LAYOUT_POSITIONS_ROOT),
+    # a seated performer: hips and up, no positions, no face
+    "upper": FrameLayout(("Hips",) + UPPER_BODY_JOINTS, (), LAYOUT_POSITIONS_NONE),
+    # head and face only
+    "face": FrameLayout(("Hips", "Spine", "Spine1", "Neck", "Head"), FACE_CHANNEL_NAMES, LAYOUT_POSITIONS_NONE),
+}
+
+
+def stamp_frame(record, send_time):
+    record["body"][0, STAMP_ROW, :2].view(np.float64)[0] = send_time
+
+
+def read_stamp(fd):
+    return float(fd.body_data[STAMP_ROW, :2].view(np.float64)[0])
+
+
+class ProceduralFrames:
+    # every joint swings about its own axis, the hips bob, face channels pulse out of phase
+    def __init__(self, rate, seed=0):
+        rng = np.random.default_rng(seed)
+        self.rate = rate
+        self.axes = rng.normal(size=(NUM_BODY_JOINTS, 3))
+        self.axes /= np.linalg.norm(self.axes, axis=1, keepdims=True)
+        self.phases = rng.uniform(0, 2 * np.pi, size=NUM_BODY_JOINTS)
+        self.face_phases = rng.uniform(0, 2 * np.pi, size=NUM_FACE_CHANNELS)
+        self.record = np.zeros(1, dtype=FRAME_DTYPE)
+
+    def __call__(self, index):
+        t = index / self.rate
+        record = self.record
+        half_angles = 0.25 * np.sin(2 * np.pi * 0.5 * t + self.phases)
+        body = record["body"][0]
+        body[:, :3] = self.axes * np.sin(half_angles)[:, None]
+        body[:, 3] = np.cos(half_angles)
+        body[:, 4:] = 0
+        body[0, 4:] = (0.0, 0.9 + 0.05 * np.sin(2 * np.pi * t), 0.0)
+        record["faces"][0] = 0.5 + 0.5 * np.sin(2 * np.pi * 0.3 * t + self.face_phases)
+        return record
+
+
+class CaptureFrames:
+    # loops a raw capture; its own timing is ignored in favour of --rate
+    def __init__(self, path):
+        self.reader = CaptureReader(path)
+        assert len(self.reader), "Capture %s has no frames" % path
+        self.record = np.zeros(1, dtype=FRAME_DTYPE)
+
+    def __call__(self, index):
+        self.record.view(np.uint8)[:] = np.frombuffer(self.reader.frame(index % len(self.reader)), dtype=np.uint8)
+        return self.record
+
+
+class LayoutEncoder:
+    # full frames cut down to the channels of a FrameLayout
+    def __init__(self, layout):
+        self.layout = layout
+        self.joint_rows = body_pose_indices(layout.joint_names)
+        self.face_rows = face_channel_indices(layout.face_names)
+        self.channels = layout.dtype["body"].shape[1]
+        self.frame_size = layout.frame_size
+        self._record = np.zeros(1, dtype=layout.dtype)
+
+    def encode(self, faces, body, sequence, send_time):
+        record = self._record[0]
+        record["sequence"] = sequence
+        record["timestamp"] = send_time
+        record["faces"] = faces[self.face_rows]
+        record["body"][:len(self.joint_rows)] = body[self.joint_rows, :self.channels]
+        if self.layout.positions == LAYOUT_POSITIONS_ROOT:
+            record["root"] = body[self.joint_rows[0], ROTATION_CHANNELS:]
+        return self._record.tobytes()
+
+
+def frame_encoder(version, flags, layout=FULL_LAYOUT):
+    # a layout or compact encoder for clients that negotiated one, None for raw frames
+    if version < 2:
+        return None
+    if flags & PROTOCOL_FLAG_LAYOUT:
+        return LayoutEncoder(layout)
+    return CompactEncoder() if flags & PROTOCOL_FLAG_COMPACT else None
+
+
+def grant_flags(flags, server_flags, layout):
+    # a partial layout wins over the compact encoding, which only encodes full frames
+    flags &= server_flags
+    if flags & PROTOCOL_FLAG_LAYOUT and not layout.is_full:
+        return PROTOCOL_FLAG_LAYOUT
+    return flags & ~PROTOCOL_FLAG_LAYOUT
+
+
+def describe_encoding(encoder):
+    if isinstance(encoder, LayoutEncoder):
+        return ", " + encoder.layout.describe()
+    return ", compact" if encoder is not None else ""
+
+
+class Client:
+    def __init__(self, writer, version, flags=0, layout=FULL_LAYOUT):
+        self.writer = writer
+        self.version = version
+        self.flags = flags
+        self.encoder = frame_encoder(version, flags, layout)
+        self.name = "%s:%s" % writer.get_extra_info("peername")[:2]
+        self.sent = 0
+        self.bytes_sent = 0
+        self.skipped = 0
+        self.last_sent = 0
+
+    @property
+    def backlog(self):
+        # frames written but still queued on our side of the socket
+        if isinstance(self.encoder, LayoutEncoder):
+            frame_size = self.encoder.frame_size
+        elif self.encoder is not None:
+            frame_size = COMPACT_HEADER.size + COMPACT_DELTA_DTYPE.itemsize
+        else:
+            frame_size = FRAME_SIZE if self.version < 2 else FRAME_SIZE + FRAME_HEADER.size
+        return self.writer.transport.get_write_buffer_size() / frame_size
+
+    @property
+    def closing(self):
+        return self.writer.is_closing()
+
+    def write(self, data):
+        self.writer.write(data)
+
+
+class DatagramClient:
+    # a UDP peer, registered by its handshake; datagrams are never queued, so there is no backlog
+    backlog = 0
+
+    def __init__(self, transport, addr, flags=0, loss=0.0, reorder=0.0, layout=FULL_LAYOUT):
+        self.transport = transport
+        self.addr = addr
+        self.version = 2
+        self.flags = flags
+        self.encoder = frame_encoder(self.version, flags, layout)
+        self.name = "udp %s:%s" % addr[:2]
+        self.loss = loss
+        self.reorder = reorder
+        self.sent = 0
+        self.bytes_sent = 0
+        self.skipped = 0
+        self.last_sent = 0
+        self.last_seen = time.perf_counter()
+        self._held = None
+
+    @property
+    def closing(self):
+        return time.perf_counter() - self.last_seen > DATAGRAM_TIMEOUT
+
+    def write(self, data):
+        if self.loss and random.random() < self.loss:
+            return
+        if self._held is None and self.reorder and random.random() < self.reorder:
+            # goes out after the next frame
+            self._held = data
+            return
+        self.transport.sendto(data, self.addr)
+        if self._held is not None:
+            self.transport.sendto(self._held, self.addr)
+            self._held = None
+
+
+class DatagramServer(asyncio.DatagramProtocol):
+    def __init__(self, server, loss=0.0, reorder=0.0):
+        self.server = server
+        self.loss = loss
+        self.reorder = reorder
+        self.clients = {}
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        # handshakes register a client and keep it alive; each one is acked, and followed by the
+        # layout if the client takes one
+        version, flags = parse_request(data[len(HANDSHAKE):]) if data[:len(HANDSHAKE)] == HANDSHAKE else (None, 0)
+        if version is None or version < 2 or self.server.protocol < 2:
+            return
+        client = self.clients.get(addr)
+        if client is None or client not in self.server.clients:
+            layout = self.server.layout
+            client = DatagramClient(
+                self.transport, addr, grant_flags(flags, self.server.flags, layout), self.loss, self.reorder, layout
+            )
+            self.clients[addr] = client
+            self.server.clients.append(client)
+            print("client %s connected, protocol version %d%s"
+                  % (client.name, client.version, describe_encoding(client.encoder)))
+        client.last_seen = time.perf_counter()
+        self.transport.sendto(build_ack(client.version, time.perf_counter(), client.flags), addr)
+        if client.flags & PROTOCOL_FLAG_LAYOUT:
+            self.transport.sendto(build_layout(client.encoder.layout), addr)
+
+
+class StreamServer:
+    def __init__(self, frames, rate, jitter=0.0, burst=0, burst_every=0.0, max_backlog=120, protocol=PROTOCOL_VERSION,
+                 compact=True, layout=FULL_LAYOUT):
+        self.frames = frames
+        self.protocol = protocol
+        # encodings granted to clients that ask for them
+        self.flags = PROTOCOL_FLAG_LAYOUT | (PROTOCOL_FLAG_COMPACT if compact else 0)
+        self.layout = layout
+        self.rate = rate
+        self.jitter = jitter
+        self.burst = burst
+        self.burst_every = burst_every
+        self.max_backlog = max_backlog
+        self.clients = []
+        self.frames_generated = 0
+
+    async def handle_client(self, reader, writer):
+        try:
+            handshake = await reader.readexactly(len(HANDSHAKE))
+        except asyncio.IncompleteReadError:
+            writer.close()
+            return
+        if handshake != HANDSHAKE:
+            print("bad handshake %r" % handshake)
+            writer.close()
+            return
+        version = 1
+        flags = 0
+        if self.protocol >= 2:
+            # a version 2 client sends its request right behind the handshake
+            try:
+                request = await asyncio.wait_for(reader.readexactly(PROTOCOL_REQUEST.size), 0.25)
+                requested, flags = parse_request(request)
+                version = min(requested or 1, self.protocol)
+                flags = grant_flags(flags, self.flags, self.layout)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                pass
+            if version >= 2:
+                writer.write(build_ack(version, time.perf_counter(), flags))
+                if flags & PROTOCOL_FLAG_LAYOUT:
+                    writer.write(build_layout(self.layout))
+        client = Client(writer, version, flags, self.layout)
+        self.clients.append(client)
+        print("client %s connected, protocol version %d%s" % (client.name, version, describe_encoding(client.encoder)))
+        await reader.read()
+        self.clients.remove(client)
+        writer.close()
+        print("client %s disconnected (sent %d, skipped %d)" % (client.name, client.sent, client.skipped))
+
+    def send(self, record, sequence):
+        send_time = time.perf_counter()
+        stamp_frame(record, send_time)
+        data = record.tobytes()
+        data_v2 = FRAME_HEADER.pack(sequence, send_time) + data
+        for client in list(self.clients):
+            if client.closing:
+                if isinstance(client, DatagramClient):
+                    self.clients.remove(client)
+                    print("client %s timed out (sent %d)" % (client.name, client.sent))
+                continue
+            if client.backlog > self.max_backlog:
+                client.skipped += 1
+                continue
+            if client.encoder is not None:
+                message = client.encoder.encode(record["faces"][0], record["body"][0], sequence, send_time)
+            else:
+                message = data if client.version < 2 else data_v2
+            client.write(message)
+            client.sent += 1
+            client.bytes_sent += len(message)
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        period = 1.0 / self.rate
+        start_time = loop.time()
+        next_burst = start_time + self.burst_every if self.burst else None
+        held = 0
+        while True:
+            target = start_time + self.frames_generated * period
+            if self.jitter:
+                target += abs(random.gauss(0.0, self.jitter))
+            # always yield, so a rate the loop can't keep up with doesn't starve the clients
+            await asyncio.sleep(max(target - loop.time(), 0))
+            record = self.frames(self.frames_generated)
+            self.frames_generated += 1
+            if next_burst is not None and loop.time() >= next_burst:
+                # hold the next frames back, then deliver them back to back
+                held += 1
+                if held < self.burst:
+                    continue
+                for i in range(self.frames_generated - held, self.frames_generated):
+                    self.send(self.frames(i), i)
+                held = 0
+                next_burst += self.burst_every
+                continue
+            self.send(record, self.frames_generated - 1)
+
+
+class Receiver:
+    # the extension's receive path minus the solver: transport, frame queue, frame parse
+    def __init__(self, index, policy, transport_mode, compact=False):
+        self.index = index
+        self.transport_mode = transport_mode
+        self.compact = compact
+        self.queue = FrameQueue(policy, DEFAULT_QUEUE_SIZE)
+        self.protocol = None
+        self.sequence_tracker = SequenceTracker()
+        self.latencies = []
+        self.applied = 0
+
+    async def run(self, host, port):
+        if self.transport_mode == TRANSPORT_UDP:
+            transport, self.protocol = await open_frame_datagram_endpoint(
+                host, port, self.queue.maxsize, sequence_tracker=self.sequence_tracker, compact=self.compact
+            )
+        else:
+            transport, self.protocol = await open_frame_connection(
+                host, port, self.queue.maxsize, compact=self.compact
+            )
+        consumer = asyncio.ensure_future(self._consume())
+        try:
+            while True:
+                message = await self.protocol.read_frame()
+                if self.protocol.version >= 2 and self.transport_mode != TRANSPORT_UDP:
+                    self.sequence_tracker.update(FRAME_HEADER.unpack_from(message)[0])
+                await self.queue.put(message)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            consumer.cancel()
+            transport.close()
+
+    async def _consume(self):
+        fd = FrameDetections(self.protocol.layout)
+        while True:
+            message = await self.queue.get()
+            fd.ParseFromString(message)
+            if fd.timestamp is not None:
+                sent = fd.timestamp - self.protocol.clock_offset
+            else:
+                sent = read_stamp(fd)
+            self.latencies.append(time.perf_counter() - sent)
+            self.applied += 1
+            await asyncio.sleep(0)
+
+
+def report(server, receivers, elapsed, interval, last_generated):
+    print("[%6.1f s] generated %8.1f frames/s, %d client(s)"
+          % (elapsed, (server.frames_generated - last_generated) / interval, len(server.clients)))
+    for client in server.clients:
+        rate = (client.sent - client.last_sent) / interval
+        client.last_sent = client.sent
+        print("    %-21s sent %8.1f frames/s  %6.0f B/frame  backlog %6.1f frames  skipped %d"
+              % (client.name, rate, client.bytes_sent / max(client.sent, 1), client.backlog, client.skipped))
+    for receiver in receivers:
+        latencies = np.array(receiver.latencies) * 1e3
+        receiver.latencies = []
+        if len(latencies):
+            stats = receiver.queue.get_stats()
+            print("    receiver %-3d %s v%d applied %6d  latency p50 %7.2f ms  p99 %7.2f ms  queued %d  dropped %d  "
+                  "lost %d  stale %d  %.0f B/frame"
+                  % (receiver.index, receiver.transport_mode, receiver.protocol.version, receiver.applied,
+                     np.percentile(latencies, 50), np.percentile(latencies, 99), stats["depth"], stats["dropped"],
+                     receiver.sequence_tracker.frames_lost, receiver.sequence_tracker.frames_reordered,
+                     receiver.protocol.get_stats()["bytes_per_frame"]))
+
+
+async def main():
+    frames = CaptureFrames(args.capture) if args.capture else ProceduralFrames(args.rate)
+    server = StreamServer(
+        frames, args.rate, args.jitter_ms / 1e3, args.burst, args.burst_every, args.max_backlog, args.protocol,
+        not args.no_compact, LAYOUTS[args.layout]
+    )
+    listener = await asyncio.start_server(server.handle_client, args.host, args.port)
+    port = listener.sockets[0].getsockname()[1]
+    loop = asyncio.get_event_loop()
+    datagram_transport, _ = await loop.create_datagram_endpoint(
+        lambda: DatagramServer(server, args.loss, args.reorder), local_addr=(args.host, port)
+    )
+    print("serving %s:%d (TCP and UDP) at %g frames/s (%s)"
+          % (args.host, port, args.rate, args.capture or "procedural"))
+
+    receivers = [Receiver(i, args.policy, args.transport, args.compact) for i in range(args.clients)]
+    tasks = [asyncio.ensure_future(server.run())]
+    tasks += [asyncio.ensure_future(receiver.run(args.host, port)) for receiver in receivers]
+
+    start_time = loop.time()
+    last_generated = 0
+    try:
+        while not args.duration or loop.time() - start_time < args.duration:
+            await asyncio.sleep(args.report)
+            report(server, receivers, loop.time() - start_time, args.report, last_generated)
+            last_generated = server.frames_generated
+    finally:
+        for task in tasks:
+            task.cancel()
+        listener.close()
+        datagram_transport.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(DEFAULT_PORT))
+    parser.add_argument("--rate", type=float, default=60.0, help="frames per second")
+    parser.add_argument(
+        "--protocol", type=int, choices=(1, 2), default=PROTOCOL_VERSION, help="highest protocol version"
+    )
+    parser.add_argument("--capture", help="loop frames from a raw capture instead of animating procedurally")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="std. deviation of extra send delay")
+    parser.add_argument("--burst", type=int, default=0, help="frames held back and then sent at once")
+    parser.add_argument("--burst-every", type=float, default=2.0, help="seconds between bursts")
+    parser.add_argument("--loss", type=float, default=0.0, help="fraction of UDP datagrams dropped")
+    parser.add_argument("--reorder", type=float, default=0.0, help="fraction of UDP datagrams sent one frame late")
+    parser.add_argument("--max-backlog", type=float, default=120, help="skip a client above this many queued frames")
+    parser.add_argument("--clients", type=int, default=0, help="in-process receivers to start")
+    parser.add_argument(
+        "--policy", choices=QUEUE_POLICIES, default="block", help="frame queue policy of the receivers"
+    )
+    parser.add_argument("--transport", choices=TRANSPORTS, default="tcp", help="transport of the receivers")
+    parser.add_argument("--compact", action="store_true", help="receivers offer the compact encoding")
+    parser.add_argument("--no-compact", action="store_true", help="never grant the compact encoding")
+    parser.add_argument("--layout", choices=sorted(LAYOUTS), default="full",
+                        help="channels sent to clients that take a frame layout")
+    parser.add_argument("--duration", type=float, default=0.0, help="seconds to run, 0 runs until interrupted")
+    parser.add_argument("--report", type=float, default=1.0, help="seconds between reports")
+    args = parser.parse_args()
+    try:
+        asyncio.get_event_loop().run_until_complete(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,160 @@
+import asyncio
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+from .constants import *
+from .frames import FRAME_SIZE, FULL_LAYOUT
+from .protocol import build_layout, parse_layout
+
+# File header: magic, format version, frame size in bytes; version 2 follows it with the size of
+# a layout message (protocol.build_layout) and the message, empty for the full layout
+CAPTURE_HEADER = struct.Struct("<8sII")
+CAPTURE_LAYOUT_SIZE = struct.Struct("<I")
+
+
+def capture_record_dtype(frame_size=FRAME_SIZE):
+    # one record per received message: receive time in seconds, then the frame exactly as received
+    return np.dtype([("timestamp", "<f8"), ("frame", "V%d" % frame_size)])
+
+
+#
+# CaptureWriter class
+#
+# Appends raw wire frames with their receive timestamps to a capture file. Opening an existing
+# capture appends to it, so a take can be resumed; the frame size has to match. Without a
+# frame size the first frame written sets it (it depends on the negotiated protocol version),
+# and the layout set by then goes into the header with it; a new file closed before any frame
+# was written is removed rather than left without a header.
+#
+class CaptureWriter:
+    def __init__(self, path, frame_size=FRAME_SIZE, layout=FULL_LAYOUT):
+        self.path = path
+        self.frame_size = None
+        self.layout = layout
+        self.frames_written = 0
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._file = open(path, "ab")
+        self._timestamp = struct.Struct("<d")
+        if self._file.tell():
+            self.frame_size, self.layout, data_offset = read_capture_header(path, frame_size)
+        elif frame_size:
+            self._write_header(frame_size)
+
+    def _write_header(self, frame_size):
+        layout = b"" if self.layout.is_full else build_layout(self.layout)
+        self._file.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION, frame_size))
+        self._file.write(CAPTURE_LAYOUT_SIZE.pack(len(layout)))
+        self._file.write(layout)
+        self.frame_size = frame_size
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def write(self, frame, timestamp=None):
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        if self.frame_size is None:
+            self._write_header(len(frame))
+        assert len(frame) == self.frame_size, "Unexpected frame size %d" % len(frame)
+        self._file.write(self._timestamp.pack(timestamp))
+        self._file.write(frame)
+        self.frames_written += 1
+
+    def close(self):
+        if self._file is not None:
+            empty = self.frame_size is None and not self._file.tell()
+            self._file.close()
+            self._file = None
+            if empty:
+                os.remove(self.path)
+
+
+def read_capture_header(path, frame_size=None):
+    # (frame size, layout, offset of the first record)
+    with open(path, "rb") as capture_file:
+        header = capture_file.read(CAPTURE_HEADER.size)
+        assert len(header) == CAPTURE_HEADER.size, "Not a capture file: %s" % path
+        magic, version, file_frame_size = CAPTURE_HEADER.unpack(header)
+        assert magic == CAPTURE_MAGIC, "Not a capture file: %s" % path
+        assert 1 <= version <= CAPTURE_VERSION, "Unsupported capture version %d" % version
+        assert frame_size is None or file_frame_size == frame_size, "Capture frame size %d" % file_frame_size
+        layout = FULL_LAYOUT
+        data_offset = CAPTURE_HEADER.size
+        if version >= 2:
+            layout_size, = CAPTURE_LAYOUT_SIZE.unpack(capture_file.read(CAPTURE_LAYOUT_SIZE.size))
+            if layout_size:
+                layout = parse_layout(capture_file.read(layout_size))
+            data_offset += CAPTURE_LAYOUT_SIZE.size + layout_size
+    return file_frame_size, layout, data_offset
+
+
+#
+# CaptureReader class
+#
+# Memory maps a capture file; frames are returned as views into the mapping, so replaying costs
+# no reads or copies. A record cut short by a crash while writing is ignored.
+#
+class CaptureReader:
+    def __init__(self, path):
+        self.path = path
+        self.frame_size, self.layout, self._data_offset = read_capture_header(path)
+        record_dtype = capture_record_dtype(self.frame_size)
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        count = (len(self._mmap) - self._data_offset) // record_dtype.itemsize
+        self.timestamps = np.ndarray((count,), dtype="<f8", buffer=self._mmap, offset=self._data_offset,
+                                     strides=(record_dtype.itemsize,))
+        self._record_size = record_dtype.itemsize
+        self._frames = memoryview(self._mmap)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def duration(self):
+        return float(self.timestamps[-1] - self.timestamps[0]) if len(self) else 0.0
+
+    def frame(self, index):
+        start = self._data_offset + index * self._record_size + 8
+        return self._frames[start:start + self.frame_size]
+
+    def close(self):
+        if self._mmap is not None:
+            self.timestamps = None
+            self._file.close()
+            try:
+                self._frames.release()
+                self._mmap.close()
+            except BufferError:
+                # frames handed out are still referenced (a queue, a parsed frame); the mapping
+                # goes away with the last of them
+                pass
+            self._frames = None
+            self._mmap = None
+
+
+async def replay_capture(reader, queue, speed=1.0, loop=False):
+    # Puts the captured frames on a FrameQueue with their original spacing divided by speed;
+    # speed 0 replays as fast as the queue takes them
+    event_loop = asyncio.get_event_loop()
+    timestamps = reader.timestamps
+    while True:
+        start_time = event_loop.time()
+        for i in range(len(reader)):
+            if speed:
+                delay = start_time + (timestamps[i] - timestamps[0]) / speed - event_loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await queue.put(reader.frame(i))
+            if not speed:
+                # a queue with room never suspends; give the consumer and other sessions a turn
+                await asyncio.sleep(0)
+        if not loop:
+            break
@@ -0,0 +1,172 @@
+import math
+import struct
+
+import numpy as np
+
+from .constants import *
+from .frames import NUM_BODY_JOINTS, NUM_FACE_CHANNELS, FRAME_DTYPE_V2
+
+# Compact frames (negotiated with PROTOCOL_FLAG_COMPACT) replace the float32 payload of a
+# protocol version 2 frame:
+#   header    sequence, sender clock, kind, payload size
+#   keyframe  faces as u8, root position as f32, every joint rotation as a smallest-three u32
+#   delta     frames since the keyframe, faces, root position, and each rotation as int8 steps
+#             from the keyframe's quantized components
+# Only the root joint's position is sent; the solver uses no other. Deltas refer to the last
+# keyframe only, so a lost delta never affects the next one.
+COMPACT_HEADER = struct.Struct("<QdBxH")
+COMPACT_KEYFRAME = 0
+COMPACT_DELTA = 1
+COMPACT_KEY_DTYPE = np.dtype(
+    [
+        ("faces", np.uint8, (NUM_FACE_CHANNELS,)),
+        ("root", "<f4", (3,)),
+        ("quats", "<u4", (NUM_BODY_JOINTS,)),
+    ]
+)
+COMPACT_DELTA_DTYPE = np.dtype(
+    [
+        ("key_age", "<u2"),
+        ("faces", np.uint8, (NUM_FACE_CHANNELS,)),
+        ("root", "<f4", (3,)),
+        ("deltas", np.int8, (NUM_BODY_JOINTS, 3)),
+    ]
+)
+COMPACT_PAYLOAD_SIZES = {COMPACT_KEYFRAME: COMPACT_KEY_DTYPE.itemsize, COMPACT_DELTA: COMPACT_DELTA_DTYPE.itemsize}
+COMPACT_MAX_FRAME_SIZE = COMPACT_HEADER.size + max(COMPACT_PAYLOAD_SIZES.values())
+
+ROOT_JOINT = 0  # Hips, the first of BODY_POSE_NAMES
+
+# Smallest three: the largest quaternion component (made positive) is dropped and rebuilt from
+# the other three, which all lie within +-1/sqrt(2) and get 10 bits each; 2 bits keep its index.
+QUAT_COMPONENT_BITS = 10
+QUAT_COMPONENT_MAX = (1 << QUAT_COMPONENT_BITS) - 1
+QUAT_COMPONENT_RANGE = math.sqrt(0.5)
+QUAT_COMPONENT_SCALE = QUAT_COMPONENT_MAX / (2 * QUAT_COMPONENT_RANGE)
+# the three components kept for each dropped one
+QUAT_OTHER_COMPONENTS = np.array([[1, 2, 3], [0, 2, 3], [0, 1, 3], [0, 1, 2]], dtype=np.intp)
+
+
+def quantize_quats(quats, largest=None):
+    # (N,4) -> index of the dropped component and (N,3) quantized others; a given `largest`
+    # is used instead of each quaternion's own, and values out of range are not clamped
+    rows = np.arange(len(quats))
+    if largest is None:
+        largest = np.argmax(np.abs(quats), axis=1)
+    sign = np.where(quats[rows, largest] < 0, -1.0, 1.0)
+    others = quats[rows[:, None], QUAT_OTHER_COMPONENTS[largest]] * sign[:, None]
+    return largest, np.rint((others + QUAT_COMPONENT_RANGE) * QUAT_COMPONENT_SCALE).astype(np.int32)
+
+
+def pack_quats(largest, quantized):
+    quantized = quantized.astype(np.uint32)
+    return (
+        (largest.astype(np.uint32) << 30) | (quantized[:, 0] << 20) | (quantized[:, 1] << 10) | quantized[:, 2]
+    )
+
+
+def unpack_quats(packed):
+    packed = packed.astype(np.uint32)
+    largest = (packed >> 30).astype(np.intp)
+    quantized = np.stack((packed >> 20, packed >> 10, packed), axis=1) & QUAT_COMPONENT_MAX
+    return largest, quantized.astype(np.int32)
+
+
+def dequantize_quats(largest, quantized, out):
+    rows = np.arange(len(largest))
+    others = quantized * (1.0 / QUAT_COMPONENT_SCALE) - QUAT_COMPONENT_RANGE
+    out[rows[:, None], QUAT_OTHER_COMPONENTS[largest]] = others
+    out[rows, largest] = np.sqrt(np.maximum(1.0 - np.einsum("ij,ij->i", others, others), 0.0))
+    return out
+
+
+#
+# CompactEncoder class
+#
+# Sender side, one per connection: a keyframe first, then deltas until keyframe_interval
+# frames have passed or a rotation has moved too far from the keyframe for int8 steps.
+#
+class CompactEncoder:
+    def __init__(self, keyframe_interval=COMPACT_KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self._key_largest = None
+        self._key_quantized = None
+        self._key_sequence = None
+        self._key = np.zeros(1, dtype=COMPACT_KEY_DTYPE)
+        self._delta = np.zeros(1, dtype=COMPACT_DELTA_DTYPE)
+        self.keyframes = 0
+        self.deltas = 0
+
+    def encode(self, faces, body, sequence, send_time):
+        # faces (51,) and body (52,7) as in a raw frame
+        quats = body[:, :4].astype(np.float64)
+        quats /= np.linalg.norm(quats, axis=1, keepdims=True)
+        faces = np.rint(np.clip(faces, 0.0, 1.0) * 255.0)
+        if self._key_sequence is not None and 0 < sequence - self._key_sequence < self.keyframe_interval:
+            largest, quantized = quantize_quats(quats, self._key_largest)
+            steps = quantized - self._key_quantized
+            if np.abs(steps).max() <= 127 and quantized.min() >= 0 and quantized.max() <= QUAT_COMPONENT_MAX:
+                delta = self._delta[0]
+                delta["key_age"] = sequence - self._key_sequence
+                delta["faces"] = faces
+                delta["root"] = body[ROOT_JOINT, 4:7]
+                delta["deltas"] = steps
+                self.deltas += 1
+                header = COMPACT_HEADER.pack(sequence, send_time, COMPACT_DELTA, self._delta.itemsize)
+                return header + self._delta.tobytes()
+        largest, quantized = quantize_quats(quats)
+        quantized = np.clip(quantized, 0, QUAT_COMPONENT_MAX)
+        self._key_largest = largest
+        self._key_quantized = quantized
+        self._key_sequence = sequence
+        key = self._key[0]
+        key["faces"] = faces
+        key["root"] = body[ROOT_JOINT, 4:7]
+        key["quats"] = pack_quats(largest, quantized)
+        self.keyframes += 1
+        header = COMPACT_HEADER.pack(sequence, send_time, COMPACT_KEYFRAME, self._key.itemsize)
+        return header + self._key.tobytes()
+
+
+#
+# CompactDecoder class
+#
+# Receiver side: expands compact frames into protocol version 2 frame buffers, so everything
+# downstream (queue, capture, FrameDetections) sees ordinary frames. A delta whose keyframe
+# was never received (lost, or the stream joined late) can't be decoded and is skipped.
+#
+class CompactDecoder:
+    def __init__(self):
+        self._key_largest = None
+        self._key_quantized = None
+        self._key_sequence = None
+        self._quats = np.zeros((NUM_BODY_JOINTS, 4))
+        self.frames_undecodable = 0
+
+    def decode(self, message, out):
+        # message: header and payload; out: a writable FRAME_SIZE_V2 buffer. False if skipped.
+        sequence, send_time, kind, payload_size = COMPACT_HEADER.unpack_from(message)
+        if COMPACT_PAYLOAD_SIZES.get(kind) != payload_size or len(message) != COMPACT_HEADER.size + payload_size:
+            raise ValueError("Malformed compact frame (kind %d, %d bytes)" % (kind, len(message)))
+        if kind == COMPACT_KEYFRAME:
+            payload = np.frombuffer(message, dtype=COMPACT_KEY_DTYPE, count=1, offset=COMPACT_HEADER.size)[0]
+            self._key_largest, self._key_quantized = unpack_quats(payload["quats"])
+            self._key_sequence = sequence
+            quantized = self._key_quantized
+            largest = self._key_largest
+        else:
+            payload = np.frombuffer(message, dtype=COMPACT_DELTA_DTYPE, count=1, offset=COMPACT_HEADER.size)[0]
+            if self._key_sequence is None or sequence - int(payload["key_age"]) != self._key_sequence:
+                self.frames_undecodable += 1
+                return False
+            quantized = self._key_quantized + payload["deltas"]
+            largest = self._key_largest
+        record = np.frombuffer(out, dtype=FRAME_DTYPE_V2, count=1)[0]
+        record["sequence"] = sequence
+        record["timestamp"] = send_time
+        np.multiply(payload["faces"], 1.0 / 255.0, out=record["faces"], casting="unsafe")
+        body = record["body"]
+        body[:, :4] = dequantize_quats(largest, quantized, self._quats)
+        body[:, 4:] = 0.0
+        body[ROOT_JOINT, 4:7] = payload["root"]
+        return True
@@ -6,12 +6,21 @@ CS_PORT_TEXT = "PORT"
 CS_GOTO_BTN_TEXT = "Contact us"
 CS_START_BTN_TEXT = "Start streaming"
 CS_STOP_BTN_TEXT = "Stop streaming"
+CS_RECORD_BTN_TEXT = "Record take"
+CS_STOP_RECORD_BTN_TEXT = "Stop recording"
 CS_URL = "http://motionverse.io/omniverse"
 SKEL_SOURCE_EDIT_TEXT = "Target skeleton"
 SKEL_SOURCE_BTN_TEXT = "Use highlighted skeleton"
 SKEL_INVALID_TEXT = "No skeleton selected"
 RIG_DROPDOWN_TEXT = "Rig Type"
 RIG_UNSUPPORTED_TEXT = "Unsupported rig"
+QUEUE_POLICY_TEXT = "Frame policy"
+METRICS_TEXT = "Metrics"
+JITTER_DELAY_TEXT = "Jitter buffer (ms)"
+SOLVER_THREAD_TEXT = "Solver thread"
+SMOOTHING_TEXT = "Smoothing"
+TRANSPORT_TEXT = "Transport"
+COMPACT_ENCODING_TEXT = "Compact encoding"
 # UI image filepaths
 LOGO_FILEPATH = "/data/logo-white.png"
 
@@ -22,3 +31,84 @@ CS_H_SPACING = 5
 DEFAULT_PORT = "4188"
 DEFAULT_IP = "192.168.10.105"
 
+# frame queue policies
+QUEUE_POLICY_BLOCK = "block"
+QUEUE_POLICY_DROP_OLDEST = "drop_oldest"
+QUEUE_POLICY_LATEST = "latest"
+QUEUE_POLICY_PER_UPDATE = "per_update"
+QUEUE_POLICIES = (QUEUE_POLICY_BLOCK, QUEUE_POLICY_DROP_OLDEST, QUEUE_POLICY_LATEST, QUEUE_POLICY_PER_UPDATE)
+QUEUE_POLICY_LABELS = ("Block (every frame)", "Drop oldest", "Latest only", "Latest per app update")
+DEFAULT_QUEUE_POLICY = QUEUE_POLICY_BLOCK
+DEFAULT_QUEUE_SIZE = 10
+
+# wire protocol; version 2 adds a sequence number and sender timestamp to every frame
+PROTOCOL_VERSION = 2
+# handshake flags: encodings the client can take, and in the ack the one the server chose
+PROTOCOL_FLAG_COMPACT = 1
+# a FrameLayout message follows the ack and frames carry only its channels; servers grant
+# at most one of compact and layout
+PROTOCOL_FLAG_LAYOUT = 2
+LAYOUT_VERSION = 1
+DEFAULT_COMPACT_ENCODING = False
+COMPACT_KEYFRAME_INTERVAL = 30
+
+# jitter buffer; a delay of 0 applies frames as they arrive
+DEFAULT_JITTER_DELAY = 0.0
+JITTER_BUFFER_CAPACITY = 32
+
+# One-Euro smoothing of solved poses, per joint group; a rig file's "smoothing" section
+# overrides these. Cutoffs in Hz, beta in Hz per unit of speed.
+SMOOTHING_GROUPS = ("body", "hands", "root")
+DEFAULT_SMOOTHING = {
+    "body": {"min_cutoff": 1.2, "beta": 0.4, "d_cutoff": 1.0},
+    "hands": {"min_cutoff": 0.8, "beta": 0.3, "d_cutoff": 1.0},
+    "root": {"min_cutoff": 1.0, "beta": 0.7, "d_cutoff": 1.0},
+}
+DEFAULT_SMOOTHING_ENABLED = False
+
+# decode and solve on a background thread (SolverWorker); applies to sessions started afterwards
+DEFAULT_SOLVER_THREAD = False
+
+# receive transport
+DEFAULT_RING_HEADROOM = 8
+DEFAULT_SO_RCVBUF = 0  # 0 keeps the OS default
+TRANSPORT_TCP = "tcp"
+TRANSPORT_UDP = "udp"
+TRANSPORTS = (TRANSPORT_TCP, TRANSPORT_UDP)
+TRANSPORT_LABELS = ("TCP", "UDP (latest frame)")
+DEFAULT_TRANSPORT = TRANSPORT_TCP
+# UDP: seconds between handshake requests until acked, between keepalives after that, and
+# without any datagram before the stream counts as lost
+DATAGRAM_HANDSHAKE_INTERVAL = 0.25
+DATAGRAM_KEEPALIVE = 1.0
+DATAGRAM_TIMEOUT = 3.0
+# TCP: seconds without a frame before the connection counts as dead
+STREAM_READ_TIMEOUT = 3.0
+
+# stream session lifecycle: idle -> connecting -> streaming, and on a lost or failed connection
+# backoff -> connecting again, waiting twice as long after every attempt that got no frame
+SESSION_IDLE = "idle"
+SESSION_CONNECTING = "connecting"
+SESSION_STREAMING = "streaming"
+SESSION_BACKOFF = "backoff"
+CONNECT_TIMEOUT = 2.0
+RECONNECT_INITIAL_DELAY = 0.25
+RECONNECT_MAX_DELAY = 5.0
+RECONNECT_BACKOFF = 2.0
+
+# compiled rigs (scripts/rig_cache.py), kept on disk across Kit sessions
+COMPILED_RIG_VERSION = 1
+COMPILED_RIG_DIRECTORY_NAME = "motionverse_compiled_rigs"
+
+# take recording
+RECORD_FLUSH_FRAMES = 120
+TAKE_DIRECTORY_NAME = "takes"
+
+# raw wire captures
+CAPTURE_MAGIC = b"MVCAPRAW"
+CAPTURE_VERSION = 2  # version 2 records the stream's FrameLayout after the header
+CAPTURE_DIRECTORY_NAME = "captures"
+CAPTURE_FILE_EXTENSION = ".mvcap"
+
+# blend shape targets exported from Maya carry the blendShape node name as a prefix
+BLENDSHAPE_TOKEN_PREFIX = "_blendShape_"
@@ -0,0 +1,248 @@
+import time
+
+import numpy as np
+from pxr import Vt, Gf, UsdSkel, Usd
+
+from .constants import BLENDSHAPE_TOKEN_PREFIX
+from .frames import FULL_LAYOUT, BodyGather, FaceGather, face_channel_indices
+from .jitter import JitterBuffer
+from .rig_cache import compile_rig, skeleton_fingerprint
+from .smoothing import PoseFilter, get_smoothing_params
+from .solver import PoseSolver
+from .writer import AnimationWriter
+
+#
+# SkeletonDriver class
+#
+# Solver and animation state for one driven skeleton. Any followers (skeletons with the same
+# joint order and rest pose) bind their animationSource to the same UsdSkel.Animation, so they
+# move with the leader without being solved themselves. Face channels are mapped to the blend
+# shape order of the bound meshes once, up front, so each frame only gathers 51 floats. The
+# animation covers the joints the stream's FrameLayout carries, and the gathers are compiled
+# for that layout; a stream with another layout initializes the animation again. The skeleton
+# side of that comes from a CompiledRig, shared through compiled_rigs when one is given, so
+# initializing again costs a few stage writes and never changes the rest pose once more.
+#
+class SkeletonDriver:
+    def __init__(self, stage, skeleton, rig_mapping, skel_cache, followers=(), joint_namespace="",
+                 compiled_rigs=None):
+        self.stage = stage
+        self.skeleton = skeleton
+        self.rig_mapping = rig_mapping
+        self.joint_namespace = joint_namespace
+        self.skel_cache = skel_cache
+        self.followers = list(followers)
+        self.compiled_rigs = compiled_rigs
+        self.compiled_rig = None
+        self.motion_skel_anim = None
+        self.pose_solver = None
+        self.anim_writer = None
+        self.selected_joints = None
+        self.layout = None
+        self.body_gather = None
+        self.face_gather = None
+        self.jitter_delay = 0.0
+        self.jitter_buffer = None
+        self.smoothing_enabled = False
+        self.pose_filter = None
+        # the last pose staged, solved on this thread or by a SolverWorker
+        self.rotations = None
+        self.root_translation = None
+
+        # skel_root_rotate_xyz is a set of rotations in XYZ order used to align the rest pose
+        # with the capture axes (+Y up, +Z forward)
+        skel_root_rotate_xyz = rig_mapping["skel_root_rotate_xyz"]
+        rot_x = Gf.Rotation(Gf.Vec3d(1, 0, 0), skel_root_rotate_xyz[0])
+        rot_y = Gf.Rotation(Gf.Vec3d(0, 1, 0), skel_root_rotate_xyz[1])
+        rot_z = Gf.Rotation(Gf.Vec3d(0, 0, 1), skel_root_rotate_xyz[2])
+        self.rest_xform_adjust = Gf.Matrix4d()
+        self.rest_xform_adjust.SetRotate(rot_x * rot_y * rot_z)
+        self.rest_xform_adjust_inverse = self.rest_xform_adjust.GetInverse()
+
+        skel_query = self.skel_cache.GetSkelQuery(skeleton)
+        if not skel_query.HasRestPose():
+            xforms = skel_query.ComputeJointLocalTransforms()
+            for target in self.skeletons:
+                target.GetRestTransformsAttr().Set(xforms)
+            self.skel_cache.Clear()
+        # without a cache, rest rewrites start from the rest pose as this driver found it
+        self.source_rest_xforms = skeleton.GetRestTransformsAttr().Get()
+
+        blend_shape_order = get_blend_shape_order(self.skel_cache, self.skeletons)
+        self.blend_shape_tokens, channels = compile_blendshape_mapping(
+            blend_shape_order, rig_mapping.get("blendshape_mappings", {})
+        )
+        self.face_channels = channels
+        self.face_indices = face_channel_indices(channels)
+        self.face_weights = np.zeros(len(self.face_indices), dtype=np.float32)
+
+    @property
+    def skeletons(self):
+        return [self.skeleton] + self.followers
+
+    @property
+    def initialized(self):
+        return self.selected_joints is not None
+
+    def compile_rig(self, selected_joints):
+        args = (self.rig_mapping, selected_joints, self.joint_namespace, self.rest_xform_adjust)
+        if self.compiled_rigs is not None:
+            return self.compiled_rigs.get(self.skeleton, *args)
+        return compile_rig(self.skeleton.GetJointsAttr().Get(), self.source_rest_xforms, *args)
+
+    def init_animation(self, selected_joints, layout=FULL_LAYOUT):
+        compiled_rig = self.compile_rig(selected_joints)
+        anim_tokens = Vt.TokenArray(compiled_rig.anim_tokens)
+        self.motion_to_anim_index = compiled_rig.motion_to_anim_index
+        self.anim_topology = compiled_rig.anim_topology
+        self.rest_xforms_anim_global = compiled_rig.rest_xforms_anim_global
+
+        anim_path = self.skeleton.GetPath().AppendChild("SkelRoot")
+
+        self.motion_skel_anim = UsdSkel.Animation.Define(self.stage, anim_path)
+        self.motion_skel_anim.GetJointsAttr().Set(anim_tokens)
+        if self.blend_shape_tokens:
+            self.motion_skel_anim.GetBlendShapesAttr().Set(Vt.TokenArray(self.blend_shape_tokens))
+
+        # Every skeleton of the group shares the one animation prim
+        for target in self.skeletons:
+            binding = UsdSkel.BindingAPI.Apply(target.GetPrim())
+            binding.CreateAnimationSourceRel().SetTargets([self.motion_skel_anim.GetPrim().GetPath()])
+
+        # written only when it differs, so initializing again sends no change notices for it
+        for target in self.skeletons:
+            rest_xforms_attr = target.GetRestTransformsAttr()
+            if rest_xforms_attr.Get() != compiled_rig.rest_xforms_local:
+                rest_xforms_attr.Set(compiled_rig.rest_xforms_local)
+
+        self.motion_skel_anim.SetTransforms(compiled_rig.base_xforms_anim_local, 0)
+
+        self.body_gather = BodyGather(layout, compiled_rig.motion_to_token)
+        self.face_gather = FaceGather(layout, self.face_channels)
+        self.pose_solver = PoseSolver(
+            self.anim_topology,
+            self.rest_xforms_anim_global,
+            self.rest_xform_adjust,
+            self.body_gather.indices,
+            self.motion_to_anim_index["Hips"],
+        )
+        self.anim_writer = AnimationWriter(self.motion_skel_anim, self.pose_solver.root_index)
+        self.compiled_rig = compiled_rig
+        self.selected_joints = set(selected_joints)
+        self.layout = layout
+        self.jitter_buffer = None
+        self.set_jitter_delay(self.jitter_delay)
+        self.set_smoothing(self.smoothing_enabled)
+
+    def set_smoothing(self, enabled):
+        # One-Euro filtering of solved poses with the rig's per group parameters
+        self.smoothing_enabled = enabled
+        if enabled and self.initialized:
+            self.pose_filter = PoseFilter(
+                self.motion_to_anim_index, self.pose_solver.root_index, get_smoothing_params(self.rig_mapping)
+            )
+        else:
+            self.pose_filter = None
+
+    def set_jitter_delay(self, delay):
+        # > 0 plays solved poses back through a JitterBuffer, `delay` seconds behind capture
+        self.jitter_delay = delay
+        if not self.initialized or delay <= 0:
+            self.jitter_buffer = None
+        elif self.jitter_buffer is None:
+            self.jitter_buffer = JitterBuffer(len(self.pose_solver.motion_indices), len(self.face_indices), delay)
+        else:
+            self.jitter_buffer.delay = delay
+
+    def apply(self, fd, frame_time=None):
+        # frame_time: capture time of the frame in this machine's clock, for the jitter buffer
+        if not self.initialized or fd.layout != self.layout:
+            self.init_animation(fd.body_pose_names, fd.layout)
+        anim_rotations, root_translation, face_weights = self.solve(fd, frame_time)
+        self.stage_pose(anim_rotations, root_translation, face_weights, frame_time)
+        return anim_rotations, root_translation
+
+    def solve(self, fd, frame_time=None):
+        # pure array math into the solver's buffers; safe off the main thread once initialized
+        body_block = self.body_gather(fd, self.pose_solver.body_block)
+        anim_rotations, root_translation = self.pose_solver.solve(body_block)
+        pose_filter = self.pose_filter
+        if pose_filter is not None:
+            if frame_time is None:
+                frame_time = time.perf_counter()
+            anim_rotations, root_translation = pose_filter.filter(anim_rotations, root_translation, frame_time)
+        face_weights = self.face_gather(fd, self.face_weights) if self.blend_shape_tokens else None
+        return anim_rotations, root_translation, face_weights
+
+    def stage_pose(self, anim_rotations, root_translation, face_weights=None, frame_time=None):
+        self.rotations = anim_rotations
+        self.root_translation = root_translation
+        if self.jitter_buffer is not None:
+            if frame_time is None:
+                frame_time = time.perf_counter()
+            self.jitter_buffer.push(frame_time, anim_rotations, root_translation, face_weights)
+        else:
+            self.anim_writer.stage(anim_rotations, root_translation, face_weights)
+
+    def commit(self, now=None):
+        if self.anim_writer is None:
+            return
+        if self.jitter_buffer is not None:
+            pose = self.jitter_buffer.sample(time.perf_counter() if now is None else now)
+            if pose is not None:
+                rotations, root_translation, face_weights = pose
+                self.anim_writer.stage(rotations, root_translation, face_weights if self.blend_shape_tokens else None)
+        self.anim_writer.commit()
+
+
+def get_blend_shape_order(skel_cache, skeletons):
+    # blend shape tokens of every mesh skinned by the given skeletons, in first-seen order
+    paths = set(skeleton.GetPath() for skeleton in skeletons)
+    roots = {}
+    for skeleton in skeletons:
+        skel_root = UsdSkel.Root.Find(skeleton.GetPrim())
+        if skel_root:
+            roots.setdefault(skel_root.GetPath(), skel_root)
+    order = []
+    for skel_root in roots.values():
+        skel_cache.Populate(skel_root, Usd.TraverseInstanceProxies())
+        for binding in skel_cache.ComputeSkelBindings(skel_root, Usd.TraverseInstanceProxies()):
+            if binding.GetSkeleton().GetPath() not in paths:
+                continue
+            for target in binding.GetSkinningTargets():
+                if target.HasBlendShapes():
+                    order.extend(token for token in target.GetBlendShapeOrder() if token not in order)
+    return order
+
+
+def blendshape_base_name(token):
+    # "_blendShape_jawOpen", "blendShape1.jawOpen" and "jawOpen" all name the jawOpen target
+    name = token.rsplit(".", 1)[-1].rsplit(":", 1)[-1]
+    if name.startswith(BLENDSHAPE_TOKEN_PREFIX):
+        name = name[len(BLENDSHAPE_TOKEN_PREFIX):]
+    return name
+
+
+def compile_blendshape_mapping(blend_shape_order, blendshape_mappings):
+    # blendshape_mappings is {model blend shape: face channel}, like joint_mappings; returns the
+    # mapped tokens and, for each, the face channel that drives it
+    tokens = []
+    channels = []
+    for token in blend_shape_order:
+        channel = blendshape_mappings.get(token, blendshape_mappings.get(blendshape_base_name(token)))
+        if channel is not None:
+            tokens.append(token)
+            channels.append(channel)
+    return tokens, channels
+
+
+def group_skeletons(skeletons):
+    # {fingerprint: [skeleton, ...]} in first-seen order; the first skeleton of a group leads it
+    groups = {}
+    seen = set()
+    for skeleton in skeletons:
+        if skeleton.GetPath() in seen:
+            continue
+        seen.add(skeleton.GetPath())
+        groups.setdefault(skeleton_fingerprint(skeleton), []).append(skeleton)
+    return groups
@@ -1,29 +1,49 @@
-import carb
 import omni.ext
 import omni.timeline
 import omni.usd
 import omni.kit.window.file
-import traceback
 import json
 import glob
-import asyncio
-from email import message
-from operator import le
-from pxr import Vt, Gf, UsdSkel, Usd, Sdf, UsdGeom
+import os
+import tempfile
+from pxr import UsdSkel, Sdf, UsdGeom
 from typing import cast, Union, List
 
 from .constants import *
 from .ui import *
 from .styles import *
 from .utils import *
+from .logs import log_info, log_warn
+from .session import StreamSession, ReplaySession
+from .recorder import TakeRecorder, get_take_path, get_capture_path
+from .driver import SkeletonDriver, group_skeletons
+from .frames import FULL_LAYOUT
+from .rig_cache import CompiledRigCache
+from .rigs import RigRegistry
+from .stage_index import SkeletonIndex
+from .metrics import StreamMetrics
 
 class MotionverseExtension(omni.ext.IExt):
     def __init__(self):
-        self._net_io_task = None
-        self._update_skeleton_task = None
+        self.session = None
+        self.sessions = []
         self.target_skeleton = None
+        self.drivers = []
         self.skel_root_path = None
         self.skel_cache = UsdSkel.Cache()
+        # compiled rigs are keyed by skeleton path and content, so one cache serves every stage
+        self.compiled_rigs = CompiledRigCache(os.path.join(tempfile.gettempdir(), COMPILED_RIG_DIRECTORY_NAME))
+        self.skeleton_index = None
+        self.queue_policy = DEFAULT_QUEUE_POLICY
+        self.socket_rcvbuf = DEFAULT_SO_RCVBUF
+        self.take_recorder = TakeRecorder()
+        self.metrics_enabled = False
+        self.jitter_delay = DEFAULT_JITTER_DELAY
+        self.solver_thread = DEFAULT_SOLVER_THREAD
+        self.transport_mode = DEFAULT_TRANSPORT
+        self.compact_encoding = DEFAULT_COMPACT_ENCODING
+        self.smoothing_enabled = DEFAULT_SMOOTHING_ENABLED
+        self.record_requested = False
 
     def on_startup(self, ext_id):
         self.import_rig_mappings_from_json_files()
@@ -36,225 +56,219 @@ class MotionverseExtension(omni.ext.IExt):
         self.disconnect("Resetting connection")
         host = self.ui_controller.source_ip_field.model.as_string
         port = self.ui_controller.source_port_field.model.as_int
-        loop = asyncio.get_event_loop()
-        queue = asyncio.Queue(maxsize=10, loop=loop)
-        if self._net_io_task:
-            loop.run_until_complete(asyncio.wait({self._net_io_task}, timeout=1.0))
-        if self._update_skeleton_task:
-            loop.run_until_complete(asyncio.wait({self._update_skeleton_task}, timeout=1.0))
-
-        self._net_io_task = loop.create_task(self._do_net_io(host, port, queue))
-        self._update_skeleton_task = loop.create_task(self._update_skeleton_loop(queue))
-        self._net_io_task.add_done_callback(self.on_task_complete)
-        self._update_skeleton_task.add_done_callback(self.on_task_complete)
-
-    def on_task_complete(self, fut=None):
-        if fut is self._net_io_task:
-            self._update_skeleton_task.cancel()
-        elif fut is self._update_skeleton_task:
-            self._net_io_task.cancel()
-        self.ui_controller.streaming_active = False
-
-    async def _do_net_io(self, host, port, queue):
+        if self.session is not None:
+            self.sessions.remove(self.session)
+        self.session = self._start_session(host, port, self.drivers, self.queue_policy)
+        self.session.frame_callbacks.append(self._record_frame)
         self.ui_controller.streaming_active = True
-        writer = None
-        try:
-            reader, writer = await asyncio.open_connection(host, port)
-            writer.write(b"ov")
-            await self._read_client(reader, queue)
-        except asyncio.CancelledError:
-            log_info("Network streaming cancelled")
-        except:
-            carb.log_error(traceback.format_exc())
-        finally:
-            if writer is not None:
-                writer.close()
-                await writer.wait_closed()
-                log_info("TCP connection closed")
-            log_info("Net I/O task stopped")
-
-    async def _read_client(self, reader, queue):
-        while True:
-            message_data = await reader.readexactly(1660)
-            await queue.put(message_data)
-
-    async def _update_skeleton_loop(self, queue):
-        try:
-            while True:
-                message = await queue.get()
-                fd = FrameDetections()
-                fd.ParseFromString(message)
-                self.update_skeleton(fd)
-        except asyncio.CancelledError:
-            log_info("Skeleton update task cancelled")
-        except:
-            carb.log_error(traceback.format_exc())
+
+    def add_session(self, host, port, skel_root_paths, queue_policy=None):
+        # Additional stream driving its own characters, alongside the one configured in the window
+        drivers = self.create_drivers(skel_root_paths)
+        return self._start_session(host, port, drivers, queue_policy or self.queue_policy)
+
+    def remove_session(self, session):
+        session.stop()
+        if session in self.sessions:
+            self.sessions.remove(session)
+        if session is self.session:
+            self.session = None
+
+    def replay_capture(self, capture_path, skel_root_paths=None, speed=1.0, loop=False):
+        # plays a raw capture through the same pipeline as a live stream; speed 0 is unthrottled
+        drivers = self.create_drivers(skel_root_paths) if skel_root_paths else self.drivers
+        session = ReplaySession(capture_path, drivers, speed, loop)
+        return self._add_session(session)
+
+    def start_capture(self, capture_path=None):
+        if self.session is None:
+            log_warn("No stream to capture")
+            return None
+        if capture_path is None:
+            capture_path = get_capture_path(omni.usd.get_context().get_stage(), self.session.name)
+        self.session.start_capture(capture_path)
+        return capture_path
+
+    def stop_capture(self):
+        return self.session.stop_capture() if self.session is not None else None
+
+    def _start_session(self, host, port, drivers, queue_policy):
+        return self._add_session(
+            StreamSession(host, port, drivers, queue_policy, self.socket_rcvbuf, transport_mode=self.transport_mode)
+        )
+
+    def _add_session(self, session):
+        if self.metrics_enabled:
+            session.metrics = StreamMetrics()
+        session.set_jitter_delay(self.jitter_delay)
+        session.set_smoothing(self.smoothing_enabled)
+        session.solver_thread = self.solver_thread
+        session.compact_encoding = self.compact_encoding
+        session.completion_callbacks.append(self.on_session_complete)
+        self.sessions.append(session)
+        session.start()
+        return session
+
+    def on_session_complete(self, session):
+        if session is self.session and self.ui_controller is not None:
+            self.ui_controller.streaming_active = False
+
+    def set_metrics_enabled(self, enabled):
+        # attaching fresh metrics also resets them
+        self.metrics_enabled = enabled
+        for session in self.sessions:
+            session.metrics = StreamMetrics() if enabled else None
+
+    def set_jitter_delay(self, delay):
+        # seconds of buffering for smooth playback; 0 applies frames as they arrive
+        self.jitter_delay = max(delay, 0.0)
+        for session in self.sessions:
+            session.set_jitter_delay(self.jitter_delay)
+
+    def set_smoothing_enabled(self, enabled):
+        self.smoothing_enabled = enabled
+        for session in self.sessions:
+            session.set_smoothing(enabled)
+
+    def get_metrics(self):
+        # {session name: metrics stats} for every instrumented session
+        return {session.name: session.metrics.get_stats() for session in self.sessions if session.metrics is not None}
+
+    def commit_sessions(self):
+        # sessions on the per_update policy or a solver thread apply their newest frame here,
+        # then one change block for every pose staged by every session since the last app update
+        for session in self.sessions:
+            session.update()
+        with Sdf.ChangeBlock():
+            for session in self.sessions:
+                session.commit()
 
     def disconnect(self, reason=str()):
-        streaming_active = False
-        if self._net_io_task is not None:
-            self._net_io_task.cancel()
+        if self.ui_controller is not None:
+            self.ui_controller.streaming_active = False
+        if self.take_recorder.recording:
+            self.stop_recording()
+        if self.session is not None:
+            self.session.stop()
 
     def import_rig_mappings_from_json_files(self):
-        self.rig_mappings = []
-        rig_filenames = glob.glob(get_this_files_path() + "/xform_*.json")
+        self.rig_registry = RigRegistry()
+        self.rig_mappings = self.rig_registry.mappings
+        rig_filenames = sorted(glob.glob(get_this_files_path() + "/xform_*.json"))
         if rig_filenames is not None:
             for filename in rig_filenames:
                 rig_mapfile = open(filename, "r")
                 if rig_mapfile is not None:
-                    self.rig_mappings.append(json.load(rig_mapfile))
+                    self.rig_registry.add(json.load(rig_mapfile))
                 else:
                     log_info("error - could not load file %s" % filename)
 
-    def init_skeletons(self, skel_root_path):
-
+    def init_skeletons(self, skel_root_paths):
         self.selected_rig_index = None
-        self.motion_skel_anim = None
-        self.selected_joints = None
-        self.skel_root_path = skel_root_path
-        selected_skeleton = find_skeleton(skel_root_path)
-        skel_query = self.skel_cache.GetSkelQuery(selected_skeleton)
-        joint_tokens = skel_query.GetJointOrder()
-        jointPaths = [Sdf.Path(jointToken) for jointToken in joint_tokens]
-        all_joint_names = [jointPath.name for jointPath in jointPaths]
-
-        self.selected_rig_index = get_rig_index(all_joint_names, self.rig_mappings)
-
-        assert self.selected_rig_index is not None, "Unsupported rig"
-        self.target_skeleton = selected_skeleton
+        self.skel_root_path = skel_root_paths if isinstance(skel_root_paths, str) else skel_root_paths[0]
+        previous_drivers = self.drivers
+        self.drivers = self.create_drivers(skel_root_paths)
+        # sessions driving the previous selection (the window's stream, replays) move to the new one
+        for session in self.sessions:
+            if previous_drivers and session.drivers == previous_drivers:
+                session.set_drivers(self.drivers)
+        self.target_skeleton = self.drivers[0].skeleton
         self.target_skel_root = UsdSkel.Root.Find(self.target_skeleton.GetPrim())
-        skel_root_rotate_xyz = self.rig_mappings[self.selected_rig_index]["skel_root_rotate_xyz"]
-        rot_x = Gf.Rotation(Gf.Vec3d(1, 0, 0), skel_root_rotate_xyz[0])
-        rot_y = Gf.Rotation(Gf.Vec3d(0, 1, 0), skel_root_rotate_xyz[1])
-        rot_z = Gf.Rotation(Gf.Vec3d(0, 0, 1), skel_root_rotate_xyz[2])
-        self.rest_xform_adjust = Gf.Matrix4d()
-        self.rest_xform_adjust.SetRotate(rot_x * rot_y * rot_z)
-        self.rest_xform_adjust_inverse = self.rest_xform_adjust.GetInverse()
-
-        if not skel_query.HasRestPose():
-            xforms = skel_query.ComputeJointLocalTransforms()
-            self.target_skeleton.GetRestTransformsAttr().Set(xforms)
-            self.skel_cache.Clear()
-
-    def update_skeleton(self, fd):
-        if self.selected_joints is None:
-            self._init_animation(fd.body_pose_names)
-        num_joints = len(self.rest_xforms_anim_global)
-        root_index = self.motion_to_anim_index["Hips"]
-        motion_xforms_global = Vt.Matrix4dArray(num_joints)
-        for i, pose in enumerate(fd.body_poses):
-            name = fd.body_pose_names[i]
-            if name in self.motion_to_anim_index:
-                anim_index = self.motion_to_anim_index[name]
-                q = pose['rotation']
-                t = pose['position']
-                rot = Gf.Rotation(Gf.Quatd(q[3], q[0], q[1], q[2]))
-                trans = Gf.Vec3d(t[0], t[1], t[2])
-
-                xform = Gf.Matrix4d()
-                xform.SetTransform(rot, trans)
-
-                motion_xforms_global[anim_index] = xform
-               
-        target_pose_xforms_global = Vt.Matrix4dArray(
-            [
-                base_xform * motion_xform
-                for motion_xform, base_xform in zip(motion_xforms_global, self.rest_xforms_anim_global)
-            ]
-        )
-
-        root_xform = self.rest_xform_adjust_inverse
-
-        target_xforms_local = UsdSkel.ComputeJointLocalTransforms(
-            self.anim_topology, target_pose_xforms_global, root_xform
-        )
 
-        anim_rotations = Vt.QuatfArray([Gf.Quatf(xform.ExtractRotationQuat()) for xform in target_xforms_local])
-
-   
-        height_offset = 0
-
-        local_translations_attr = self.motion_skel_anim.GetTranslationsAttr()
-        local_translations = local_translations_attr.Get(0)
-        local_translations[root_index] = Gf.Vec3f(
-            root_xform.Transform(
-                Gf.Vec3d(0, 1, 0) * height_offset + motion_xforms_global[root_index].ExtractTranslation()
+    def create_drivers(self, skel_root_paths):
+        # One path drives one skeleton; several paths are grouped by joint order and rest pose
+        # and every group is solved once, its other members sharing the leader's animation.
+        if isinstance(skel_root_paths, str):
+            skel_root_paths = [skel_root_paths]
+        drivers = []
+        stage = omni.usd.get_context().get_stage()
+        skeleton_index = self.get_skeleton_index()
+        skeletons = []
+        for path in skel_root_paths:
+            skeleton = skeleton_index.find_skeleton(path)
+            assert skeleton is not None, "Could not find skeleton"
+            skeletons.append(skeleton)
+
+        for group in group_skeletons(skeletons).values():
+            leader = group[0]
+            rig_match = skeleton_index.get_rig_match(leader)
+            if rig_match is None:
+                all_joint_names = [Sdf.Path(joint).name for joint in leader.GetJointsAttr().Get() or []]
+                ranked = self.rig_registry.rank(all_joint_names)
+                if ranked:
+                    best = ranked[0]
+                    log_warn(
+                        "Unsupported rig %s (closest: %s, %d of %d joints)"
+                        % (leader.GetPath(), self.rig_mappings[best.index]["display_name"], best.matched, best.total)
+                    )
+                else:
+                    log_warn("Unsupported rig %s" % leader.GetPath())
+                continue
+            if self.selected_rig_index is None:
+                self.selected_rig_index = rig_match.index
+            drivers.append(
+                SkeletonDriver(
+                    stage,
+                    leader,
+                    self.rig_mappings[rig_match.index],
+                    self.skel_cache,
+                    followers=group[1:],
+                    joint_namespace=rig_match.namespace,
+                    compiled_rigs=self.compiled_rigs,
+                )
             )
-        )
-        local_translations_attr.Set(local_translations, 0)
 
-        self.motion_skel_anim.GetRotationsAttr().Set(anim_rotations, 0)
-        # self.motion_skel_anim.GetBlendShapeWeightsAttr().Set(fd.faces,0)
+        assert drivers, "Unsupported rig"
+        # set up for full frames at selection, so a stream's first frame doesn't pay for it
+        for driver in drivers:
+            driver.init_animation(FULL_LAYOUT.joint_names, FULL_LAYOUT)
+        return drivers
 
-    def _init_animation(self,selected_joints):
+    def get_skeleton_index(self):
+        # built on first use for the open stage, then maintained from change notices
+        stage = omni.usd.get_context().get_stage()
+        if self.skeleton_index is None or self.skeleton_index.stage != stage:
+            if self.skeleton_index is not None:
+                self.skeleton_index.close()
+            self.skeleton_index = SkeletonIndex(stage, self.rig_registry)
+        return self.skeleton_index
+
+    def get_drivable_skeletons(self):
+        return self.get_skeleton_index().drivable_skeletons()
+
+    def _record_frame(self, session, fd):
+        # a take holds one animation: the first character's (its followers share it); other
+        # skeleton groups of the session are not recorded. Time codes follow the frames' capture
+        # times, so frames applied in a burst after a stall keep their real spacing.
+        if self.record_requested:
+            if not self.take_recorder.recording:
+                self._start_take()
+            driver = self.drivers[0]
+            self.take_recorder.add_frame(driver.rotations, driver.root_translation, session.frame_time)
+
+    def start_recording(self):
+        # the take starts with the next applied frame, once the animation prim exists
+        self.record_requested = True
+
+    def stop_recording(self):
+        self.record_requested = False
+        take_path = self.take_recorder.stop()
+        if take_path:
+            log_info("Recorded take %s (%d frames)" % (take_path, self.take_recorder.frames_recorded))
+        return take_path
+
+    def _start_take(self):
         stage = omni.usd.get_context().get_stage()
-        rig_mapping = self.rig_mappings[self.selected_rig_index]["joint_mappings"]
-        skel_query = self.skel_cache.GetSkelQuery(self.target_skeleton)
-        joint_tokens = skel_query.GetJointOrder()
-        joint_names = {Sdf.Path(token).name: token for token in joint_tokens}
-        joint_token_indices = {token: index for index, token in enumerate(joint_tokens)}
-
-        motion_to_token = {
-            value: joint_names[key] for key, value in rig_mapping.items() if value in selected_joints
-        }
-        anim_tokens = Vt.TokenArray(motion_to_token.values())
-        assert len(anim_tokens) > 0
-        anim_token_indices = {token: index for index, token in enumerate(anim_tokens)}
-        active_token_indices = [joint_token_indices[token] for token in anim_tokens]
-        self.motion_to_anim_index = {
-            motion_name: anim_token_indices[token] for motion_name, token in motion_to_token.items()
-        }
-
-        self.anim_topology = UsdSkel.Topology([Sdf.Path(token) for token in anim_tokens])
-        assert self.anim_topology.Validate()
-
-       
-        anim_path = self.target_skeleton.GetPath().AppendChild("SkelRoot")
-       
-        self.motion_skel_anim = UsdSkel.Animation.Define(stage, anim_path)
-        self.motion_skel_anim.GetJointsAttr().Set(anim_tokens)
-        # self.motion_skel_anim.GetBlendShapesAttr().Set(anim_tokens)
-
-        binding = UsdSkel.BindingAPI.Apply(self.target_skeleton.GetPrim())
-        binding.CreateAnimationSourceRel().SetTargets([self.motion_skel_anim.GetPrim().GetPath()])
-
-        root_xform = Gf.Matrix4d()
-        root_xform.SetIdentity()
-        root_xform = self.rest_xform_adjust
-        identity_xform = Gf.Matrix4d()
-        identity_xform.SetIdentity()
-
-        rest_xforms_local = self.target_skeleton.GetRestTransformsAttr().Get()
-        assert rest_xforms_local, "Skeleton has no restTransforms"
-        skel_topology = skel_query.GetTopology()
-
-
-        anim_start_index = active_token_indices[0]
-        xform_accum = Gf.Matrix4d()
-        xform_accum.SetIdentity()
-        index = skel_topology.GetParent(anim_start_index)
-        while index >= 0:
-            xform_accum = rest_xforms_local[index] * xform_accum
-            rest_xforms_local[index] = identity_xform
-            index = skel_topology.GetParent(index)
-
-        rest_xforms_local[anim_start_index] = xform_accum * rest_xforms_local[anim_start_index]
-
-        self.target_skeleton.GetRestTransformsAttr().Set(rest_xforms_local)
-
-        rest_xforms_global = UsdSkel.ConcatJointTransforms(skel_topology, rest_xforms_local, root_xform)
-
-        self.rest_xforms_anim_global = Vt.Matrix4dArray([rest_xforms_global[i] for i in active_token_indices])
-
-        base_xforms_anim_local = UsdSkel.ComputeJointLocalTransforms(
-            self.anim_topology, self.rest_xforms_anim_global, identity_xform
+        take_path = get_take_path(stage, self.target_skeleton.GetPath())
+        driver = self.drivers[0]
+        self.take_recorder.start(
+            driver.motion_skel_anim, driver.pose_solver.root_index, take_path, stage.GetTimeCodesPerSecond()
         )
-
-        self.motion_skel_anim.SetTransforms(base_xforms_anim_local, 0)
-        self.selected_joints = set(selected_joints)
+        log_info("Recording take %s" % take_path)
 
     def update_ui(self, dt):
         try:
+            self.commit_sessions()
             self.ui_controller.update_ui()
         except:
             self.disconnect("Error updating UI")
@@ -264,7 +278,39 @@ class MotionverseExtension(omni.ext.IExt):
         self.ui_controller.shutdown()
         self.ui_controller = None
         self.disconnect("Extension is shutting down")
+        for session in list(self.sessions):
+            self.remove_session(session)
+        if self.skeleton_index is not None:
+            self.skeleton_index.close()
+            self.skeleton_index = None
+
+
+    @property
+    def frame_queue(self):
+        return self.session.frame_queue if self.session is not None else None
+
+    @property
+    def queue_depth(self):
+        return self.frame_queue.depth if self.frame_queue is not None else 0
 
+    @property
+    def session_state(self):
+        # idle, connecting, streaming or backoff (waiting to reconnect)
+        return self.session.state if self.session is not None else SESSION_IDLE
+
+    @property
+    def frames_dropped(self):
+        return self.frame_queue.frames_dropped if self.frame_queue is not None else 0
+
+    @property
+    def metrics_summary(self):
+        if self.session is None or self.session.metrics is None:
+            return ""
+        return self.session.metrics.summary()
+
+    @property
+    def recording(self):
+        return self.record_requested
 
     @property
     def ready_to_stream(self):
@@ -0,0 +1,243 @@
+import numpy as np
+
+# Joint order of the body block in every Motionverse frame
+BODY_POSE_NAMES = (
+    "Hips", "LeftUpLeg", "RightUpLeg", "LeftLeg", "RightLeg", "LeftFoot", "RightFoot", "Spine", "Spine1", "Neck",
+    "Head", "LeftShoulder", "RightShoulder", "LeftArm", "RightArm", "LeftForeArm", "RightForeArm", "LeftHand",
+    "RightHand", "LeftToeBase", "RightToeBase", "LeftHandThumb1", "LeftHandThumb2", "LeftHandThumb3", "LeftHandIndex1",
+    "LeftHandIndex2", "LeftHandIndex3", "LeftHandMiddle1", "LeftHandMiddle2", "LeftHandMiddle3", "LeftHandRing1",
+    "LeftHandRing2", "LeftHandRing3", "LeftHandPinky1", "LeftHandPinky2", "LeftHandPinky3", "RightHandThumb1",
+    "RightHandThumb2", "RightHandThumb3", "RightHandIndex1", "RightHandIndex2", "RightHandIndex3", "RightHandMiddle1",
+    "RightHandMiddle2", "RightHandMiddle3", "RightHandRing1", "RightHandRing2", "RightHandRing3", "RightHandPinky1",
+    "RightHandPinky2", "RightHandPinky3",
+)
+
+# Order of the face coefficients in every Motionverse frame (ARKit names)
+FACE_CHANNEL_NAMES = (
+    "eyeBlinkRight", "eyeLookDownRight", "eyeLookInRight", "eyeLookOutRight", "eyeLookUpRight", "eyeSquintRight",
+    "eyeWideRight", "eyeBlinkLeft", "eyeLookDownLeft", "eyeLookInLeft", "eyeLookOutLeft", "eyeLookUpLeft",
+    "eyeSquintLeft", "eyeWideLeft", "jawForward", "jawRight", "jawLeft", "jawOpen", "mouthClose", "mouthFunnel",
+    "mouthPucker", "mouthRight", "mouthLeft", "mouthSmileRight", "mouthSmileLeft", "mouthFrownRight", "mouthFrownLeft",
+    "mouthDimpleRight", "mouthDimpleLeft", "mouthStretchRight", "mouthStretchLeft", "mouthRollLower", "mouthRollUpper",
+    "mouthShrugLower", "mouthShrugUpper", "mouthPressRight", "mouthPressLeft", "mouthLowerDownRight",
+    "mouthLowerDownLeft", "mouthUpperUpRight", "mouthUpperUpLeft", "browDownRight", "browDownLeft", "browInnerUp",
+    "browOuterUpRight", "browOuterUpLeft", "cheekPuff", "cheekSquintRight", "cheekSquintLeft", "noseSneerRight",
+    "noseSneerLeft",
+)
+
+NUM_FACE_CHANNELS = 51
+NUM_BODY_JOINTS = 52
+BODY_CHANNELS = 7  # quaternion (x, y, z, w) + position
+
+# One frame on the wire: 51 face floats followed by a (52, 7) pose block, native float32
+FRAME_DTYPE = np.dtype(
+    [
+        ("faces", np.float32, (NUM_FACE_CHANNELS,)),
+        ("body", np.float32, (NUM_BODY_JOINTS, BODY_CHANNELS)),
+    ]
+)
+FRAME_SIZE = FRAME_DTYPE.itemsize
+
+# Protocol version 2 prefixes every frame with a sequence number and the sender's monotonic
+# clock in seconds
+FRAME_DTYPE_V2 = np.dtype(
+    [
+        ("sequence", "<u8"),
+        ("timestamp", "<f8"),
+        ("faces", np.float32, (NUM_FACE_CHANNELS,)),
+        ("body", np.float32, (NUM_BODY_JOINTS, BODY_CHANNELS)),
+    ]
+)
+FRAME_SIZE_V2 = FRAME_DTYPE_V2.itemsize
+
+# Joint positions in a FrameLayout: none, the first joint's only (the root), or every joint's
+LAYOUT_POSITIONS_NONE = 0
+LAYOUT_POSITIONS_ROOT = 1
+LAYOUT_POSITIONS_ALL = 2
+ROTATION_CHANNELS = 4
+
+
+def body_pose_indices(names):
+    index = {name: i for i, name in enumerate(BODY_POSE_NAMES)}
+    return np.array([index[name] for name in names], dtype=np.intp)
+
+
+def face_channel_indices(names):
+    index = {name: i for i, name in enumerate(FACE_CHANNEL_NAMES)}
+    return np.array([index[name] for name in names], dtype=np.intp)
+
+
+#
+# FrameLayout class
+#
+# The channels a sender streams, announced once per connection when PROTOCOL_FLAG_LAYOUT is
+# negotiated (see protocol.build_layout): which joints make up the body block, which face
+# channels, and which joint positions. Frames then carry only those, after the version 2 header:
+#   faces f32[F], body f32[J, 7] (or f32[J, 4] without positions), root position f32[3]
+# where the root position is only there with LAYOUT_POSITIONS_ROOT. FULL_LAYOUT, every joint
+# with its position and every face channel, is byte for byte a version 2 frame, including the
+# body block's last row that no joint uses (body_rows).
+#
+class FrameLayout:
+    def __init__(self, joint_names=BODY_POSE_NAMES, face_names=FACE_CHANNEL_NAMES, positions=LAYOUT_POSITIONS_ALL,
+                 body_rows=None):
+        self.joint_names = tuple(joint_names)
+        self.face_names = tuple(face_names)
+        self.positions = positions
+        self.body_rows = body_rows or len(self.joint_names)
+        body_channels = BODY_CHANNELS if positions == LAYOUT_POSITIONS_ALL else ROTATION_CHANNELS
+        fields = [
+            ("sequence", "<u8"),
+            ("timestamp", "<f8"),
+            ("faces", np.float32, (len(self.face_names),)),
+            ("body", np.float32, (self.body_rows, body_channels)),
+        ]
+        if positions == LAYOUT_POSITIONS_ROOT:
+            fields.append(("root", np.float32, (3,)))
+        self.dtype = np.dtype(fields)
+        self.frame_size = self.dtype.itemsize
+        self._joint_rows = {name: i for i, name in enumerate(self.joint_names)}
+        self._face_rows = {name: i for i, name in enumerate(self.face_names)}
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, FrameLayout) and self.joint_names == other.joint_names
+            and self.face_names == other.face_names and self.positions == other.positions
+            and self.body_rows == other.body_rows
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.joint_names, self.face_names, self.positions, self.body_rows))
+
+    @property
+    def is_full(self):
+        return self == FULL_LAYOUT
+
+    def joint_rows(self, names):
+        return np.array([self._joint_rows[name] for name in names], dtype=np.intp)
+
+    def face_rows(self, names):
+        # (positions in names, rows in the frame) of the channels this layout carries
+        present = [i for i, name in enumerate(names) if name in self._face_rows]
+        return np.array(present, dtype=np.intp), np.array([self._face_rows[names[i]] for i in present], dtype=np.intp)
+
+    def describe(self):
+        positions = ("no positions", "root position", "positions")[self.positions]
+        return "%d joints, %d face channels, %s" % (len(self.joint_names), len(self.face_names), positions)
+
+
+FULL_LAYOUT = FrameLayout(body_rows=NUM_BODY_JOINTS)
+
+
+#
+# BodyGather class
+#
+# Copies the rows a rig uses out of the body block of one layout into the solver's (J,7) block,
+# compiled once when the layout is known. Without positions the position columns stay zero
+# apart from the root's, which comes from the frame's root position if it has one.
+#
+class BodyGather:
+    def __init__(self, layout, names):
+        self.layout = layout
+        self.indices = layout.joint_rows(names)
+        if layout.positions == LAYOUT_POSITIONS_ROOT:
+            self.root_rows = np.flatnonzero(self.indices == 0)
+        else:
+            self.root_rows = None
+        self._rotations = np.zeros((len(self.indices), ROTATION_CHANNELS), dtype=np.float32)
+
+    def __call__(self, fd, out):
+        if self.layout.positions == LAYOUT_POSITIONS_ALL:
+            return np.take(fd.body_data, self.indices, axis=0, out=out)
+        np.take(fd.body_data, self.indices, axis=0, out=self._rotations)
+        out[:, :ROTATION_CHANNELS] = self._rotations
+        out[:, ROTATION_CHANNELS:] = 0.0
+        if self.root_rows is not None:
+            out[self.root_rows, ROTATION_CHANNELS:] = fd.root_position
+        return out
+
+
+#
+# FaceGather class
+#
+# Face coefficients of one layout in a mesh's blend shape order (channel names per blend
+# shape), compiled once per layout; channels the layout doesn't carry stay at zero weight.
+#
+class FaceGather:
+    def __init__(self, layout, names):
+        self.targets, self.indices = layout.face_rows(names)
+        self.complete = len(self.targets) == len(names)
+        self.missing = np.setdiff1d(np.arange(len(names)), self.targets)
+
+    def __call__(self, fd, out):
+        if self.complete:
+            return np.take(fd.faces, self.indices, out=out)
+        out[self.targets] = fd.faces[self.indices]
+        out[self.missing] = 0.0
+        return out
+
+
+#
+# FrameDetections class
+#
+# Views a received message in place; faces and body_data alias the message buffer, so
+# they are only valid for as long as the buffer is. Messages are parsed with the layout the
+# connection negotiated; with the full layout version 1 and 2 frames are told apart by size.
+#
+class FrameDetections:
+    __slots__ = ("faces", "body_data", "root_position", "sequence", "timestamp", "layout")
+
+    def __init__(self, layout=FULL_LAYOUT):
+        self.faces = None
+        self.body_data = None
+        self.root_position = None
+        # only carried by protocol version 2 frames
+        self.sequence = None
+        self.timestamp = None
+        self.layout = layout
+
+    @property
+    def body_pose_names(self):
+        return self.layout.joint_names
+
+    def ParseFromString(self, value):
+        layout = self.layout
+        if layout is not FULL_LAYOUT:
+            record = np.frombuffer(value, dtype=layout.dtype, count=1)
+            self.sequence = int(record["sequence"][0])
+            self.timestamp = float(record["timestamp"][0])
+            self.faces = record["faces"][0]
+            self.body_data = record["body"][0]
+            self.root_position = record["root"][0] if layout.positions == LAYOUT_POSITIONS_ROOT else None
+            return self
+        self.root_position = None
+        if len(value) == FRAME_SIZE_V2:
+            record = np.frombuffer(value, dtype=FRAME_DTYPE_V2, count=1)
+            self.sequence = int(record["sequence"][0])
+            self.timestamp = float(record["timestamp"][0])
+        else:
+            record = np.frombuffer(value, dtype=FRAME_DTYPE, count=1)
+            self.sequence = None
+            self.timestamp = None
+        self.faces = record["faces"][0]
+        self.body_data = record["body"][0]
+        return self
+
+    def gather_body(self, indices, out=None):
+        # Copy out only the joint rows a rig mapping uses, optionally into a preallocated (J,7) buffer
+        return np.take(self.body_data, indices, axis=0, out=out)
+
+    def gather_faces(self, indices, out=None):
+        # Face coefficients reordered to a mesh's blend shape order
+        return np.take(self.faces, indices, out=out)
+
+    @property
+    def body_poses(self):
+        # Per-joint dict view kept for older callers; allocates, so keep it off the hot path
+        return [
+            {"rotation": self.body_data[idx][:4], "position": self.body_data[idx][4:]}
+            for idx in range(len(self.body_pose_names))
+        ]
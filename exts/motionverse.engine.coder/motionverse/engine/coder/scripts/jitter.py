@@ -0,0 +1,130 @@
+import numpy as np
+
+from .constants import *
+
+# Below this angle between two quaternions slerp is replaced by nlerp, which is then exact to
+# float32 precision and avoids dividing by a vanishing sin(theta)
+SLERP_DOT_THRESHOLD = 0.9995
+
+
+def slerp_quats(q0, q1, t, out=None):
+    # (J,4) x (J,4) -> (J,4) spherical interpolation along the shorter arc, all joints at once
+    q0 = np.asarray(q0, dtype=np.float32)
+    q1 = np.asarray(q1, dtype=np.float32)
+    dot = np.einsum("ij,ij->i", q0, q1)
+    sign = np.where(dot < 0, -1.0, 1.0).astype(np.float32)
+    dot = np.minimum(np.abs(dot), 1.0)
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+    linear = dot > SLERP_DOT_THRESHOLD
+    safe_sin = np.where(linear, 1.0, sin_theta)
+    w0 = np.where(linear, 1.0 - t, np.sin((1.0 - t) * theta) / safe_sin)
+    w1 = np.where(linear, t, np.sin(t * theta) / safe_sin) * sign
+    if out is None:
+        out = np.empty_like(q0)
+    np.multiply(q0, w0[:, None], out=out)
+    out += q1 * w1[:, None]
+    out /= np.linalg.norm(out, axis=1, keepdims=True)
+    return out
+
+
+#
+# JitterBuffer class
+#
+# Holds the most recent solved poses with their capture times and is sampled at the app's update
+# rate, `delay` seconds behind the newest input, so irregular arrival no longer shows up as
+# uneven motion. Rotations are slerped and the root translation and blend shape weights are
+# lerped between the two frames bracketing the sample time. Storage is preallocated; pushing a
+# frame and sampling are a handful of array copies and one batched slerp. While the sample holds
+# a frame it already returned (waiting for the delay, or the stream stalled or stopped), sample()
+# returns None, so an unchanged pose is not written again.
+#
+class JitterBuffer:
+    def __init__(self, num_joints, num_weights=0, delay=DEFAULT_JITTER_DELAY, capacity=JITTER_BUFFER_CAPACITY):
+        self.delay = delay
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.rotations = np.zeros((capacity, num_joints, 4), dtype=np.float32)
+        self.root_translations = np.zeros((capacity, 3), dtype=np.float32)
+        self.weights = np.zeros((capacity, num_weights), dtype=np.float32)
+        self.rotations_out = np.zeros((num_joints, 4), dtype=np.float32)
+        self.root_translation_out = np.zeros(3, dtype=np.float32)
+        self.weights_out = np.zeros(num_weights, dtype=np.float32)
+        self._start = 0
+        self._count = 0
+        # capture time of the newest frame the samples have reached
+        self.sampled_time = None
+        self._held_time = None
+        self.frames_late = 0
+        self.frames_overflowed = 0
+        self.underruns = 0
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        self._start = 0
+        self._count = 0
+        self.sampled_time = None
+        self._held_time = None
+
+    def push(self, frame_time, rotations, root_translation, weights=None):
+        capacity = self.capacity
+        if self._count:
+            if frame_time <= self.times[(self._start + self._count - 1) % capacity]:
+                # arrived after a newer frame; too late to play
+                self.frames_late += 1
+                return
+            if self._count == capacity:
+                self._start = (self._start + 1) % capacity
+                self._count -= 1
+                self.frames_overflowed += 1
+        index = (self._start + self._count) % capacity
+        self.times[index] = frame_time
+        self.rotations[index] = rotations
+        self.root_translations[index] = root_translation
+        if weights is not None:
+            self.weights[index] = weights
+        self._count += 1
+
+    def sample(self, now):
+        # pose at now - delay; None until the first frame arrives and while it would not change
+        if not self._count:
+            return None
+        capacity = self.capacity
+        sample_time = now - self.delay
+        # sample times only move forward, so frames before the bracketing pair are done with
+        while self._count > 1 and self.times[(self._start + 1) % capacity] <= sample_time:
+            self._start = (self._start + 1) % capacity
+            self._count -= 1
+        i0 = self._start
+        self.sampled_time = self.times[i0]
+        if self._count == 1 or sample_time <= self.times[i0]:
+            if sample_time > self.times[i0]:
+                # the stream fell behind the delay: hold the newest pose
+                self.underruns += 1
+            if self._held_time == self.times[i0]:
+                return None
+            self._held_time = self.times[i0]
+            self.rotations_out[:] = self.rotations[i0]
+            self.root_translation_out[:] = self.root_translations[i0]
+            self.weights_out[:] = self.weights[i0]
+        else:
+            self._held_time = None
+            i1 = (i0 + 1) % capacity
+            t = (sample_time - self.times[i0]) / (self.times[i1] - self.times[i0])
+            slerp_quats(self.rotations[i0], self.rotations[i1], t, self.rotations_out)
+            np.add(
+                self.root_translations[i0] * (1.0 - t), self.root_translations[i1] * t, out=self.root_translation_out
+            )
+            np.add(self.weights[i0] * (1.0 - t), self.weights[i1] * t, out=self.weights_out)
+        return self.rotations_out, self.root_translation_out, self.weights_out
+
+    def get_stats(self):
+        return {
+            "delay": self.delay,
+            "buffered": self._count,
+            "late": self.frames_late,
+            "overflowed": self.frames_overflowed,
+            "underruns": self.underruns,
+        }
@@ -0,0 +1,30 @@
+import logging
+
+try:
+    import carb
+except ImportError:
+    # outside Kit, as in the headless benchmarks under bench/
+    carb = None
+
+_logger = logging.getLogger("motionverse")
+
+
+def log_info(msg):
+    if carb is None:
+        _logger.info(msg)
+    else:
+        carb.log_info("{}".format(msg))
+
+
+def log_warn(msg):
+    if carb is None:
+        _logger.warning(msg)
+    else:
+        carb.log_warn("{}".format(msg))
+
+
+def log_error(msg):
+    if carb is None:
+        _logger.error(msg)
+    else:
+        carb.log_error("{}".format(msg))
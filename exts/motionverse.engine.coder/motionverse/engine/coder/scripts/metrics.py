@@ -0,0 +1,141 @@
+import bisect
+import math
+import threading
+import time
+
+# Histogram buckets: 4 per octave from 1 us to ~17 s
+HISTOGRAM_BOUNDS = tuple(1e-6 * 2 ** (i / 4.0) for i in range(97))
+
+
+#
+# Histogram class
+#
+# Fixed log-spaced buckets, so adding a sample is a bisect and an increment and memory stays
+# constant however long a stream runs. Percentiles are reported as the upper bound of the
+# bucket they fall in (within 19% of the true value).
+#
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * q / 100.0)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return HISTOGRAM_BOUNDS[index] if index < len(HISTOGRAM_BOUNDS) else self.max
+        return self.max
+
+    def get_stats(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+#
+# StreamMetrics class
+#
+# Counters and timing histograms for one stream session. Sessions and drivers only touch it
+# when one is attached (session.metrics is None otherwise), so disabled metrics cost a single
+# attribute check per frame. With the solver thread on, decode and solve times come from the
+# worker thread; the stage histograms are only touched under a lock.
+#
+class StreamMetrics:
+    STAGES = ("receive", "decode", "solve", "author")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {stage: Histogram() for stage in self.STAGES}
+        self.start_time = time.perf_counter()
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.frames_applied = 0
+        self.queue_depth_total = 0
+        self.queue_depth_max = 0
+        self.inter_arrival = Histogram()
+        # RFC 3550 style running estimate of the inter-arrival deviation, in seconds
+        self.jitter = 0.0
+        self._last_arrival = None
+        self._last_interval = None
+
+    def frame_received(self, nbytes, receive_time):
+        # receive_time: from the frame's bytes coming in to the frame being queued for reading,
+        # decoding compact frames included
+        now = time.perf_counter()
+        self.frames_received += 1
+        self.bytes_received += nbytes
+        self.add_time("receive", receive_time)
+        if self._last_arrival is not None:
+            interval = now - self._last_arrival
+            self.inter_arrival.add(interval)
+            if self._last_interval is not None:
+                self.jitter += (abs(interval - self._last_interval) - self.jitter) / 16.0
+            self._last_interval = interval
+        self._last_arrival = now
+
+    def frame_applied(self, queue_depth):
+        self.frames_applied += 1
+        self.queue_depth_total += queue_depth
+        if queue_depth > self.queue_depth_max:
+            self.queue_depth_max = queue_depth
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self.stages[stage].add(seconds)
+
+    def get_stats(self):
+        elapsed = max(time.perf_counter() - self.start_time, 1e-9)
+        stats = {
+            "elapsed": elapsed,
+            "frames_received": self.frames_received,
+            "frames_applied": self.frames_applied,
+            "bytes_per_second": self.bytes_received / elapsed,
+            "frames_per_second": self.frames_applied / elapsed,
+            "queue_depth_mean": self.queue_depth_total / self.frames_applied if self.frames_applied else 0.0,
+            "queue_depth_max": self.queue_depth_max,
+            "inter_arrival": self.inter_arrival.get_stats(),
+            "jitter": self.jitter,
+        }
+        with self._lock:
+            for stage, histogram in self.stages.items():
+                stats[stage] = histogram.get_stats()
+        return stats
+
+    def summary(self):
+        # one line for the Motionverse window
+        stats = self.get_stats()
+        return "%.0f fps, %.0f KB/s, jitter %.1f ms | decode %.0f / solve %.0f / author %.0f us (p99)" % (
+            stats["frames_per_second"],
+            stats["bytes_per_second"] / 1024.0,
+            stats["jitter"] * 1e3,
+            stats["decode"]["p99"] * 1e6,
+            stats["solve"]["p99"] * 1e6,
+            stats["author"]["p99"] * 1e6,
+        )
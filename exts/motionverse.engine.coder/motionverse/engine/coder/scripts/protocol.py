@@ -0,0 +1,107 @@
+import struct
+
+from .constants import *
+from .frames import FRAME_SIZE, FRAME_SIZE_V2, LAYOUT_POSITIONS_ALL, FrameLayout
+
+# Version negotiation rides on the original b"ov" handshake: the client appends a request and a
+# version 2 server answers with an ack before its first frame. Older servers ignore the request
+# and start streaming version 1 frames; the magic reads as a float32 NaN, which no face
+# coefficient is, so an ack can't be confused with the start of a frame.
+HANDSHAKE = b"ov"
+PROTOCOL_MAGIC = b"MV\xc0\x7f"
+PROTOCOL_REQUEST = struct.Struct("<4sHH")  # magic, highest version the client speaks, flags
+PROTOCOL_ACK = struct.Struct("<4sHHd")  # magic, version in use, flags, server clock in seconds
+FRAME_HEADER = struct.Struct("<Qd")  # version 2 frame prefix: sequence, sender clock in seconds
+# FrameLayout message: magic, layout version, positions, body block rows after the joints' (see
+# FrameLayout.body_rows), joint count, face channel count and the size of the names that follow
+# (joint names, then face channel names, NUL separated ASCII)
+LAYOUT_MAGIC = b"MVLY"
+LAYOUT_HEADER = struct.Struct("<4sHBBHHI")
+LAYOUT_MAX_NAMES_SIZE = 1 << 16
+
+FRAME_SIZES = {1: FRAME_SIZE, 2: FRAME_SIZE_V2}
+
+
+def build_handshake(version=PROTOCOL_VERSION, flags=0):
+    if version < 2:
+        return HANDSHAKE
+    return HANDSHAKE + PROTOCOL_REQUEST.pack(PROTOCOL_MAGIC, version, flags)
+
+
+def parse_request(data):
+    # (highest version a client asks for, flags), or (None, 0) for a plain version 1 handshake
+    if len(data) < PROTOCOL_REQUEST.size:
+        return None, 0
+    magic, version, flags = PROTOCOL_REQUEST.unpack_from(data)
+    return (version, flags) if magic == PROTOCOL_MAGIC else (None, 0)
+
+
+def build_ack(version, server_time, flags=0):
+    return PROTOCOL_ACK.pack(PROTOCOL_MAGIC, version, flags, server_time)
+
+
+def build_layout(layout):
+    names = b"\0".join(name.encode("ascii") for name in layout.joint_names + layout.face_names)
+    num_joints = len(layout.joint_names)
+    header = LAYOUT_HEADER.pack(
+        LAYOUT_MAGIC, LAYOUT_VERSION, layout.positions, layout.body_rows - num_joints, num_joints,
+        len(layout.face_names), len(names)
+    )
+    return header + names
+
+
+def layout_message_size(header):
+    # total size of a layout message from its first LAYOUT_HEADER.size bytes
+    magic, version, positions, padding_rows, num_joints, num_faces, names_size = LAYOUT_HEADER.unpack_from(header)
+    if magic != LAYOUT_MAGIC or names_size > LAYOUT_MAX_NAMES_SIZE:
+        raise ValueError("Expected a frame layout")
+    return LAYOUT_HEADER.size + names_size
+
+
+def parse_layout(data):
+    magic, version, positions, padding_rows, num_joints, num_faces, names_size = LAYOUT_HEADER.unpack_from(data)
+    if magic != LAYOUT_MAGIC or len(data) != LAYOUT_HEADER.size + names_size:
+        raise ValueError("Malformed frame layout (%d bytes)" % len(data))
+    if version != LAYOUT_VERSION or positions > LAYOUT_POSITIONS_ALL:
+        raise ValueError("Unsupported frame layout version %d" % version)
+    names = bytes(data[LAYOUT_HEADER.size:]).split(b"\0") if names_size else []
+    if len(names) != num_joints + num_faces or not num_joints:
+        raise ValueError("Frame layout names %d joints and %d face channels" % (num_joints, num_faces))
+    names = [name.decode("ascii") for name in names]
+    return FrameLayout(names[:num_joints], names[num_joints:], positions, num_joints + padding_rows)
+
+
+def estimate_clock_offset(request_time, ack_time, server_time):
+    # server clock minus client clock, assuming the handshake round trip was symmetric; the
+    # error is at most half the round trip
+    return server_time - 0.5 * (request_time + ack_time)
+
+
+#
+# SequenceTracker class
+#
+# Counts missing and out of order frames from version 2 sequence numbers, as they arrive and
+# before any queue policy drops frames on purpose.
+#
+class SequenceTracker:
+    def __init__(self):
+        self.last_sequence = None
+        self.gaps = 0
+        self.frames_lost = 0
+        self.frames_reordered = 0
+
+    def update(self, sequence):
+        # False for a frame older than one already seen
+        last_sequence = self.last_sequence
+        if last_sequence is not None:
+            if sequence <= last_sequence:
+                self.frames_reordered += 1
+                return False
+            if sequence > last_sequence + 1:
+                self.gaps += 1
+                self.frames_lost += sequence - last_sequence - 1
+        self.last_sequence = sequence
+        return True
+
+    def get_stats(self):
+        return {"gaps": self.gaps, "lost": self.frames_lost, "reordered": self.frames_reordered}
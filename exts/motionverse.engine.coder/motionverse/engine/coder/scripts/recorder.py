@@ -0,0 +1,133 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+from pxr import Vt, Sdf
+
+from .constants import *
+
+#
+# TakeRecorder class
+#
+# Captures solved poses into a detached Sdf layer as time samples on a SkelAnimation prim.
+# Frames are buffered in preallocated arrays and committed every `flush_frames` frames inside a
+# single Sdf.ChangeBlock; the take layer is not part of the stage, so recording causes no
+# recomposition or Hydra updates while streaming. stop() exports the take to its own file.
+#
+class TakeRecorder:
+    def __init__(self, flush_frames=RECORD_FLUSH_FRAMES):
+        self.flush_frames = flush_frames
+        self.layer = None
+        self.take_path = None
+        self.takes = []
+        self._time_origin = None
+
+    @property
+    def recording(self):
+        return self.layer is not None
+
+    def start(self, skel_anim, root_index, take_path, time_codes_per_second=24.0, start_time_code=0.0):
+        assert not self.recording, "A take is already being recorded"
+        anim_path = skel_anim.GetPrim().GetPath()
+        joints = skel_anim.GetJointsAttr().Get()
+        translations = skel_anim.GetTranslationsAttr().Get(0)
+        assert joints, "Animation has no joints"
+
+        self.layer = Sdf.Layer.CreateAnonymous(os.path.basename(take_path))
+        self.layer.timeCodesPerSecond = time_codes_per_second
+        self.layer.framesPerSecond = time_codes_per_second
+        self.take_path = take_path
+
+        prim_spec = Sdf.CreatePrimInLayer(self.layer, anim_path)
+        prim_spec.specifier = Sdf.SpecifierDef
+        prim_spec.typeName = "SkelAnimation"
+        joints_spec = Sdf.AttributeSpec(prim_spec, "joints", Sdf.ValueTypeNames.TokenArray, Sdf.VariabilityUniform)
+        joints_spec.default = joints
+        scales_spec = Sdf.AttributeSpec(prim_spec, "scales", Sdf.ValueTypeNames.Half3Array)
+        scales = skel_anim.GetScalesAttr().Get(0)
+        if scales:
+            scales_spec.default = scales
+        self._rotations_path = Sdf.AttributeSpec(prim_spec, "rotations", Sdf.ValueTypeNames.QuatfArray).path
+        self._translations_path = Sdf.AttributeSpec(prim_spec, "translations", Sdf.ValueTypeNames.Float3Array).path
+
+        num_joints = len(joints)
+        self._base_translations = np.array(translations, dtype=np.float32).reshape(num_joints, 3)
+        self._time_codes = np.empty(self.flush_frames)
+        self._rotations = np.empty((self.flush_frames, num_joints, 4), dtype=np.float32)
+        self._root_translations = np.empty((self.flush_frames, 3), dtype=np.float32)
+        self._root_index = root_index
+        self._count = 0
+        self._time_origin = None
+        self._time_codes_per_second = time_codes_per_second
+        self._start_time_code = start_time_code
+        self._last_time_code = None
+        self.frames_recorded = 0
+
+    def add_frame(self, rotations, root_translation, timestamp=None):
+        # timestamp is in seconds (arrival time by default, or a sender timestamp)
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        if self._time_origin is None:
+            self._time_origin = timestamp
+        time_code = self._start_time_code + (timestamp - self._time_origin) * self._time_codes_per_second
+        if self._last_time_code is not None and time_code <= self._last_time_code:
+            return
+        self._last_time_code = time_code
+
+        i = self._count
+        self._time_codes[i] = time_code
+        self._rotations[i] = rotations
+        self._root_translations[i] = root_translation
+        self._count += 1
+        self.frames_recorded += 1
+        if self._count == self.flush_frames:
+            self.flush()
+
+    def flush(self):
+        count = self._count
+        if not count:
+            return
+        translations = np.repeat(self._base_translations[None], count, axis=0)
+        translations[:, self._root_index] = self._root_translations[:count]
+        with Sdf.ChangeBlock():
+            for i in range(count):
+                time_code = float(self._time_codes[i])
+                self.layer.SetTimeSample(self._rotations_path, time_code, Vt.QuatfArray.FromNumpy(self._rotations[i]))
+                self.layer.SetTimeSample(self._translations_path, time_code, Vt.Vec3fArray.FromNumpy(translations[i]))
+        self._count = 0
+
+    def stop(self):
+        if not self.recording:
+            return None
+        self.flush()
+        if self._last_time_code is not None:
+            self.layer.startTimeCode = self._start_time_code
+            self.layer.endTimeCode = self._last_time_code
+        directory = os.path.dirname(self.take_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.layer.Export(self.take_path)
+        take_path = self.take_path
+        self.takes.append(take_path)
+        self.layer = None
+        self.take_path = None
+        return take_path
+
+
+def get_output_directory(stage, directory_name):
+    # next to the stage file, or in the temp directory for a stage that was never saved
+    root_layer = stage.GetRootLayer()
+    if root_layer.anonymous or not root_layer.realPath:
+        return os.path.join(tempfile.gettempdir(), directory_name)
+    return os.path.join(os.path.dirname(root_layer.realPath), directory_name)
+
+
+def get_take_path(stage, skeleton_path):
+    name = "%s_%s.usd" % (Sdf.Path(skeleton_path).name, time.strftime("%Y%m%d_%H%M%S"))
+    return os.path.join(get_output_directory(stage, TAKE_DIRECTORY_NAME), name)
+
+
+def get_capture_path(stage, source_name):
+    name = "%s_%s%s" % (source_name.replace(":", "_"), time.strftime("%Y%m%d_%H%M%S"), CAPTURE_FILE_EXTENSION)
+    return os.path.join(get_output_directory(stage, CAPTURE_DIRECTORY_NAME), name)
@@ -0,0 +1,247 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from pxr import Vt, Gf, UsdSkel, Sdf
+
+from .constants import COMPILED_RIG_VERSION
+from .rigs import strip_namespace
+
+
+def fingerprint(joints, rest_xforms, decimals=5):
+    # joint order plus rest pose, rounded so float noise from different exporters still matches
+    digest = hashlib.sha1("\n".join(joints).encode("utf-8"))
+    if rest_xforms:
+        rest = np.round(np.array(rest_xforms, dtype=np.float64), decimals) + 0.0
+        digest.update(rest.tobytes())
+    return digest.hexdigest()
+
+
+def skeleton_fingerprint(skeleton, decimals=5):
+    return fingerprint(skeleton.GetJointsAttr().Get() or [], skeleton.GetRestTransformsAttr().Get(), decimals)
+
+
+def selection_key(rig_mapping, selected_joints, joint_namespace):
+    # everything besides the skeleton that a compiled rig depends on
+    joint_mappings = rig_mapping["joint_mappings"]
+    key = {
+        "version": COMPILED_RIG_VERSION,
+        "joint_mappings": joint_mappings,
+        "skel_root_rotate_xyz": rig_mapping["skel_root_rotate_xyz"],
+        "joint_namespace": joint_namespace,
+        "selected_joints": sorted(set(joint_mappings.values()).intersection(selected_joints)),
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def to_matrix_array(a):
+    return Vt.Matrix4dArray.FromNumpy(np.ascontiguousarray(a, dtype=np.float64).reshape(-1, 4, 4))
+
+
+#
+# CompiledRig class
+#
+# What driving one skeleton with one rig mapping and joint selection takes, worked out once:
+# the animation's joint tokens and topology, the motion joint -> animation joint map and the
+# rest matrices the solver starts from. The skeleton's rest pose is rewritten so the joints
+# above the first animated one are identity (their transforms folded into it), which lets the
+# solver's root rotation stand for the whole chain. The rewrite is always computed from the
+# rest pose the skeleton had before any rewrite (source_rest_xforms), so doing it again, or for
+# another joint selection, never compounds.
+#
+class CompiledRig:
+    def __init__(self, anim_tokens, motion_names, active_token_indices, anim_parents, rest_xforms_local,
+                 rest_xforms_anim_global, base_xforms_anim_local, source_fingerprint, rest_fingerprint):
+        self.anim_tokens = list(anim_tokens)
+        self.motion_names = list(motion_names)
+        self.motion_to_token = dict(zip(self.motion_names, self.anim_tokens))
+        self.motion_to_anim_index = {motion_name: index for index, motion_name in enumerate(self.motion_names)}
+        self.active_token_indices = np.asarray(active_token_indices, dtype=np.intp)
+        self.anim_topology = UsdSkel.Topology(Vt.IntArray([int(parent) for parent in anim_parents]))
+        self.rest_xforms_local = rest_xforms_local
+        self.rest_xforms_anim_global = rest_xforms_anim_global
+        self.base_xforms_anim_local = base_xforms_anim_local
+        self.source_fingerprint = source_fingerprint
+        self.rest_fingerprint = rest_fingerprint
+
+    def save(self, file):
+        np.savez(
+            file,
+            anim_tokens=np.array(self.anim_tokens),
+            motion_names=np.array(self.motion_names),
+            active_token_indices=self.active_token_indices,
+            anim_parents=np.array(self.anim_topology.GetParentIndices(), dtype=np.intp),
+            rest_xforms_local=np.array(self.rest_xforms_local),
+            rest_xforms_anim_global=np.array(self.rest_xforms_anim_global),
+            base_xforms_anim_local=np.array(self.base_xforms_anim_local),
+            fingerprints=np.array([self.source_fingerprint, self.rest_fingerprint]),
+        )
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file, allow_pickle=False) as data:
+            source_fingerprint, rest_fingerprint = data["fingerprints"].tolist()
+            return cls(
+                data["anim_tokens"].tolist(),
+                data["motion_names"].tolist(),
+                data["active_token_indices"],
+                data["anim_parents"],
+                to_matrix_array(data["rest_xforms_local"]),
+                to_matrix_array(data["rest_xforms_anim_global"]),
+                to_matrix_array(data["base_xforms_anim_local"]),
+                source_fingerprint,
+                rest_fingerprint,
+            )
+
+
+def save_source(file, source):
+    source_fingerprint, source_rest_xforms = source
+    np.savez(file, fingerprint=np.array(source_fingerprint), rest_xforms=np.array(source_rest_xforms))
+
+
+def load_source(file):
+    with np.load(file, allow_pickle=False) as data:
+        return str(data["fingerprint"]), to_matrix_array(data["rest_xforms"])
+
+
+def compile_rig(joint_tokens, source_rest_xforms, rig_mapping, selected_joints, joint_namespace, rest_xform_adjust):
+    joint_names = {strip_namespace(Sdf.Path(token).name, joint_namespace): token for token in joint_tokens}
+    joint_token_indices = {token: index for index, token in enumerate(joint_tokens)}
+    motion_to_token = {
+        value: joint_names[key] for key, value in rig_mapping["joint_mappings"].items() if value in selected_joints
+    }
+    anim_tokens = list(motion_to_token.values())
+    assert len(anim_tokens) > 0
+    active_token_indices = [joint_token_indices[token] for token in anim_tokens]
+
+    anim_topology = UsdSkel.Topology([Sdf.Path(token) for token in anim_tokens])
+    assert anim_topology.Validate()
+    skel_topology = UsdSkel.Topology(Vt.TokenArray(joint_tokens))
+
+    assert source_rest_xforms, "Skeleton has no restTransforms"
+    rest_xforms_local = Vt.Matrix4dArray(source_rest_xforms)
+    identity_xform = Gf.Matrix4d()
+    identity_xform.SetIdentity()
+
+    anim_start_index = active_token_indices[0]
+    xform_accum = Gf.Matrix4d()
+    xform_accum.SetIdentity()
+    index = skel_topology.GetParent(anim_start_index)
+    while index >= 0:
+        xform_accum = rest_xforms_local[index] * xform_accum
+        rest_xforms_local[index] = identity_xform
+        index = skel_topology.GetParent(index)
+    rest_xforms_local[anim_start_index] = xform_accum * rest_xforms_local[anim_start_index]
+
+    rest_xforms_global = UsdSkel.ConcatJointTransforms(skel_topology, rest_xforms_local, rest_xform_adjust)
+    rest_xforms_anim_global = Vt.Matrix4dArray([rest_xforms_global[i] for i in active_token_indices])
+    base_xforms_anim_local = UsdSkel.ComputeJointLocalTransforms(
+        anim_topology, rest_xforms_anim_global, identity_xform
+    )
+
+    return CompiledRig(
+        anim_tokens,
+        list(motion_to_token.keys()),
+        active_token_indices,
+        anim_topology.GetParentIndices(),
+        rest_xforms_local,
+        rest_xforms_anim_global,
+        base_xforms_anim_local,
+        fingerprint(joint_tokens, source_rest_xforms),
+        fingerprint(joint_tokens, rest_xforms_local),
+    )
+
+
+#
+# CompiledRigCache class
+#
+# Compiled rigs by skeleton path, skeleton fingerprint (joint order and rest pose) and
+# selection, in memory and, given a directory, on disk so they outlive the Kit session. Every
+# fingerprint a skeleton can show, as found or after a rest rewrite, leads back to its source
+# rest pose, so selecting a skeleton again or streaming to it with another frame layout starts
+# from the same rest pose. A directory that can't be written to is dropped and the cache keeps
+# working in memory.
+#
+class CompiledRigCache:
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._rigs = {}
+        # (skeleton path, fingerprint) -> (source fingerprint, source rest transforms)
+        self._sources = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, skeleton, rig_mapping, selected_joints, joint_namespace, rest_xform_adjust):
+        skeleton_path = str(skeleton.GetPath())
+        joint_tokens = skeleton.GetJointsAttr().Get() or []
+        current_fingerprint = skeleton_fingerprint(skeleton)
+        source = self._get_source(skeleton_path, current_fingerprint)
+        if source is None:
+            # first sight of this skeleton: its rest pose as found is where every rewrite starts
+            source = (current_fingerprint, skeleton.GetRestTransformsAttr().Get())
+            self._add_source(skeleton_path, current_fingerprint, source)
+        source_fingerprint, source_rest_xforms = source
+
+        key = (skeleton_path, source_fingerprint, selection_key(rig_mapping, selected_joints, joint_namespace))
+        rig = self._rigs.get(key)
+        if rig is None:
+            rig = self._load(self._file_path(*key), CompiledRig.load)
+        if rig is None:
+            self.misses += 1
+            rig = compile_rig(
+                joint_tokens, source_rest_xforms, rig_mapping, selected_joints, joint_namespace, rest_xform_adjust
+            )
+            self._save(self._file_path(*key), rig.save)
+        else:
+            self.hits += 1
+        self._rigs[key] = rig
+        if (skeleton_path, rig.rest_fingerprint) not in self._sources:
+            self._add_source(skeleton_path, rig.rest_fingerprint, source)
+        return rig
+
+    def clear(self):
+        self._rigs.clear()
+        self._sources.clear()
+
+    def _get_source(self, skeleton_path, current_fingerprint):
+        source = self._sources.get((skeleton_path, current_fingerprint))
+        if source is None:
+            source = self._load(self._file_path(skeleton_path, current_fingerprint, "source"), load_source)
+            if source is not None:
+                self._sources[(skeleton_path, current_fingerprint)] = source
+        return source
+
+    def _add_source(self, skeleton_path, current_fingerprint, source):
+        self._sources[(skeleton_path, current_fingerprint)] = source
+        path = self._file_path(skeleton_path, current_fingerprint, "source")
+        self._save(path, lambda file: save_source(file, source))
+
+    def _file_path(self, *key):
+        if self.directory is None:
+            return None
+        name = hashlib.sha1("\n".join(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + ".npz")
+
+    def _load(self, path, load):
+        if path is None or not os.path.isfile(path):
+            return None
+        try:
+            with open(path, "rb") as file:
+                return load(file)
+        except (OSError, ValueError, KeyError):
+            # unreadable or from an older format: compiled again and overwritten
+            return None
+
+    def _save(self, path, save):
+        if path is None:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # written aside and moved in place, so a concurrent reader never sees half a file
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as file:
+                save(file)
+            os.replace(temp_path, path)
+        except OSError:
+            self.directory = None
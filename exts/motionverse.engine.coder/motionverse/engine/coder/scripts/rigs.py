@@ -0,0 +1,86 @@
+from collections import Counter, namedtuple
+
+# Namespace separators used by DCC exporters ("mixamorig:Hips"; "mixamorig_Hips" once made a valid USD name)
+NAMESPACE_SEPARATORS = (":", "_")
+
+RigMatch = namedtuple("RigMatch", ["index", "coverage", "matched", "total", "namespace"])
+
+
+def find_namespace(joint_names):
+    # a prefix counts as a namespace when more than half of the joints carry it
+    prefixes = Counter()
+    for name in joint_names:
+        for separator in NAMESPACE_SEPARATORS:
+            position = name.find(separator)
+            if position > 0:
+                prefixes[name[: position + 1]] += 1
+                break
+    if prefixes:
+        prefix, count = prefixes.most_common(1)[0]
+        if count * 2 > len(joint_names):
+            return prefix
+    return ""
+
+
+def strip_namespace(name, namespace):
+    if namespace and name.startswith(namespace):
+        return name[len(namespace):]
+    return name
+
+
+#
+# RigRegistry class
+#
+# Rig profiles indexed by the model joint names they map. Matching a skeleton walks its joints
+# once against a joint -> profiles index, so the cost follows the skeleton size rather than
+# profiles x mapped joints x skeleton joints.
+#
+class RigRegistry:
+    def __init__(self, rig_mappings=()):
+        self.mappings = []
+        self.joint_sets = []
+        self.joint_index = {}
+        for rig_mapping in rig_mappings:
+            self.add(rig_mapping)
+
+    def __len__(self):
+        return len(self.mappings)
+
+    def __getitem__(self, index):
+        return self.mappings[index]
+
+    def add(self, rig_mapping):
+        index = len(self.mappings)
+        joints = frozenset(rig_mapping["joint_mappings"])
+        self.mappings.append(rig_mapping)
+        self.joint_sets.append(joints)
+        for joint in joints:
+            self.joint_index.setdefault(joint, []).append(index)
+        return index
+
+    def rank(self, model_joint_names):
+        # RigMatch for every profile sharing a joint with the skeleton, best coverage first; ties
+        # go to the profile mapping more joints, then to the one loaded first
+        # profiles are scored on the names as given and, if the skeleton has one, with its
+        # namespace removed, since a profile may itself be keyed on prefixed names
+        best = {}
+        namespace = find_namespace(model_joint_names)
+        for namespace in ("", namespace) if namespace else ("",):
+            hits = Counter()
+            for name in set(strip_namespace(name, namespace) for name in model_joint_names):
+                for index in self.joint_index.get(name, ()):
+                    hits[index] += 1
+            for index, count in hits.items():
+                if index not in best or count > best[index].matched:
+                    total = len(self.joint_sets[index])
+                    best[index] = RigMatch(index, count / total, count, total, namespace)
+        matches = list(best.values())
+        matches.sort(key=lambda match: (-match.coverage, -match.total, match.index))
+        return matches
+
+    def match(self, model_joint_names, min_coverage=1.0):
+        # best ranked profile, or None when even that one leaves too many mapped joints missing
+        matches = self.rank(model_joint_names)
+        if matches and matches[0].coverage >= min_coverage:
+            return matches[0]
+        return None
@@ -0,0 +1,508 @@
+import asyncio
+import os
+import time
+import traceback
+
+from .capture import CaptureWriter, CaptureReader, replay_capture
+from .constants import *
+from .frames import FULL_LAYOUT, FrameDetections
+from .metrics import Histogram
+from .protocol import FRAME_HEADER, SequenceTracker
+from .streaming import FrameQueue
+from .transport import open_frame_connection, open_frame_datagram_endpoint
+from .logs import log_info, log_warn, log_error
+from .worker import SolverWorker
+
+#
+# StreamSession class
+#
+# One capture stream: its connection, frame queue and the skeleton drivers it animates.
+# Sessions share Kit's event loop; each one stages solved poses on its drivers and the
+# extension commits every session's writes together once per app update. On the per_update
+# queue policy there is no update task: the network task only keeps the newest frame and the
+# extension calls update() on every app update, so solving and authoring follow the render
+# rate rather than the network rate.
+#
+# With solver_thread set, a SolverWorker decodes and solves the newest frame off the main
+# thread and update() only stages its result. Either way drivers not yet initialized for the
+# stream's frame layout are initialized as soon as it is known, before the first frame.
+#
+# A live session keeps its stream up until it is stopped: a connection that fails, drops or
+# goes quiet (STREAM_READ_TIMEOUT, or DATAGRAM_TIMEOUT over UDP) puts it in backoff, and it
+# connects again after a delay that doubles with every attempt that brought no frame. Drivers
+# keep their animation across reconnects unless the frame layout changes. start() and stop()
+# never wait: they close the connection and cancel the tasks, which wind down on the event loop.
+# A run that was stopped, or replaced by start(), also ends at its next connect or reconnect,
+# since asyncio.wait_for can swallow a cancel on Python before 3.12.
+#
+class StreamSession:
+    def __init__(self, host, port, drivers, queue_policy=DEFAULT_QUEUE_POLICY, rcvbuf=DEFAULT_SO_RCVBUF, name=None,
+                 transport_mode=DEFAULT_TRANSPORT):
+        self.host = host
+        self.port = port
+        self.name = name or "%s:%s" % (host, port)
+        self.drivers = list(drivers)
+        self.queue_policy = queue_policy
+        self.rcvbuf = rcvbuf
+        self.transport_mode = transport_mode
+        self.frame_queue = None
+        self.frames_applied = 0
+        # capture time of the last applied frame in this machine's clock (see _frame_time)
+        self.frame_time = None
+        self.state = SESSION_IDLE
+        self.auto_reconnect = True
+        self.reconnects = 0
+        self.last_error = None
+        # callbacks: on_frame(session, fd) after each staged frame, on_complete(session) when stopped
+        self.frame_callbacks = []
+        self.completion_callbacks = []
+        self.capture_writer = None
+        # StreamMetrics when instrumentation is on; None keeps the hot path untimed
+        self.metrics = None
+        self.jitter_delay = 0.0
+        self.smoothing_enabled = False
+        # offer the compact frame encoding in the handshake
+        self.compact_encoding = False
+        self.solver_thread = False
+        self.solver_worker = None
+        self._reset_protocol_stats()
+        self._pending_commit = False
+        self._flushed = None
+        self._stopping = False
+        self._net_io_task = None
+        self._update_skeleton_task = None
+        self._update_frame = FrameDetections()
+
+    def _reset_protocol_stats(self):
+        # negotiated per connection; sequence and latency stats need protocol version 2
+        self.protocol_version = None
+        self.clock_offset = None
+        self.layout = FULL_LAYOUT
+        self.sequence_tracker = SequenceTracker()
+        self._sender_time = None
+        self._latency_time = None
+        self._protocol = None
+
+    @property
+    def active(self):
+        return self._net_io_task is not None and not self._net_io_task.done()
+
+    def start(self):
+        # a previous run's tasks are cancelled and left to finish on their own; once replaced
+        # they no longer complete the session
+        for task in (self._net_io_task, self._update_skeleton_task):
+            if task is not None:
+                task.cancel()
+        self._close_connection()
+        if self.solver_worker is not None:
+            self.solver_worker.stop()
+        self._stopping = False
+        loop = asyncio.get_event_loop()
+        queue = FrameQueue(self.queue_policy, DEFAULT_QUEUE_SIZE)
+        self.frame_queue = queue
+
+        self._reset_protocol_stats()
+        self.latency = Histogram()
+        self.reconnects = 0
+        self.last_error = None
+        if self.solver_thread:
+            self.solver_worker = SolverWorker(self)
+            self.solver_worker.start()
+        else:
+            self.solver_worker = None
+        self._net_io_task = loop.create_task(self._do_net_io(queue))
+        self._net_io_task.add_done_callback(self._on_task_complete)
+        if self.solver_worker is not None:
+            self._update_skeleton_task = loop.create_task(self._feed_worker_loop(queue, self.solver_worker))
+            self._update_skeleton_task.add_done_callback(self._on_task_complete)
+        elif queue.policy == QUEUE_POLICY_PER_UPDATE:
+            self._update_skeleton_task = None
+        else:
+            self._update_skeleton_task = loop.create_task(self._update_skeleton_loop(queue))
+            self._update_skeleton_task.add_done_callback(self._on_task_complete)
+
+    def stop(self):
+        self._stopping = True
+        if self._net_io_task is not None:
+            self._net_io_task.cancel()
+        self._close_connection()
+
+    def _close_connection(self):
+        # fails a pending read, so the stream ends even if the cancel is lost
+        if self._protocol is not None and self._protocol.transport is not None:
+            self._protocol.transport.close()
+
+    def _stopped(self):
+        return self._stopping or self._net_io_task is not asyncio.current_task()
+
+    def set_jitter_delay(self, delay):
+        self.jitter_delay = delay
+        for driver in self.drivers:
+            driver.set_jitter_delay(delay)
+
+    def set_smoothing(self, enabled):
+        self.smoothing_enabled = enabled
+        for driver in self.drivers:
+            driver.set_smoothing(enabled)
+
+    def set_drivers(self, drivers):
+        # another selection while the session runs: the new drivers take over from the next frame
+        worker = self.solver_worker if self.active else None
+        if worker is not None:
+            # poses the worker solved for the old drivers don't fit the new ones
+            worker.stop()
+        self.drivers = list(drivers)
+        for driver in self.drivers:
+            driver.set_jitter_delay(self.jitter_delay)
+            driver.set_smoothing(self.smoothing_enabled)
+            if not driver.initialized or driver.layout != self.layout:
+                driver.init_animation(self.layout.joint_names, self.layout)
+        if worker is not None:
+            worker.start()
+
+    def start_capture(self, path):
+        # raw frames from the wire, as received, for replay through a ReplaySession
+        self.stop_capture()
+        # the frame size and layout are settled by the connection, or by the first frame
+        self.capture_writer = CaptureWriter(path, frame_size=None, layout=self.layout)
+        log_info("Capturing %s to %s" % (self.name, path))
+
+    def stop_capture(self):
+        if self.capture_writer is None:
+            return None
+        capture_writer = self.capture_writer
+        self.capture_writer = None
+        capture_writer.close()
+        if not capture_writer.frames_written and not os.path.exists(capture_writer.path):
+            log_info("Capture of %s stopped before any frame, nothing written" % self.name)
+            return None
+        log_info("Captured %d frames to %s" % (capture_writer.frames_written, capture_writer.path))
+        return capture_writer.path
+
+    def _on_task_complete(self, fut=None):
+        tasks = [task for task in (self._net_io_task, self._update_skeleton_task) if task is not None]
+        if fut not in tasks:
+            return
+        # either task ending stops the session
+        for task in tasks:
+            task.cancel()
+        if not all(task.done() for task in tasks):
+            return
+        if self.solver_worker is not None:
+            self.solver_worker.stop()
+        self.stop_capture()
+        for callback in self.completion_callbacks:
+            callback(self)
+
+    async def _do_net_io(self, queue):
+        delay = RECONNECT_INITIAL_DELAY
+        try:
+            while not self._stopped():
+                frames_received = queue.frames_received
+                try:
+                    await self._stream(queue)
+                except (OSError, EOFError, ValueError, asyncio.TimeoutError) as exc:
+                    if self._stopped():
+                        break
+                    # refused, reset, silent or malformed: all worth another attempt
+                    self.last_error = str(exc) or type(exc).__name__
+                    log_warn("Stream %s lost: %s" % (self.name, self.last_error))
+                if self._stopped() or not self.auto_reconnect:
+                    break
+                if queue.frames_received != frames_received:
+                    delay = RECONNECT_INITIAL_DELAY
+                self.state = SESSION_BACKOFF
+                log_info("Reconnecting to %s in %.2f s" % (self.name, delay))
+                await asyncio.sleep(delay)
+                delay = min(delay * RECONNECT_BACKOFF, RECONNECT_MAX_DELAY)
+                self.reconnects += 1
+        except asyncio.CancelledError:
+            log_info("Network streaming cancelled (%s)" % self.name)
+        except:
+            log_error(traceback.format_exc())
+        finally:
+            if self._net_io_task is asyncio.current_task():
+                self.state = SESSION_IDLE
+            log_info("Net I/O task stopped (%s)" % self.name)
+
+    async def _stream(self, queue):
+        # one connection, from connecting until it is lost
+        self.state = SESSION_CONNECTING
+        self._reset_protocol_stats()
+        transport = None
+        try:
+            if self.transport_mode == TRANSPORT_UDP:
+                # the datagram protocol checks sequence numbers itself, to discard stale frames
+                connect = open_frame_datagram_endpoint(
+                    self.host, self.port, queue.maxsize, self.rcvbuf, self.sequence_tracker, self.compact_encoding
+                )
+            else:
+                connect = open_frame_connection(
+                    self.host, self.port, queue.maxsize, self.rcvbuf, compact=self.compact_encoding
+                )
+            transport, protocol = await asyncio.wait_for(connect, CONNECT_TIMEOUT)
+            if self._stopped():
+                # connected as the run was stopped, and wait_for swallowed the cancel
+                raise asyncio.CancelledError()
+            self._protocol = protocol
+            self.protocol_version = protocol.version
+            self.clock_offset = protocol.clock_offset
+            self._set_layout(protocol.layout)
+            if protocol.decoder is not None:
+                encoding = ", compact"
+            elif not protocol.layout.is_full:
+                encoding = ", %s" % protocol.layout.describe()
+            else:
+                encoding = ""
+            log_info("Connected to %s over %s, protocol version %d%s" % (
+                self.name, self.transport_mode, protocol.version, encoding
+            ))
+            # whatever an earlier connection left queued is stale by now
+            queue.clear()
+            self.state = SESSION_STREAMING
+            await self._read_client(protocol, queue)
+        finally:
+            if transport is not None:
+                transport.close()
+                await protocol.wait_closed()
+                log_info("%s connection closed (%s)" % (self.transport_mode.upper(), self.name))
+
+    def _set_layout(self, layout):
+        capture_writer = self.capture_writer
+        if capture_writer is not None:
+            if capture_writer.frame_size is None:
+                capture_writer.layout = layout
+            elif capture_writer.layout != layout:
+                log_warn("Frame layout of %s changed, capture stopped" % self.name)
+                self.stop_capture()
+        self.layout = layout
+        for driver in self.drivers:
+            if driver.jitter_buffer is not None:
+                # capture times of an earlier connection don't compare with the new ones
+                driver.jitter_buffer.clear()
+        # initialized here rather than on the first frame, so that frame costs no more than any
+        # other; drivers already set up for this layout (at skeleton selection) are kept
+        stale = [driver for driver in self.drivers if not driver.initialized or driver.layout != layout]
+        if not stale:
+            return
+        worker = self.solver_worker
+        if worker is not None:
+            # the worker solves with the drivers as they are, so it can't run while they change
+            worker.stop()
+        for driver in stale:
+            driver.init_animation(layout.joint_names, layout)
+        if worker is not None:
+            worker.start()
+
+    async def _read_client(self, protocol, queue):
+        if protocol.version < 2 or self.transport_mode == TRANSPORT_UDP:
+            sequence_tracker = None
+        else:
+            sequence_tracker = self.sequence_tracker
+        while True:
+            metrics = self.metrics
+            protocol.time_frames = metrics is not None
+            if metrics is None:
+                message_data = await protocol.read_frame()
+            else:
+                bytes_received = protocol.bytes_received
+                message_data = await protocol.read_frame()
+                # bytes off the wire, which for compact frames is less than the frame handed on, and
+                # the time the protocol took over them rather than the time spent waiting for them
+                metrics.frame_received(protocol.bytes_received - bytes_received, protocol.frame_receive_time)
+            if sequence_tracker is not None:
+                sequence_tracker.update(FRAME_HEADER.unpack_from(message_data)[0])
+            if self.capture_writer is not None:
+                self.capture_writer.write(message_data)
+            await queue.put(message_data)
+
+    async def _update_skeleton_loop(self, queue):
+        fd = FrameDetections()
+        try:
+            while True:
+                message = await queue.get()
+                self._apply_message(fd, message, queue)
+                # queue.get() does not suspend while frames are pending, so yield here to keep a
+                # busy source from starving the other sessions
+                await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            log_info("Skeleton update task cancelled (%s)" % self.name)
+        except:
+            log_error(traceback.format_exc())
+
+    async def _feed_worker_loop(self, queue, worker):
+        try:
+            while worker.alive:
+                worker.submit(await queue.get())
+            log_error("Solver worker for %s exited" % self.name)
+        except asyncio.CancelledError:
+            log_info("Solver feed task cancelled (%s)" % self.name)
+        except:
+            log_error(traceback.format_exc())
+
+    def update(self):
+        # called once per app update: stages the solver thread's newest frame, or decodes and
+        # solves the newest frame on the per_update policy
+        queue = self.frame_queue
+        if self.solver_worker is not None:
+            solved = self.solver_worker.take()
+            if solved is not None:
+                self._apply_solved(solved, queue)
+            return
+        if queue is None or queue.policy != QUEUE_POLICY_PER_UPDATE:
+            return
+        message = queue.get_nowait()
+        if message is not None:
+            self._apply_message(self._update_frame, message, queue)
+
+    def _apply_message(self, fd, message, queue):
+        fd.layout = self.layout
+        metrics = self.metrics
+        if metrics is None:
+            fd.ParseFromString(message)
+        else:
+            start = time.perf_counter()
+            fd.ParseFromString(message)
+            metrics.add_time("decode", time.perf_counter() - start)
+            metrics.frame_applied(queue.depth)
+        self.update_skeleton(fd)
+
+    def _apply_solved(self, solved, queue):
+        fd = solved.fd
+        frame_time = self._frame_time(fd, solved.arrival_time)
+        for driver, pose in zip(self.drivers, solved.poses):
+            driver.stage_pose(pose[0], pose[1], pose[2], frame_time)
+        if self.metrics is not None:
+            self.metrics.frame_applied(queue.depth)
+        self._frame_applied(fd, frame_time)
+
+    def _frame_time(self, fd, arrival_time):
+        # when the frame was captured, in this machine's clock if the sender says so
+        if fd.timestamp is not None and self.clock_offset is not None:
+            return fd.timestamp - self.clock_offset
+        return arrival_time
+
+    def update_skeleton(self, fd):
+        frame_time = self._frame_time(fd, time.perf_counter())
+        metrics = self.metrics
+        if metrics is None:
+            for driver in self.drivers:
+                driver.apply(fd, frame_time)
+        else:
+            start = time.perf_counter()
+            for driver in self.drivers:
+                driver.apply(fd, frame_time)
+            metrics.add_time("solve", time.perf_counter() - start)
+        self._frame_applied(fd, frame_time)
+
+    def _frame_applied(self, fd, frame_time):
+        self.frames_applied += 1
+        self.frame_time = frame_time
+        self._pending_commit = True
+        self._sender_time = fd.timestamp
+        for callback in self.frame_callbacks:
+            callback(self, fd)
+
+    def commit(self):
+        flushed = self._flushed
+        if flushed is not None and not flushed.done() and not self._pending_commit:
+            worker = self.solver_worker
+            if worker is None or not worker.alive or worker.idle:
+                flushed.set_result(None)
+        # with a jitter buffer the pose moves between frames, so it is written on every update
+        # the buffer has a new pose for, as long as the session runs
+        jitter = self.jitter_delay and self.active
+        if not self._pending_commit and not jitter:
+            return
+        frame_applied = self._pending_commit
+        self._pending_commit = False
+        metrics = self.metrics
+        if metrics is None:
+            for driver in self.drivers:
+                driver.commit()
+        else:
+            start = time.perf_counter()
+            for driver in self.drivers:
+                driver.commit()
+            metrics.add_time("author", time.perf_counter() - start)
+        if self.clock_offset is None:
+            return
+        # sender capture clock to the USD write, in this machine's clock, once per frame written
+        if jitter:
+            jitter_buffer = self.drivers[0].jitter_buffer if self.drivers else None
+            sampled_time = jitter_buffer.sampled_time if jitter_buffer is not None else None
+            if sampled_time is not None and sampled_time != self._latency_time:
+                self._latency_time = sampled_time
+                self.latency.add(time.perf_counter() - sampled_time)
+        elif frame_applied and self._sender_time is not None:
+            self.latency.add(time.perf_counter() - (self._sender_time - self.clock_offset))
+
+    async def _flush(self):
+        # until every frame handed on so far is solved, staged and committed; commit() checks,
+        # once per app update
+        self._flushed = asyncio.get_event_loop().create_future()
+        try:
+            await self._flushed
+        finally:
+            self._flushed = None
+
+    def get_stats(self):
+        stats = {
+            "name": self.name, "active": self.active, "state": self.state, "reconnects": self.reconnects,
+            "applied": self.frames_applied,
+        }
+        if self.last_error is not None:
+            stats["last_error"] = self.last_error
+        if self.frame_queue is not None:
+            stats.update(self.frame_queue.get_stats())
+        if self.protocol_version is not None:
+            stats["protocol_version"] = self.protocol_version
+            stats["clock_offset"] = self.clock_offset
+        if self._protocol is not None:
+            stats["transport"] = dict(self._protocol.get_stats(), mode=self.transport_mode)
+        if self.protocol_version == 2:
+            stats.update(self.sequence_tracker.get_stats())
+            stats["latency"] = self.latency.get_stats()
+        if self.jitter_delay and self.drivers and self.drivers[0].jitter_buffer is not None:
+            stats["jitter_buffer"] = self.drivers[0].jitter_buffer.get_stats()
+        if self.solver_worker is not None:
+            stats["solver_worker"] = self.solver_worker.get_stats()
+        if self.metrics is not None:
+            stats["metrics"] = self.metrics.get_stats()
+        return stats
+
+
+#
+# ReplaySession class
+#
+# A StreamSession fed from a capture file instead of a socket: same queue, same update loop.
+# speed scales the captured frame spacing; 0 replays as fast as the drivers keep up.
+#
+class ReplaySession(StreamSession):
+    def __init__(self, capture_path, drivers, speed=1.0, loop=False, queue_policy=QUEUE_POLICY_BLOCK, name=None):
+        super().__init__(None, None, drivers, queue_policy, name=name or os.path.basename(capture_path))
+        self.capture_path = capture_path
+        self.speed = speed
+        self.loop = loop
+
+    async def _do_net_io(self, queue):
+        reader = CaptureReader(self.capture_path)
+        try:
+            self._set_layout(reader.layout)
+            self.state = SESSION_STREAMING
+            log_info("Replaying %d frames (%.1f s) from %s" % (len(reader), reader.duration, self.capture_path))
+            await replay_capture(reader, queue, self.speed, self.loop)
+            # let the update loop drain what is still queued, and the solver thread and the app
+            # updates finish with it, before the session completes
+            await queue.drain()
+            await self._flush()
+        except asyncio.CancelledError:
+            log_info("Replay cancelled (%s)" % self.name)
+        except:
+            log_error(traceback.format_exc())
+        finally:
+            # the per_update frame still views the last replayed record
+            self._update_frame = FrameDetections()
+            reader.close()
+            self.state = SESSION_IDLE
+            log_info("Replay stopped (%s)" % self.name)
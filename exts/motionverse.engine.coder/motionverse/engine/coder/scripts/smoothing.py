@@ -0,0 +1,105 @@
+import math
+
+import numpy as np
+
+from .constants import *
+from .frames import BODY_POSE_NAMES
+
+# Capture joints filtered with the "hands" parameters; the wrists count as body
+HAND_JOINT_NAMES = frozenset(BODY_POSE_NAMES[BODY_POSE_NAMES.index("LeftHandThumb1"):])
+
+
+def smoothing_alpha(cutoff, dt):
+    # exponential smoothing factor of a first order low-pass at `cutoff` Hz
+    return 1.0 / (1.0 + 1.0 / (2.0 * math.pi * cutoff * dt))
+
+
+#
+# OneEuroFilter class
+#
+# One-Euro adaptive low-pass (Casiez et al.) over N rows of D values at once: each row's
+# cutoff rises with the speed of its filtered derivative, so slow drift is smoothed hard while
+# fast motion follows with little lag. Parameters are per row; the work per sample is a few
+# array operations whatever N is.
+#
+class OneEuroFilter:
+    def __init__(self, min_cutoff, beta, d_cutoff=1.0):
+        self.min_cutoff = np.asarray(min_cutoff, dtype=np.float64)
+        self.beta = np.asarray(beta, dtype=np.float64)
+        self.d_cutoff = np.asarray(d_cutoff, dtype=np.float64)
+        self.value = None
+        self.derivative = None
+        self.time = None
+
+    def reset(self):
+        self.value = None
+        self.time = None
+
+    def __call__(self, x, t):
+        # filtered (N,D) float64 state; samples that don't advance time leave it unchanged
+        if self.value is None:
+            self.value = np.array(x, dtype=np.float64)
+            self.derivative = np.zeros_like(self.value)
+            self.time = t
+            return self.value
+        dt = t - self.time
+        if dt <= 0:
+            return self.value
+        self.time = t
+        delta = x - self.value
+        self.derivative += smoothing_alpha(self.d_cutoff, dt)[..., None] * (delta / dt - self.derivative)
+        cutoff = self.min_cutoff + self.beta * np.linalg.norm(self.derivative, axis=-1)
+        self.value += smoothing_alpha(cutoff, dt)[..., None] * delta
+        return self.value
+
+
+def get_smoothing_params(rig_mapping):
+    # {group: {min_cutoff, beta, d_cutoff}}, the rig file's "smoothing" section over the defaults
+    overrides = rig_mapping.get("smoothing", {})
+    return {
+        group: dict(DEFAULT_SMOOTHING[group], **overrides.get(group, {})) for group in SMOOTHING_GROUPS
+    }
+
+
+#
+# PoseFilter class
+#
+# Smooths a solved pose: every joint rotation (as a 4-vector, kept on the hemisphere of the
+# previous output so a sign flip of the solver is not mistaken for motion) and the root
+# translation. Joints take the parameters of their group: "root" for the root joint and
+# translation, "hands" for the fingers, "body" for everything else.
+#
+class PoseFilter:
+    def __init__(self, motion_to_anim_index, root_index, params):
+        num_joints = len(motion_to_anim_index)
+        groups = ["body"] * num_joints
+        for motion_name, anim_index in motion_to_anim_index.items():
+            if anim_index == root_index:
+                groups[anim_index] = "root"
+            elif motion_name in HAND_JOINT_NAMES:
+                groups[anim_index] = "hands"
+
+        def column(key):
+            return [params[group][key] for group in groups]
+
+        root = params["root"]
+        self.rotation_filter = OneEuroFilter(column("min_cutoff"), column("beta"), column("d_cutoff"))
+        self.translation_filter = OneEuroFilter([root["min_cutoff"]], [root["beta"]], [root["d_cutoff"]])
+        self.rotations = np.zeros((num_joints, 4), dtype=np.float32)
+        self.root_translation = np.zeros(3, dtype=np.float32)
+        self._aligned = np.zeros((num_joints, 4))
+
+    def reset(self):
+        self.rotation_filter.reset()
+        self.translation_filter.reset()
+
+    def filter(self, rotations, root_translation, t):
+        aligned = self._aligned
+        aligned[:] = rotations
+        previous = self.rotation_filter.value
+        if previous is not None:
+            aligned *= np.where(np.einsum("ij,ij->i", aligned, previous) < 0, -1.0, 1.0)[:, None]
+        smoothed = self.rotation_filter(aligned, t)
+        np.divide(smoothed, np.linalg.norm(smoothed, axis=1, keepdims=True), out=self.rotations, casting="unsafe")
+        self.root_translation[:] = self.translation_filter(np.reshape(root_translation, (1, 3)), t)[0]
+        return self.rotations, self.root_translation
@@ -0,0 +1,174 @@
+import numpy as np
+from pxr import Vt, Gf, UsdSkel
+
+#
+# PoseSolver class
+#
+# Batched replacement for the per-joint Gf loop that used to live in update_skeleton.
+# All matrices follow Gf's row-vector convention, so `a @ b` here is `a * b` in Gf.
+#
+class PoseSolver:
+    def __init__(self, anim_topology, rest_xforms_anim_global, rest_xform_adjust, motion_indices, root_index):
+        num_joints = len(rest_xforms_anim_global)
+        self.num_joints = num_joints
+        self.root_index = root_index
+        # row of the wire's body block feeding each animation joint
+        self.motion_indices = np.asarray(motion_indices, dtype=np.intp)
+        assert len(self.motion_indices) == num_joints
+
+        self.parents = np.array(anim_topology.GetParentIndices(), dtype=np.intp)
+        self.root_mask = self.parents < 0
+        self.parents_safe = np.where(self.root_mask, 0, self.parents)
+
+        self.rest_xforms_global = np.array(rest_xforms_anim_global, dtype=np.float64).reshape(num_joints, 4, 4)
+        self.rest_xform_adjust = np.array(rest_xform_adjust, dtype=np.float64).reshape(4, 4)
+        self.rest_xform_adjust_inverse = np.linalg.inv(self.rest_xform_adjust)
+
+        # Only the upper 3x3 blocks matter for rotations: with affine matrices the translation row
+        # never feeds back into them.
+        self._rest_rot = np.ascontiguousarray(self.rest_xforms_global[:, :3, :3])
+        self._rest_rot_inverse = np.linalg.inv(self._rest_rot)
+        self._adjust_rot_inverse = self.rest_xform_adjust_inverse[:3, :3].copy()
+
+        # scratch buffers reused every frame
+        self.body_block = np.empty((num_joints, 7), dtype=np.float32)
+        self._motion_rot = np.empty((num_joints, 3, 3))
+        self._local_rot = np.empty((num_joints, 3, 3))
+        self.rotations = np.empty((num_joints, 4), dtype=np.float32)
+        self.root_translation = np.empty(3, dtype=np.float32)
+
+    def solve(self, block):
+        # block is the (J,7) body data gathered in animation joint order (see motion_indices):
+        # quaternion (x, y, z, w) followed by position
+        quats_to_matrices(block[:, :4], self._motion_rot)
+
+        # target_global = rest_global * motion_global
+        target_rot = np.matmul(self._rest_rot, self._motion_rot)
+        # inverse(target_global) = inverse(motion) * inverse(rest), and motion is a pure rotation
+        target_rot_inverse = np.matmul(self._motion_rot.transpose(0, 2, 1), self._rest_rot_inverse)
+
+        parent_rot_inverse = target_rot_inverse[self.parents_safe]
+        parent_rot_inverse[self.root_mask] = self._adjust_rot_inverse
+        np.matmul(target_rot, parent_rot_inverse, out=self._local_rot)
+
+        matrices_to_quats(self._local_rot, self.rotations)
+
+        root_position = block[self.root_index, 4:7]
+        self.root_translation[:] = root_position @ self._adjust_rot_inverse + self.rest_xform_adjust_inverse[3, :3]
+        return self.rotations, self.root_translation
+
+    def solve_vt(self, block):
+        rotations, root_translation = self.solve(block)
+        # QuatfArray stores (i, j, k, real), the same order as the wire and our buffer
+        return Vt.QuatfArray.FromNumpy(rotations), Gf.Vec3f(*root_translation.tolist())
+
+
+def quats_to_matrices(quats, out=None):
+    # Matches Gf.Rotation(Gf.Quatd(w, x, y, z)): the angle comes from the clamped real part and
+    # the axis from the normalized imaginary part, so slightly denormalized input agrees with Gf.
+    quats = np.asarray(quats, dtype=np.float64)
+    w = np.clip(quats[:, 3], -1.0, 1.0)
+    imaginary = quats[:, :3]
+    length = np.sqrt(np.einsum("ij,ij->i", imaginary, imaginary))
+    scale = np.zeros_like(length)
+    valid = length > 1e-10
+    scale[valid] = np.sqrt(1.0 - w[valid] * w[valid]) / length[valid]
+    w = np.where(valid, w, 1.0)
+    x, y, z = (imaginary * scale[:, None]).T
+
+    if out is None:
+        out = np.empty((len(quats), 3, 3))
+    # row-vector (Gf) layout, i.e. the transpose of the textbook column-vector matrix
+    out[:, 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    out[:, 0, 1] = 2.0 * (x * y + w * z)
+    out[:, 0, 2] = 2.0 * (x * z - w * y)
+    out[:, 1, 0] = 2.0 * (x * y - w * z)
+    out[:, 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    out[:, 1, 2] = 2.0 * (y * z + w * x)
+    out[:, 2, 0] = 2.0 * (x * z + w * y)
+    out[:, 2, 1] = 2.0 * (y * z - w * x)
+    out[:, 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    return out
+
+
+def matrices_to_quats(m, out=None):
+    # Vectorized Gf.Matrix4d.ExtractRotationQuat, including its choice of sign, returning (x, y, z, w)
+    count = len(m)
+    if out is None:
+        out = np.empty((count, 4), dtype=np.float32)
+    diag = np.stack((m[:, 0, 0], m[:, 1, 1], m[:, 2, 2]), axis=1)
+    trace = diag.sum(axis=1)
+    i = np.where(
+        m[:, 0, 0] > m[:, 1, 1],
+        np.where(m[:, 0, 0] > m[:, 2, 2], 0, 2),
+        np.where(m[:, 1, 1] > m[:, 2, 2], 1, 2),
+    )
+    rows = np.arange(count)
+    j = (i + 1) % 3
+    k = (i + 2) % 3
+    result = np.empty((count, 4))
+
+    # with m[3][3] == 1 the "r" branch of Gf is taken whenever the trace beats the largest diagonal
+    use_trace = trace > diag[rows, i]
+    t = np.where(use_trace, trace, 0.0)
+    r = 0.5 * np.sqrt(t + 1.0)
+    denom = np.where(use_trace, 4.0 * r, 1.0)
+    result[:, 0] = (m[:, 1, 2] - m[:, 2, 1]) / denom
+    result[:, 1] = (m[:, 2, 0] - m[:, 0, 2]) / denom
+    result[:, 2] = (m[:, 0, 1] - m[:, 1, 0]) / denom
+    result[:, 3] = r
+
+    other = ~use_trace
+    if other.any():
+        rows, i, j, k = rows[other], i[other], j[other], k[other]
+        q = 0.5 * np.sqrt(m[rows, i, i] - m[rows, j, j] - m[rows, k, k] + 1.0)
+        result[rows, i] = q
+        result[rows, j] = (m[rows, i, j] + m[rows, j, i]) / (4.0 * q)
+        result[rows, k] = (m[rows, k, i] + m[rows, i, k]) / (4.0 * q)
+        result[rows, 3] = (m[rows, j, k] - m[rows, k, j]) / (4.0 * q)
+
+    np.clip(result[:, 3], -1.0, 1.0, out=result[:, 3])
+    out[:] = result
+    return out
+
+
+#
+# GfPoseSolver class
+#
+# The original per-joint Gf implementation, kept as the reference for golden checks.
+#
+class GfPoseSolver:
+    def __init__(self, anim_topology, rest_xforms_anim_global, rest_xform_adjust, motion_indices, root_index):
+        self.anim_topology = anim_topology
+        self.rest_xforms_anim_global = rest_xforms_anim_global
+        self.rest_xform_adjust_inverse = rest_xform_adjust.GetInverse()
+        self.motion_indices = list(motion_indices)
+        self.root_index = root_index
+
+    def solve_vt(self, block):
+        motion_xforms_global = Vt.Matrix4dArray(len(self.rest_xforms_anim_global))
+        for anim_index, pose in enumerate(block):
+            q = pose[:4]
+            t = pose[4:7]
+            xform = Gf.Matrix4d()
+            xform.SetTransform(
+                Gf.Rotation(Gf.Quatd(float(q[3]), float(q[0]), float(q[1]), float(q[2]))),
+                Gf.Vec3d(float(t[0]), float(t[1]), float(t[2])),
+            )
+            motion_xforms_global[anim_index] = xform
+
+        target_pose_xforms_global = Vt.Matrix4dArray(
+            [
+                base_xform * motion_xform
+                for motion_xform, base_xform in zip(motion_xforms_global, self.rest_xforms_anim_global)
+            ]
+        )
+        root_xform = self.rest_xform_adjust_inverse
+        target_xforms_local = UsdSkel.ComputeJointLocalTransforms(
+            self.anim_topology, target_pose_xforms_global, root_xform
+        )
+        anim_rotations = Vt.QuatfArray([Gf.Quatf(xform.ExtractRotationQuat()) for xform in target_xforms_local])
+        root_translation = Gf.Vec3f(
+            root_xform.Transform(motion_xforms_global[self.root_index].ExtractTranslation())
+        )
+        return anim_rotations, root_translation
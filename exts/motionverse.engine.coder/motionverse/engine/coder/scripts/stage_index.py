@@ -0,0 +1,115 @@
+from pxr import Usd, UsdSkel, Sdf, Tf
+
+INDEXED_PRIM_TYPES = {"Skeleton": UsdSkel.Skeleton, "SkelRoot": UsdSkel.Root, "BlendShape": UsdSkel.BlendShape}
+# Subtrees that never contain skeletons or blend shapes
+PRUNED_PRIM_TYPES = frozenset(["Skeleton", "BlendShape", "Material", "Shader", "NodeGraph", "GeomSubset"])
+
+
+def iter_skel_prims(prim):
+    # (schema, prim) for the Skeletons, SkelRoots and BlendShapes at or below prim, matched on
+    # type name and without descending into subtrees that cannot hold any
+    it = iter(Usd.PrimRange(prim, Usd.TraverseInstanceProxies()))
+    for child in it:
+        type_name = child.GetTypeName()
+        schema = INDEXED_PRIM_TYPES.get(type_name)
+        if schema is not None:
+            yield schema, child
+        if type_name in PRUNED_PRIM_TYPES:
+            it.PruneChildren()
+
+
+#
+# SkeletonIndex class
+#
+# Skeletons, SkelRoots and blend shapes of a stage, found with one pruned traversal and then
+# kept current from ObjectsChanged notices. The notice handler only queues the resynced paths;
+# they are rescanned on the next query, so pose writes while streaming cost next to nothing.
+# Rig matches are cached per skeleton and dropped when its joints change.
+#
+class SkeletonIndex:
+    def __init__(self, stage, rig_registry=None):
+        self.stage = stage
+        self.rig_registry = rig_registry
+        self.skeletons = {}
+        self.skel_roots = {}
+        self.blend_shapes = {}
+        self._rig_matches = {}
+        self._resynced = []
+        self._add_subtree(stage.GetPseudoRoot())
+        self._listener = Tf.Notice.Register(Usd.Notice.ObjectsChanged, self._on_objects_changed, stage)
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.Revoke()
+            self._listener = None
+
+    def _on_objects_changed(self, notice, sender):
+        for path in notice.GetResyncedPaths():
+            if path.IsPropertyPath():
+                self._on_property_changed(path)
+            else:
+                self._resynced.append(path)
+        for path in notice.GetChangedInfoOnlyPaths():
+            if path.IsPropertyPath():
+                self._on_property_changed(path)
+
+    def _on_property_changed(self, path):
+        if path.name == UsdSkel.Tokens.joints:
+            self._rig_matches.pop(path.GetPrimPath(), None)
+
+    def _update(self):
+        if not self._resynced:
+            return
+        # rescan each resynced subtree once; sorting puts ancestors ahead of their descendants
+        roots = []
+        for path in sorted(set(self._resynced)):
+            if not any(path.HasPrefix(root) for root in roots):
+                roots.append(path)
+        self._resynced = []
+        for path in roots:
+            self._remove_subtree(path)
+            prim = self.stage.GetPrimAtPath(path)
+            if prim:
+                self._add_subtree(prim)
+
+    def _add_subtree(self, prim):
+        entries = {
+            UsdSkel.Skeleton: self.skeletons, UsdSkel.Root: self.skel_roots, UsdSkel.BlendShape: self.blend_shapes
+        }
+        for schema, child in iter_skel_prims(prim):
+            entries[schema][child.GetPath()] = schema(child)
+
+    def _remove_subtree(self, path):
+        for entries in (self.skeletons, self.skel_roots, self.blend_shapes, self._rig_matches):
+            for entry_path in [entry_path for entry_path in entries if entry_path.HasPrefix(path)]:
+                del entries[entry_path]
+
+    def find_skeleton(self, path):
+        # the skeleton at path, or the first one below it (e.g. a selected SkelRoot)
+        self._update()
+        path = Sdf.Path(path)
+        skeleton = self.skeletons.get(path)
+        if skeleton is None:
+            skeleton = next(
+                (skeleton for skel_path, skeleton in self.skeletons.items() if skel_path.HasPrefix(path)), None
+            )
+        return skeleton
+
+    def find_blend_shapes(self, path):
+        self._update()
+        path = Sdf.Path(path)
+        return [blend_shape for shape_path, blend_shape in self.blend_shapes.items() if shape_path.HasPrefix(path)]
+
+    def get_rig_match(self, skeleton):
+        # RigMatch from the rig registry for the skeleton's joint names, or None if unsupported
+        if self.rig_registry is None:
+            return None
+        path = skeleton.GetPath()
+        if path not in self._rig_matches:
+            joints = skeleton.GetJointsAttr().Get() or []
+            self._rig_matches[path] = self.rig_registry.match([Sdf.Path(joint).name for joint in joints])
+        return self._rig_matches[path]
+
+    def drivable_skeletons(self):
+        self._update()
+        return [skeleton for skeleton in self.skeletons.values() if self.get_rig_match(skeleton) is not None]
@@ -0,0 +1,84 @@
+import asyncio
+
+from .constants import *
+
+#
+# FrameQueue class
+#
+# Hands received messages from the network task to the skeleton update task.
+#   block        - every frame is applied in order; the reader waits when the queue is full
+#   drop_oldest  - the reader never waits; the oldest pending frame is discarded when full
+#   latest       - like drop_oldest, and the consumer skips straight to the newest pending frame
+#   per_update   - only the newest frame is kept; the session takes it with get_nowait() once per
+#                  app update instead of running an update task
+#
+class FrameQueue:
+    def __init__(self, policy=DEFAULT_QUEUE_POLICY, maxsize=DEFAULT_QUEUE_SIZE):
+        assert policy in QUEUE_POLICIES, "Unknown frame queue policy %s" % policy
+        self.policy = policy
+        if policy == QUEUE_POLICY_PER_UPDATE:
+            # a single slot: putting a frame replaces the one not applied yet
+            maxsize = 1
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self.frames_received = 0
+        self.frames_dropped = 0
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    @property
+    def maxsize(self):
+        return self._queue.maxsize
+
+    async def put(self, frame):
+        self.frames_received += 1
+        if self.policy == QUEUE_POLICY_BLOCK:
+            await self._queue.put(frame)
+            return
+        if self._queue.full():
+            self._take()
+            self.frames_dropped += 1
+        self._queue.put_nowait(frame)
+
+    async def get(self):
+        frame = await self._queue.get()
+        self._queue.task_done()
+        if self.policy == QUEUE_POLICY_LATEST:
+            while not self._queue.empty():
+                frame = self._take()
+                self.frames_dropped += 1
+        return frame
+
+    def clear(self):
+        # discards every pending frame, e.g. those of a connection that was lost
+        while not self._queue.empty():
+            self._take()
+            self.frames_dropped += 1
+
+    def get_nowait(self):
+        # newest pending frame, or None when nothing arrived since the last call
+        frame = None
+        while not self._queue.empty():
+            if frame is not None:
+                self.frames_dropped += 1
+            frame = self._take()
+        return frame
+
+    async def drain(self):
+        # returns once every frame put so far has been taken (or dropped)
+        await self._queue.join()
+
+    def _take(self):
+        # every frame leaving the queue is marked done, which is what drain() waits for
+        frame = self._queue.get_nowait()
+        self._queue.task_done()
+        return frame
+
+    def get_stats(self):
+        return {
+            "policy": self.policy,
+            "depth": self.depth,
+            "received": self.frames_received,
+            "dropped": self.frames_dropped,
+        }
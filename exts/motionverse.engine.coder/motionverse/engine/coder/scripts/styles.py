@@ -15,4 +15,5 @@ style_btn_disabled = {
 }
 style_status_circle_green = {"background_color": 0xFF00FF00, "border_width": 0}
 style_status_circle_red = {"background_color": 0xFF0000FF, "border_width": 0}
+style_status_circle_yellow = {"background_color": 0xFF00FFFF, "border_width": 0}
 style_btn_goto_motionverse = {"Button": {"border_width": 0.0, "border_radius": 3.0, "margin": 5.0, "padding": 10.0}}
\ No newline at end of file
@@ -0,0 +1,512 @@
+import asyncio
+import collections
+import socket
+import time
+
+from .compact import COMPACT_HEADER, COMPACT_MAX_FRAME_SIZE, CompactDecoder
+from .constants import *
+from .frames import FULL_LAYOUT
+from .protocol import (
+    PROTOCOL_MAGIC, PROTOCOL_ACK, FRAME_HEADER, FRAME_SIZES, LAYOUT_MAGIC, LAYOUT_HEADER, SequenceTracker,
+    build_handshake, estimate_clock_offset, layout_message_size, parse_layout
+)
+
+#
+# FrameReceiveProtocol class
+#
+# Receives straight into a preallocated ring of frame-sized slots and hands out memoryviews of
+# completed slots, so no bytes object is created per frame. A slot stays valid until the ring
+# wraps around to it; the ring is sized so that every frame that can still be queued downstream
+# (max_pending) keeps its slot, and reading is paused when the remaining headroom fills up.
+#
+# When asking for protocol version 2 the ring is only allocated once the server's first bytes
+# show whether it acknowledged the request (and frames carry a header) or streams version 1.
+# If the server chose compact frames, they are received into a separate buffer, header first
+# for the payload size, and expanded into the ring's version 2 slots as they complete. If it
+# chose to send a frame layout, that follows the ack and sizes the ring's slots instead.
+#
+class FrameReceiveProtocol(asyncio.BufferedProtocol):
+    def __init__(self, max_pending=DEFAULT_QUEUE_SIZE, headroom=DEFAULT_RING_HEADROOM,
+                 rcvbuf=DEFAULT_SO_RCVBUF, protocol_version=PROTOCOL_VERSION, compact=False,
+                 timeout=STREAM_READ_TIMEOUT):
+        self.rcvbuf = rcvbuf
+        self.timeout = timeout
+        self.request_flags = PROTOCOL_FLAG_LAYOUT | (PROTOCOL_FLAG_COMPACT if compact else 0)
+        self.flags = 0
+        self.decoder = None
+        self.layout = FULL_LAYOUT
+        self._layout_data = None
+        self._layout_received = 0
+        self._compact = None
+        self._compact_received = 0
+        self._compact_expected = COMPACT_HEADER.size
+        # downstream: queued frames, one waiting on queue.put and one being applied
+        self._reserved = max_pending + 2
+        self._headroom = max(headroom, 1)
+        self.num_slots = self._reserved + self._headroom
+        self.protocol_version = protocol_version
+        self.version = None
+        self.frame_size = None
+        self.request_time = None
+        self.clock_offset = None
+        self._ring = None
+        self._ack = bytearray(PROTOCOL_ACK.size)
+        self._ack_received = 0
+        self._negotiated = None
+        self._write_slot = 0
+        self._write_offset = 0
+        self._ready = collections.deque()
+        # with time_frames set, how long each ready frame took to process once its bytes came in
+        self.time_frames = False
+        self._ready_times = collections.deque()
+        self.frame_receive_time = 0.0
+        self._waiter = None
+        self._paused = False
+        self._closed = None
+        self._exception = None
+        self.transport = None
+        self.frames_received = 0
+        self.bytes_received = 0
+
+    def _allocate(self, version, flags=0):
+        frame_size = self.layout.frame_size if flags & PROTOCOL_FLAG_LAYOUT else FRAME_SIZES[version]
+        self.version = version
+        self.flags = flags
+        if flags & PROTOCOL_FLAG_COMPACT and not flags & PROTOCOL_FLAG_LAYOUT:
+            self.decoder = CompactDecoder()
+            self._compact = bytearray(COMPACT_MAX_FRAME_SIZE)
+        self.frame_size = frame_size
+        self._ring = bytearray(frame_size * self.num_slots)
+        view = memoryview(self._ring)
+        self._view = view
+        self._slots = [view[i * frame_size:(i + 1) * frame_size] for i in range(self.num_slots)]
+        if not self._negotiated.done():
+            self._negotiated.set_result(version)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        loop = asyncio.get_event_loop()
+        self._closed = loop.create_future()
+        self._negotiated = loop.create_future()
+        if self.protocol_version < 2:
+            self._allocate(1)
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.rcvbuf:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+
+    def get_buffer(self, sizehint):
+        if self._layout_data is not None:
+            return memoryview(self._layout_data)[self._layout_received:]
+        if self._ring is None:
+            # the magic first, then the rest of the ack if it is one
+            end = len(PROTOCOL_MAGIC) if self._ack_received < len(PROTOCOL_MAGIC) else PROTOCOL_ACK.size
+            return memoryview(self._ack)[self._ack_received:end]
+        if self._compact is not None:
+            return memoryview(self._compact)[self._compact_received:self._compact_expected]
+        # contiguous space from the write position up to the ring end or the headroom limit
+        writable = min(self._headroom - len(self._ready), self.num_slots - self._write_slot)
+        start = self._write_slot * self.frame_size + self._write_offset
+        end = (self._write_slot + max(writable, 1)) * self.frame_size
+        return self._view[start:end]
+
+    def buffer_updated(self, nbytes):
+        start = time.perf_counter() if self.time_frames else None
+        self.bytes_received += nbytes
+        if self._layout_data is not None:
+            self._layout_updated(nbytes)
+            return
+        if self._ring is None:
+            self._negotiate(nbytes)
+            return
+        if self._compact is not None:
+            self._compact_updated(nbytes, start)
+            return
+        self._write_offset += nbytes
+        while self._write_offset >= self.frame_size:
+            self._write_offset -= self.frame_size
+            self._frame_ready(start)
+        if self._ready:
+            self._wake()
+        if len(self._ready) >= self._headroom and not self._paused:
+            self._paused = True
+            self.transport.pause_reading()
+
+    def _frame_ready(self, start):
+        self._ready.append(self._write_slot)
+        self._ready_times.append(0.0 if start is None else time.perf_counter() - start)
+        self._write_slot = (self._write_slot + 1) % self.num_slots
+        self.frames_received += 1
+
+    def _compact_updated(self, nbytes, start):
+        self._compact_received += nbytes
+        if self._compact_received < self._compact_expected:
+            return
+        if self._compact_expected == COMPACT_HEADER.size:
+            payload_size = COMPACT_HEADER.unpack_from(self._compact)[-1]
+            if COMPACT_HEADER.size + payload_size > len(self._compact):
+                self.transport.abort()
+                return
+            self._compact_expected += payload_size
+            if payload_size:
+                return
+        message = memoryview(self._compact)[:self._compact_expected]
+        self._compact_received = 0
+        self._compact_expected = COMPACT_HEADER.size
+        try:
+            decoded = self.decoder.decode(message, self._slots[self._write_slot])
+        except ValueError as exc:
+            self._exception = exc
+            self.transport.abort()
+            return
+        if not decoded:
+            return
+        self._frame_ready(start)
+        self._wake()
+        if len(self._ready) >= self._headroom and not self._paused:
+            self._paused = True
+            self.transport.pause_reading()
+
+    def _negotiate(self, nbytes):
+        self._ack_received += nbytes
+        magic_size = len(PROTOCOL_MAGIC)
+        if self._ack_received == magic_size and bytes(self._ack[:magic_size]) != PROTOCOL_MAGIC:
+            # no ack: a version 1 server, and these bytes already belong to the first frame
+            self._allocate(1)
+            self._ring[:magic_size] = self._ack[:magic_size]
+            self._write_offset = magic_size
+        elif self._ack_received == PROTOCOL_ACK.size:
+            magic, version, flags, server_time = PROTOCOL_ACK.unpack(self._ack)
+            if self.request_time is not None:
+                self.clock_offset = estimate_clock_offset(self.request_time, time.perf_counter(), server_time)
+            flags &= self.request_flags
+            if flags & PROTOCOL_FLAG_LAYOUT:
+                self.version = version
+                self.flags = flags
+                self._layout_data = bytearray(LAYOUT_HEADER.size)
+            else:
+                self._allocate(version, flags)
+
+    def _layout_updated(self, nbytes):
+        self._layout_received += nbytes
+        if self._layout_received < len(self._layout_data):
+            return
+        try:
+            if self._layout_received == LAYOUT_HEADER.size:
+                size = layout_message_size(self._layout_data)
+                if size > LAYOUT_HEADER.size:
+                    # a new buffer: the transport may still hold a view of this one
+                    data = bytearray(size)
+                    data[:LAYOUT_HEADER.size] = self._layout_data
+                    self._layout_data = data
+                    return
+            self.layout = parse_layout(self._layout_data)
+        except ValueError as exc:
+            self._exception = exc
+            self.transport.abort()
+            return
+        self._layout_data = None
+        self._allocate(self.version, self.flags)
+
+    def eof_received(self):
+        return False
+
+    def connection_lost(self, exc):
+        if self._layout_data is not None:
+            partial, expected = bytes(self._layout_data[:self._layout_received]), len(self._layout_data)
+        elif self._ring is None:
+            partial, expected = bytes(self._ack[:self._ack_received]), PROTOCOL_ACK.size
+        elif self._compact is not None:
+            partial, expected = bytes(self._compact[:self._compact_received]), self._compact_expected
+        else:
+            partial, expected = bytes(self._slots[self._write_slot][:self._write_offset]), self.frame_size
+        self._exception = self._exception or exc or asyncio.IncompleteReadError(partial, expected)
+        if self._negotiated is not None and not self._negotiated.done():
+            self._negotiated.set_exception(self._exception)
+        self._wake()
+        if self._closed is not None and not self._closed.done():
+            self._closed.set_result(None)
+
+    def _wake(self):
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def _timed_out(self):
+        self._exception = self._exception or ConnectionAbortedError("No frames for %.1f s" % self.timeout)
+        self.transport.abort()
+        self._wake()
+
+    async def read_frame(self):
+        # a server silent for longer than timeout is taken for gone, as if it had disconnected;
+        # a timer aborts the connection rather than asyncio.wait_for, which before Python 3.12
+        # can swallow a cancel that arrives as the wait ends
+        while not self._ready:
+            if self._exception is not None:
+                raise self._exception
+            loop = asyncio.get_event_loop()
+            self._waiter = loop.create_future()
+            timer = loop.call_later(self.timeout, self._timed_out) if self.timeout else None
+            try:
+                await self._waiter
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                self._waiter = None
+        slot = self._ready.popleft()
+        self.frame_receive_time = self._ready_times.popleft()
+        if self._paused and len(self._ready) < self._headroom:
+            self._paused = False
+            self.transport.resume_reading()
+        return self._slots[slot]
+
+    async def wait_negotiated(self):
+        return await self._negotiated
+
+    async def wait_closed(self):
+        if self._closed is not None:
+            await self._closed
+
+    def get_stats(self):
+        return {
+            "frames": self.frames_received,
+            "bytes": self.bytes_received,
+            "pending": len(self._ready),
+            "version": self.version,
+            "compact": self.decoder is not None,
+            "layout": self.layout.describe(),
+            "bytes_per_frame": self.bytes_received / self.frames_received if self.frames_received else 0.0,
+        }
+
+
+async def open_frame_connection(host, port, max_pending=DEFAULT_QUEUE_SIZE, rcvbuf=DEFAULT_SO_RCVBUF,
+                                protocol_version=PROTOCOL_VERSION, compact=False):
+    # connects, sends the handshake and waits until the protocol version (and layout) is settled;
+    # compact offers the compact frame encoding, which the server may or may not choose
+    loop = asyncio.get_event_loop()
+    transport, protocol = await loop.create_connection(
+        lambda: FrameReceiveProtocol(
+            max_pending=max_pending, rcvbuf=rcvbuf, protocol_version=protocol_version, compact=compact
+        ),
+        host, port
+    )
+    try:
+        protocol.request_time = time.perf_counter()
+        transport.write(build_handshake(protocol_version, protocol.request_flags))
+        await protocol.wait_negotiated()
+    except:
+        transport.close()
+        raise
+    return transport, protocol
+
+
+#
+# FrameDatagramProtocol class
+#
+# The UDP alternative to FrameReceiveProtocol, with the same reading interface: one complete
+# protocol version 2 frame per datagram, so a lost packet costs that frame alone instead of
+# holding back every later frame until TCP retransmits it. The handshake request is repeated
+# until the server acks it and then serves as a keepalive. Frames are checked against the
+# sequence tracker as they arrive; anything older than a frame already received is discarded,
+# and when the reader falls behind the oldest pending frame makes room for the newest. A frame
+# layout, if the server sends one, comes in its own datagram after each ack.
+#
+class FrameDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, max_pending=DEFAULT_QUEUE_SIZE, rcvbuf=DEFAULT_SO_RCVBUF, sequence_tracker=None,
+                 timeout=DATAGRAM_TIMEOUT, compact=False):
+        self.rcvbuf = rcvbuf
+        self.request_flags = PROTOCOL_FLAG_LAYOUT | (PROTOCOL_FLAG_COMPACT if compact else 0)
+        self.flags = 0
+        self.decoder = None
+        self.layout = FULL_LAYOUT
+        # downstream holds the queued frames, one waiting on queue.put and one being applied
+        self.max_pending = max_pending + 2
+        self.sequence_tracker = sequence_tracker or SequenceTracker()
+        self.timeout = timeout
+        self.version = None
+        self.frame_size = None
+        self.request_time = None
+        self.clock_offset = None
+        self._ready = collections.deque()
+        # as in FrameReceiveProtocol
+        self.time_frames = False
+        self._ready_times = collections.deque()
+        self.frame_receive_time = 0.0
+        self._waiter = None
+        self._negotiated = None
+        self._closed = None
+        self._exception = None
+        self._request_handle = None
+        self.transport = None
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.frames_stale = 0
+        self.frames_dropped = 0
+        self.datagrams_invalid = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        loop = asyncio.get_event_loop()
+        self._closed = loop.create_future()
+        self._negotiated = loop.create_future()
+        sock = transport.get_extra_info("socket")
+        if sock is not None and self.rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        self._send_request()
+
+    def _send_request(self):
+        if self.version is None:
+            self.request_time = time.perf_counter()
+        self.transport.sendto(build_handshake(PROTOCOL_VERSION, self.request_flags))
+        interval = DATAGRAM_KEEPALIVE if self._negotiated.done() else DATAGRAM_HANDSHAKE_INTERVAL
+        self._request_handle = asyncio.get_event_loop().call_later(interval, self._send_request)
+
+    def datagram_received(self, data, addr):
+        start = time.perf_counter() if self.time_frames else None
+        self.bytes_received += len(data)
+        if len(data) == PROTOCOL_ACK.size and data[:len(PROTOCOL_MAGIC)] == PROTOCOL_MAGIC:
+            # the first ack settles the version, later ones answer keepalives
+            if self.version is None:
+                magic, version, flags, server_time = PROTOCOL_ACK.unpack(data)
+                self.clock_offset = estimate_clock_offset(self.request_time, time.perf_counter(), server_time)
+                self.version = version
+                self.frame_size = FRAME_SIZES[version]
+                self.flags = flags & self.request_flags
+                if self.flags & PROTOCOL_FLAG_LAYOUT:
+                    # settled once the layout arrives
+                    return
+                if self.flags & PROTOCOL_FLAG_COMPACT:
+                    self.decoder = CompactDecoder()
+                self._negotiated.set_result(version)
+            return
+        if data[:len(LAYOUT_MAGIC)] == LAYOUT_MAGIC and self.flags & PROTOCOL_FLAG_LAYOUT:
+            if not self._negotiated.done():
+                try:
+                    self.layout = parse_layout(data)
+                except ValueError:
+                    self.datagrams_invalid += 1
+                    return
+                self.frame_size = self.layout.frame_size
+                self._negotiated.set_result(self.version)
+            return
+        if self.version is None or self.version < 2 or not self._negotiated.done():
+            self.datagrams_invalid += 1
+            return
+        if self.decoder is not None:
+            valid = COMPACT_HEADER.size <= len(data) <= COMPACT_MAX_FRAME_SIZE
+        else:
+            valid = len(data) == self.frame_size
+        if not valid:
+            self.datagrams_invalid += 1
+            return
+        # compact frames start with the same sequence number and sender clock
+        if not self.sequence_tracker.update(FRAME_HEADER.unpack_from(data)[0]):
+            self.frames_stale += 1
+            return
+        if self.decoder is not None:
+            frame = bytearray(self.frame_size)
+            try:
+                decoded = self.decoder.decode(data, frame)
+            except ValueError:
+                self.datagrams_invalid += 1
+                return
+            if not decoded:
+                return
+            data = frame
+        self.frames_received += 1
+        if len(self._ready) >= self.max_pending:
+            self._ready.popleft()
+            self._ready_times.popleft()
+            self.frames_dropped += 1
+        self._ready.append(data)
+        self._ready_times.append(0.0 if start is None else time.perf_counter() - start)
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def error_received(self, exc):
+        # e.g. ICMP port unreachable while nothing listens on the server port
+        self._fail(exc)
+
+    def connection_lost(self, exc):
+        if self._request_handle is not None:
+            self._request_handle.cancel()
+        self._fail(exc or ConnectionResetError("Datagram endpoint closed"))
+        if self._closed is not None and not self._closed.done():
+            self._closed.set_result(None)
+
+    def _fail(self, exc):
+        if self._exception is None:
+            self._exception = exc
+        if self._negotiated is not None and not self._negotiated.done():
+            self._negotiated.set_exception(exc)
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def _timed_out(self):
+        self._fail(ConnectionAbortedError("No datagrams for %.1f s" % self.timeout))
+
+    async def read_frame(self):
+        # timed out by a timer failing the protocol rather than asyncio.wait_for, which before
+        # Python 3.12 can swallow a cancel that arrives as the wait ends
+        while not self._ready:
+            if self._exception is not None:
+                raise self._exception
+            loop = asyncio.get_event_loop()
+            self._waiter = loop.create_future()
+            timer = loop.call_later(self.timeout, self._timed_out)
+            try:
+                await self._waiter
+            finally:
+                timer.cancel()
+                self._waiter = None
+        self.frame_receive_time = self._ready_times.popleft()
+        return self._ready.popleft()
+
+    async def wait_negotiated(self):
+        return await self._negotiated
+
+    async def wait_closed(self):
+        if self._closed is not None:
+            await self._closed
+
+    def get_stats(self):
+        return {
+            "frames": self.frames_received,
+            "bytes": self.bytes_received,
+            "pending": len(self._ready),
+            "version": self.version,
+            "stale": self.frames_stale,
+            "dropped": self.frames_dropped,
+            "invalid": self.datagrams_invalid,
+            "compact": self.decoder is not None,
+            "layout": self.layout.describe(),
+            "undecodable": self.decoder.frames_undecodable if self.decoder is not None else 0,
+            "bytes_per_frame": self.bytes_received / self.frames_received if self.frames_received else 0.0,
+        }
+
+
+async def open_frame_datagram_endpoint(host, port, max_pending=DEFAULT_QUEUE_SIZE, rcvbuf=DEFAULT_SO_RCVBUF,
+                                       sequence_tracker=None, compact=False):
+    # the UDP counterpart of open_frame_connection; the server has to speak protocol version 2
+    loop = asyncio.get_event_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: FrameDatagramProtocol(
+            max_pending=max_pending, rcvbuf=rcvbuf, sequence_tracker=sequence_tracker, compact=compact
+        ),
+        remote_addr=(host, int(port))
+    )
+    # no asyncio.wait_for here either, see FrameDatagramProtocol.read_frame
+    timer = loop.call_later(
+        DATAGRAM_TIMEOUT, protocol._fail, asyncio.TimeoutError("No ack for %.1f s" % DATAGRAM_TIMEOUT)
+    )
+    try:
+        await protocol.wait_negotiated()
+    except:
+        transport.close()
+        raise
+    finally:
+        timer.cancel()
+    return transport, protocol
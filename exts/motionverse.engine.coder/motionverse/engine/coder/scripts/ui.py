@@ -30,7 +30,7 @@ class UIController:
                         CS_GOTO_BTN_TEXT,width=ui.Percent(10),  style=style_btn_goto_motionverse,alignment=ui.Alignment.RIGHT_CENTER, clicked_fn=self.launch_motionverse_website)
                 
                 with ui.HStack():
-                    # green/red status
+                    # green/yellow/red status
                     with ui.VStack(width=50, alignment=ui.Alignment.TOP):
 
                         self._status_circle = ui.Circle(
@@ -96,6 +96,110 @@ class UIController:
                                 ui.Spacer()
                                 self._selected_rig_label = ui.Label("")
                                 ui.Spacer()
+                        # receive transport selection
+                        with ui.HStack():
+
+                            ui.Label(TRANSPORT_TEXT, width=ui.Percent(20), alignment=ui.Alignment.RIGHT_CENTER)
+
+                            ui.Spacer(width=CS_H_SPACING)
+
+                            with ui.VStack(width=ui.Percent(50)):
+                                ui.Spacer()
+                                self._transport_combo = ui.ComboBox(
+                                    TRANSPORTS.index(self.ext.transport_mode), *TRANSPORT_LABELS, height=0
+                                )
+                                self._transport_combo.model.add_item_changed_fn(self.select_transport)
+                                ui.Spacer()
+                        # compact frame encoding
+                        with ui.HStack():
+
+                            ui.Label(COMPACT_ENCODING_TEXT, width=ui.Percent(20), alignment=ui.Alignment.RIGHT_CENTER)
+
+                            ui.Spacer(width=CS_H_SPACING)
+
+                            with ui.VStack(width=0):
+                                ui.Spacer()
+                                self._compact_encoding_checkbox = ui.CheckBox(width=0, height=0)
+                                self._compact_encoding_checkbox.model.set_value(self.ext.compact_encoding)
+                                self._compact_encoding_checkbox.model.add_value_changed_fn(
+                                    self.toggle_compact_encoding
+                                )
+                                ui.Spacer()
+                        # frame queue policy selection
+                        with ui.HStack():
+
+                            ui.Label(QUEUE_POLICY_TEXT, width=ui.Percent(20), alignment=ui.Alignment.RIGHT_CENTER)
+
+                            ui.Spacer(width=CS_H_SPACING)
+
+                            with ui.VStack(width=ui.Percent(50)):
+                                ui.Spacer()
+                                self._queue_policy_combo = ui.ComboBox(
+                                    QUEUE_POLICIES.index(self.ext.queue_policy), *QUEUE_POLICY_LABELS, height=0
+                                )
+                                self._queue_policy_combo.model.add_item_changed_fn(self.select_queue_policy)
+                                ui.Spacer()
+
+                            ui.Spacer(width=CS_H_SPACING)
+
+                            self._queue_stats_label = ui.Label("")
+                        # jitter buffer delay
+                        with ui.HStack():
+
+                            ui.Label(JITTER_DELAY_TEXT, width=ui.Percent(20), alignment=ui.Alignment.RIGHT_CENTER)
+
+                            ui.Spacer(width=CS_H_SPACING)
+
+                            with ui.VStack(width=ui.Percent(10)):
+                                ui.Spacer()
+                                self._jitter_delay_field = ui.IntField(
+                                    model=ui.SimpleIntModel(int(self.ext.jitter_delay * 1000)), height=0
+                                )
+                                self._jitter_delay_field.model.add_value_changed_fn(self.set_jitter_delay)
+                                ui.Spacer()
+                        # pose smoothing
+                        with ui.HStack():
+
+                            ui.Label(SMOOTHING_TEXT, width=ui.Percent(20), alignment=ui.Alignment.RIGHT_CENTER)
+
+                            ui.Spacer(width=CS_H_SPACING)
+
+                            with ui.VStack(width=0):
+                                ui.Spacer()
+                                self._smoothing_checkbox = ui.CheckBox(width=0, height=0)
+                                self._smoothing_checkbox.model.set_value(self.ext.smoothing_enabled)
+                                self._smoothing_checkbox.model.add_value_changed_fn(self.toggle_smoothing)
+                                ui.Spacer()
+                        # background decode and solve
+                        with ui.HStack():
+
+                            ui.Label(SOLVER_THREAD_TEXT, width=ui.Percent(20), alignment=ui.Alignment.RIGHT_CENTER)
+
+                            ui.Spacer(width=CS_H_SPACING)
+
+                            with ui.VStack(width=0):
+                                ui.Spacer()
+                                self._solver_thread_checkbox = ui.CheckBox(width=0, height=0)
+                                self._solver_thread_checkbox.model.set_value(self.ext.solver_thread)
+                                self._solver_thread_checkbox.model.add_value_changed_fn(self.toggle_solver_thread)
+                                ui.Spacer()
+                        # hot path instrumentation
+                        with ui.HStack():
+
+                            ui.Label(METRICS_TEXT, width=ui.Percent(20), alignment=ui.Alignment.RIGHT_CENTER)
+
+                            ui.Spacer(width=CS_H_SPACING)
+
+                            with ui.VStack(width=0):
+                                ui.Spacer()
+                                self._metrics_checkbox = ui.CheckBox(width=0, height=0)
+                                self._metrics_checkbox.model.set_value(self.ext.metrics_enabled)
+                                self._metrics_checkbox.model.add_value_changed_fn(self.toggle_metrics)
+                                ui.Spacer()
+
+                            ui.Spacer(width=CS_H_SPACING)
+
+                            self._metrics_label = ui.Label("")
                         # start/stop stream buttons
                         with ui.HStack():
 
@@ -119,6 +223,16 @@ class UIController:
                                 style=style_btn_enabled if self.streaming_active else style_btn_disabled,
                             )
 
+                            ui.Spacer(width=CS_H_SPACING)
+
+                            self._record_button = ui.Button(
+                                CS_RECORD_BTN_TEXT,
+                                width=0,
+                                clicked_fn=self.toggle_recording,
+                                enabled=self.streaming_active,
+                                style=style_btn_enabled if self.streaming_active else style_btn_disabled,
+                            )
+
                         ui.Spacer(height=5)
     def shutdown(self):
         self._window.frame.clear()
@@ -127,13 +241,35 @@ class UIController:
     def select_skeleton(self):
         paths = omni.usd.get_context().get_selection().get_selected_prim_paths()
         if paths:
-            path = paths[0]
             try:
-                self.ext.init_skeletons(path)
+                self.ext.init_skeletons(paths)
             except Exception as ex:
                 self._skeleton_to_drive_stringfield.model.set_value(SKEL_INVALID_TEXT)
             self._selected_rig_label.text = self.ext.selected_rig_name or RIG_UNSUPPORTED_TEXT
 
+    def select_queue_policy(self, model, item):
+        index = model.get_item_value_model().as_int
+        self.ext.queue_policy = QUEUE_POLICIES[index]
+
+    def select_transport(self, model, item):
+        index = model.get_item_value_model().as_int
+        self.ext.transport_mode = TRANSPORTS[index]
+
+    def toggle_compact_encoding(self, model):
+        self.ext.compact_encoding = model.as_bool
+
+    def set_jitter_delay(self, model):
+        self.ext.set_jitter_delay(model.as_int / 1000.0)
+
+    def toggle_smoothing(self, model):
+        self.ext.set_smoothing_enabled(model.as_bool)
+
+    def toggle_solver_thread(self, model):
+        self.ext.solver_thread = model.as_bool
+
+    def toggle_metrics(self, model):
+        self.ext.set_metrics_enabled(model.as_bool)
+
     def launch_motionverse_website(self):
         webbrowser.open_new_tab(CS_URL)
 
@@ -143,6 +279,8 @@ class UIController:
             self._start_button.set_style(style_btn_disabled)
             self._stop_button.enabled = True
             self._stop_button.set_style(style_btn_enabled)
+            self._record_button.enabled = True
+            self._record_button.set_style(style_btn_enabled)
         else:
             self._start_button.enabled = self.ext.ready_to_stream
             self._start_button.set_style(
@@ -150,17 +288,34 @@ class UIController:
             )
             self._stop_button.enabled = False
             self._stop_button.set_style(style_btn_disabled)
+            self._record_button.enabled = False
+            self._record_button.set_style(style_btn_disabled)
+        self._record_button.text = CS_STOP_RECORD_BTN_TEXT if self.ext.recording else CS_RECORD_BTN_TEXT
 
-        if self.streaming_active:
+        state = self.ext.session_state
+        if not self.streaming_active or state == SESSION_IDLE:
+            self._status_circle.set_style(style_status_circle_red)
+        elif state == SESSION_STREAMING:
             self._status_circle.set_style(style_status_circle_green)
         else:
-            self._status_circle.set_style(style_status_circle_red)
+            # connecting, or waiting to reconnect
+            self._status_circle.set_style(style_status_circle_yellow)
 
         self._skeleton_to_drive_stringfield.model.set_value(self.ext.target_skeleton_path)
+        self._queue_stats_label.text = "%s, queued %d, dropped %d" % (
+            state, self.ext.queue_depth, self.ext.frames_dropped
+        )
+        if self.ext.metrics_enabled:
+            self._metrics_label.text = self.ext.metrics_summary
     def start_streaming(self):
         self.ext.connect()
     def stop_streaming(self):
         self.ext.disconnect("User cancelled")
+    def toggle_recording(self):
+        if self.ext.recording:
+            self.ext.stop_recording()
+        else:
+            self.ext.start_recording()
 
     @property
     def streaming_active(self):
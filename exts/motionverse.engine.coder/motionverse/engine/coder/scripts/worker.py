@@ -0,0 +1,181 @@
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from .frames import FrameDetections
+from .logs import log_info, log_error
+
+
+#
+# SolvedFrame class
+#
+# One slot of the SolverWorker handoff: a received message, the frame parsed from it and every
+# driver's solved pose, copied out of the solver buffers.
+#
+class SolvedFrame:
+    __slots__ = ("message", "fd", "arrival_time", "poses")
+
+    def __init__(self):
+        self.message = bytearray()
+        self.fd = FrameDetections()
+        self.arrival_time = None
+        self.poses = None
+
+    def store_poses(self, poses):
+        # allocated again once the frame layout or the drivers change what a pose holds
+        if not self._fits(poses):
+            self.poses = [tuple(None if a is None else np.empty_like(a) for a in pose) for pose in poses]
+        for slot, pose in zip(self.poses, poses):
+            for out, a in zip(slot, pose):
+                if a is not None:
+                    out[...] = a
+
+    def _fits(self, poses):
+        if self.poses is None or len(self.poses) != len(poses):
+            return False
+        for slot, pose in zip(self.poses, poses):
+            if len(slot) != len(pose):
+                return False
+            for out, a in zip(slot, pose):
+                if (out is None) != (a is None) or a is not None and out.shape != a.shape:
+                    return False
+        return True
+
+
+#
+# SolverWorker class
+#
+# Decodes and solves frames on a background thread, so the pose math stays off Kit's main
+# thread; the main thread only stages the results and makes the USD calls. Both sides hand
+# over the newest item only: submit() replaces a message the worker has not picked up yet, and
+# solved frames go through a triple buffer, so take() returns the newest finished frame without
+# ever waiting for a solve in progress. numpy releases the GIL for the array math.
+#
+# Drivers must be initialized (init_animation reads the stage) before the first submit().
+#
+class SolverWorker:
+    def __init__(self, session):
+        self.session = session
+        self._lock = threading.Lock()
+        self._frame_ready = threading.Condition(self._lock)
+        self._pending = bytearray()
+        self._pending_time = None
+        self._has_pending = False
+        # triple buffer: the worker fills _back, _ready is the newest finished frame and _front
+        # the one the main thread is staging
+        self._back = SolvedFrame()
+        self._ready = SolvedFrame()
+        self._front = SolvedFrame()
+        self._has_ready = False
+        self._solving = False
+        self._running = False
+        self._thread = None
+        self.frames_submitted = 0
+        self.frames_replaced = 0
+        self.frames_solved = 0
+        self.frames_unused = 0
+
+    @property
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def idle(self):
+        # nothing submitted is left to solve or to take
+        with self._lock:
+            return not (self._has_pending or self._solving or self._has_ready)
+
+    def start(self):
+        # a restarted worker forgets frames from before it was stopped
+        self._has_pending = False
+        self._has_ready = False
+        self._solving = False
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="Motionverse solver %s" % self.session.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        with self._lock:
+            self._running = False
+            self._frame_ready.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def submit(self, message):
+        # copies the message, so a transport buffer can be reused as soon as this returns
+        arrival_time = time.perf_counter()
+        with self._lock:
+            if len(self._pending) != len(message):
+                self._pending = bytearray(len(message))
+            self._pending[:] = message
+            self._pending_time = arrival_time
+            if self._has_pending:
+                self.frames_replaced += 1
+            self._has_pending = True
+            self.frames_submitted += 1
+            self._frame_ready.notify()
+
+    def take(self):
+        # newest solved frame not taken yet, or None; valid until the next call
+        with self._lock:
+            if not self._has_ready:
+                return None
+            self._front, self._ready = self._ready, self._front
+            self._has_ready = False
+        return self._front
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    while self._running and not self._has_pending:
+                        self._frame_ready.wait()
+                    if not self._running:
+                        return
+                    frame = self._back
+                    frame.message, self._pending = self._pending, frame.message
+                    frame.arrival_time = self._pending_time
+                    self._has_pending = False
+                    self._solving = True
+                self._solve(frame)
+                with self._lock:
+                    if self._has_ready:
+                        self.frames_unused += 1
+                    self._back, self._ready = self._ready, frame
+                    self._has_ready = True
+                    self._solving = False
+                    self.frames_solved += 1
+        except:
+            log_error(traceback.format_exc())
+        finally:
+            log_info("Solver worker stopped (%s)" % self.session.name)
+
+    def _solve(self, frame):
+        # frames are timed like on the main thread (StreamSession._frame_time), so the pose
+        # filter and jitter buffer see one clock whichever thread solves
+        metrics = self.session.metrics
+        fd = frame.fd
+        fd.layout = self.session.layout
+        if metrics is None:
+            fd.ParseFromString(frame.message)
+            frame_time = self.session._frame_time(fd, frame.arrival_time)
+            frame.store_poses([driver.solve(fd, frame_time) for driver in self.session.drivers])
+        else:
+            start = time.perf_counter()
+            fd.ParseFromString(frame.message)
+            decoded = time.perf_counter()
+            frame_time = self.session._frame_time(fd, frame.arrival_time)
+            frame.store_poses([driver.solve(fd, frame_time) for driver in self.session.drivers])
+            metrics.add_time("decode", decoded - start)
+            metrics.add_time("solve", time.perf_counter() - decoded)
+
+    def get_stats(self):
+        return {
+            "submitted": self.frames_submitted,
+            "replaced": self.frames_replaced,
+            "solved": self.frames_solved,
+            "unused": self.frames_unused,
+        }
@@ -0,0 +1,53 @@
+import numpy as np
+from pxr import Vt, Sdf
+
+#
+# AnimationWriter class
+#
+# Pushes a solved pose into a UsdSkel.Animation. Attribute handles are resolved once, the root
+# translation is patched into a locally kept translations array instead of being read back from
+# USD, and each commit is wrapped in one Sdf.ChangeBlock so it produces a single change
+# notification. stage() only copies the pose, so several writers can be committed together.
+# Blend shape weights, when the animation drives any, go out in the same change block.
+#
+class AnimationWriter:
+    def __init__(self, skel_anim, root_index, time_code=0):
+        self.skel_anim = skel_anim
+        self.root_index = root_index
+        self.time_code = time_code
+        self.rotations_attr = skel_anim.GetRotationsAttr()
+        self.translations_attr = skel_anim.GetTranslationsAttr()
+        translations = self.translations_attr.Get(time_code)
+        assert translations is not None, "Animation has no translations"
+        self.translations = np.array(translations, dtype=np.float32).reshape(len(translations), 3)
+        self.rotations = None
+        self.blend_shape_weights_attr = skel_anim.GetBlendShapeWeightsAttr()
+        self.blend_shape_weights = None
+        self.dirty = False
+
+    def stage(self, rotations, root_translation, blend_shape_weights=None):
+        if self.rotations is None:
+            self.rotations = np.empty((len(rotations), 4), dtype=np.float32)
+        self.rotations[:] = rotations
+        self.translations[self.root_index] = root_translation
+        if blend_shape_weights is not None:
+            if self.blend_shape_weights is None:
+                self.blend_shape_weights = np.empty(len(blend_shape_weights), dtype=np.float32)
+            self.blend_shape_weights[:] = blend_shape_weights
+        self.dirty = True
+
+    def commit(self, time_code=None):
+        if not self.dirty:
+            return
+        if time_code is None:
+            time_code = self.time_code
+        with Sdf.ChangeBlock():
+            self.translations_attr.Set(Vt.Vec3fArray.FromNumpy(self.translations), time_code)
+            self.rotations_attr.Set(Vt.QuatfArray.FromNumpy(self.rotations), time_code)
+            if self.blend_shape_weights is not None:
+                self.blend_shape_weights_attr.Set(Vt.FloatArray.FromNumpy(self.blend_shape_weights), time_code)
+        self.dirty = False
+
+    def write(self, rotations, root_translation, blend_shape_weights=None, time_code=None):
+        self.stage(rotations, root_translation, blend_shape_weights)
+        self.commit(time_code)